@@ -1,4 +1,5 @@
 import lxml.etree as etree
+from functools import partial
 from flask import Markup
 from flask_nemo.chunker import scheme_chunker, level_grouper
 from flask.ext.nemo import Nemo
@@ -35,6 +36,8 @@ configs = {
         "base_url": "",
         "inventory": "nemo",
         "urls" : Nemo.ROUTES + [("/read/<collection>/<textgroup>/<work>/<version>/<passage_identifier>/<visavis>", "r_double", ["GET"])],
+        # Both versions of r_double are retrieved at the same time
+        "fetch_workers": 4,
         "css": [
             "examples/translations.css"
         ],
@@ -101,10 +104,13 @@ class NemoDouble(Nemo):
         .. todo:: Change text_passage to keep being lxml and make so self.render turn etree element to Markup.
         """
 
-        # Simply call the url of the
-        args = self.r_passage(collection, textgroup, work, version, passage_identifier)
-        # Call with other identifiers and add "visavis_" front of the argument
-        args.update({"visavis_{0}".format(key): value for key, value in self.r_passage(collection, textgroup, work, visavis, passage_identifier).items()})
+        # Simply call the url of the passage and of the visavis passage at the same time
+        args, visavis_args = self.fetch(
+            partial(self.r_passage, collection, textgroup, work, version, passage_identifier),
+            partial(self.r_passage, collection, textgroup, work, visavis, passage_identifier)
+        )
+        # Add "visavis_" front of the arguments of the other identifiers
+        args.update({"visavis_{0}".format(key): value for key, value in visavis_args.items()})
         args["template"] = "double::r_double.html"
         return args
 
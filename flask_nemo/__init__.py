@@ -7,14 +7,26 @@
 """
 
 
+import hashlib
+import json
+import os
 import os.path as op
+import logging
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import jinja2
-from flask import render_template, Blueprint, abort, Markup, send_from_directory, Flask
+from flask import render_template, Blueprint, abort, Markup, send_from_directory, Flask, Response, current_app, \
+    stream_with_context, request, jsonify, g, has_app_context, has_request_context
+from werkzeug.local import LocalProxy
 import MyCapytain.retrievers.cts5
 from MyCapytain.retrievers.proto import CTS as CtsProtoRetriever
 import MyCapytain.resources.texts.tei
 import MyCapytain.resources.texts.api
 import MyCapytain.resources.inventory
+import MyCapytain.common.utils
 from MyCapytain.common.reference import URN
 from lxml import etree
 from copy import deepcopy as copy
@@ -24,7 +36,15 @@ import flask_nemo._data
 import flask_nemo.filters
 from flask_nemo.chunker import default_chunker as __default_chunker__
 from flask_nemo.default import Breadcrumb
+from flask_nemo.plugin import PluginPrototype
 from flask_nemo.common import resource_qualifier, ASSETS_STRUCTURE
+from flask_nemo.retriever import CachedRetriever, CoalescingRetriever
+from flask_nemo.cache import NamespacedCache, make_cache
+from flask_nemo.references import ReferenceTree, make_digest as make_reffs_digest
+from flask_nemo.fragments import FragmentCacheExtension
+from flask_nemo.xslt import StylesheetCache, StylesheetPool, RawXML, tostring as xslt_tostring
+from flask_nemo.inventory import InventoryIndex, CompactInventory, parse_inventory, snapshot_path, save_snapshot, \
+    load_snapshot
 
 
 class Nemo(object):
@@ -39,9 +59,10 @@ class Nemo(object):
     :type retriever: MyCapytain.retrievers.proto.CTS
     :param base_url: Base URL to use when registering the endpoint
     :type base_url: str
-    :param cache: SQLITE cache file name
-    :type base_url: str
-    :param expire: TIme before expiration of cache, default 3600
+    :param cache: Cache in which replies of the API and derived artefacts are kept : a SQLite file name, a directory, \
+    a cache backend or a list of those to use as tiers (See flask_nemo.cache.make_cache)
+    :type cache: str or list or flask_nemo.cache.BaseCache
+    :param expire: Time in seconds before expiration of cached entries, default 3600
     :type expire: int
     :param plugins: List of plugins to connect to the Nemo instance
     :type plugins: list(flask_nemo.plugin.PluginPrototype)
@@ -55,14 +76,42 @@ class Nemo(object):
     :type urls: [(str, str, [str])]
     :param inventory: Default inventory to use
     :type inventory: str
+    :param inventory_ttl: Time in seconds after which the inventory is refreshed in the background. None never refreshes it (Default : None)
+    :type inventory_ttl: int
+    :param inventory_snapshot: Directory where the parsed inventory is stored and read from on startup. Snapshots are keyed by api_url and inventory
+    :type inventory_snapshot: str
+    :param compact_inventory: Keep the inventory as compact records (See flask_nemo.inventory.CompactInventory) instead of MyCapytain objects
+    :type compact_inventory: bool
+    :param cache_timeouts: Time in seconds before expiration of cached entries, per namespace (eg. {"retriever": 600}). Namespaces without timeout use expire
+    :type cache_timeouts: dict
+    :param coalesce: Send identical concurrent requests only once to the API (See flask_nemo.retriever.CoalescingRetriever)
+    :type coalesce: bool
+    :param passage_plus: Retrieve passages with GetPassagePlus, which carries previous and next references, instead of GetPassage followed by GetPrevNextUrn
+    :type passage_plus: bool
+    :param local_prevnext: Compute previous and next passages from the cached references of the text instead of requesting them (See Nemo.reffs_prevnext). Requires a cache
+    :type local_prevnext: bool
+    :param fetch_workers: Number of threads used to run independent API calls concurrently (See Nemo.fetch). None runs them one after the other
+    :type fetch_workers: int
+    :param xslt_processes: Number of worker processes applying XSL transforms (See flask_nemo.xslt.StylesheetPool). None applies them in the thread serving the request
+    :type xslt_processes: int
+    :param xslt_timeout: Time in seconds after which a transform run by a worker process is abandoned and the passage XML is shown instead
+    :type xslt_timeout: float
     :param transform: Dictionary of XSL filepath or transform function where default key is the default applied function
     :type transform: bool|dict
     :param urntransform: Dictionary of urn transform functions where default key is the default applied function
     :type urntransform: bool|dict
-    :param chunker: Dictionary of function to group responses of GetValidReff
+    :param chunker: Dictionary of function to group responses of GetValidReff. Chunkers return or yield (reference, human readable reference) tuples
     :type chunker: {str: function(str, function(int))}
     :param prevnext: Dictionary of function to execute GetPrevNext
     :type prevnext: {str: function(str, function())}
+    :param toc_depth: Number of citation levels of the table of contents rendered on version pages. Passages below them are loaded on demand (See Nemo.r_version_reffs). None renders every passage
+    :type toc_depth: int
+    :param stream: Names of the route functions whose template is sent as a stream while it renders (eg. ["r_version"]). Errors raised after the first bytes are sent truncate the page
+    :type stream: [str]
+    :param page_cache: Names of the route functions whose responses are kept in the cache, with the time in seconds before they expire (eg. {"r_passage": 3600}). None uses the timeout of the "pages" namespace. Requires a cache (See Nemo.cached_route)
+    :type page_cache: {str: int}
+    :param cache_control: Names of the route functions and the Cache-Control header of their responses (eg. {"r_passage": "public, max-age=3600"})
+    :type cache_control: {str: str}
     :param css: Path to additional stylesheets to load
     :type css: [str]
     :param js: Path to additional javascripts to load
@@ -77,9 +126,13 @@ class Nemo(object):
     :type original_breadcrumb: bool
 
     :ivar assets: Dictionary of assets loaded individually
+    :ivar cache: Cache backend built from the cache parameter, None when cache is not set
+    :ivar lang: Lang of the rendered pages
+    :ivar executor: Thread pool used by Nemo.fetch, None when fetch_workers is not set
+    :ivar xslt_pool: Worker processes applying XSL transforms, None when xslt_processes is not set
     :ivar plugins: List of loaded plugins
 
-    .. warning:: Until a C libxslt error is fixed ( https://bugzilla.gnome.org/show_bug.cgi?id=620102 ), it is not possible to use strip spaces in the xslt given to this application. See :ref:`lxml.strip-spaces`
+    .. warning:: Because of a C libxslt error ( https://bugzilla.gnome.org/show_bug.cgi?id=620102 ), stylesheets using strip spaces are applied to a copy of the passage, which costs some time. See :ref:`lxml.strip-spaces`
     """
 
     ROUTES = [
@@ -87,7 +140,8 @@ class Nemo(object):
         ("/read/<collection>", "r_collection", ["GET"]),
         ("/read/<collection>/<textgroup>", "r_texts", ["GET"]),
         ("/read/<collection>/<textgroup>/<work>/<version>", "r_version", ["GET"]),
-        ("/read/<collection>/<textgroup>/<work>/<version>/<passage_identifier>", "r_passage", ["GET"])
+        ("/read/<collection>/<textgroup>/<work>/<version>/<passage_identifier>", "r_passage", ["GET"]),
+        ("/read/<collection>/<textgroup>/<work>/<version>/reffs/<reference>", "r_version_reffs", ["GET"])
     ]
     FILTERS = [
         "f_active_link",
@@ -97,6 +151,7 @@ class Nemo(object):
         "f_group_texts",
         "f_order_text_edition_translation",
         "f_hierarchical_passages",
+        "f_hierarchical_passages_stream",
         "f_is_str",
         "f_i18n_citation_type",
         "f_order_author"
@@ -110,7 +165,11 @@ class Nemo(object):
     def __init__(self, name=None, app=None, api_url="/", retriever=None, base_url="/nemo", cache=None, expire=3600,
                  plugins=None,
                  template_folder=None, static_folder=None, static_url_path=None,
-                 urls=None, inventory=None, transform=None, urntransform=None, chunker=None, prevnext=None,
+                 urls=None, inventory=None, inventory_ttl=None, inventory_snapshot=None,
+                 compact_inventory=False, cache_timeouts=None, coalesce=False,
+                 passage_plus=False, local_prevnext=False, fetch_workers=None, xslt_processes=None, xslt_timeout=30,
+                 transform=None, urntransform=None, chunker=None, prevnext=None, stream=None, toc_depth=None,
+                 page_cache=None, cache_control=None,
                  css=None, js=None, templates=None, statics=None,
                  prevent_plugin_clearing_assets=False,
                  original_breadcrumb=True):
@@ -135,7 +194,14 @@ class Nemo(object):
         if self.api_inventory:
             self.retriever.inventory = self.api_inventory
 
-        self.cache = None
+        self.cache = make_cache(cache)
+        self.expire = expire
+        self.cache_timeouts = cache_timeouts or {}
+        self.__caches = {}
+        if self.cache is not None:
+            self.retriever = CachedRetriever(self.retriever, cache=self.get_cache("retriever"))
+        if coalesce:
+            self.retriever = CoalescingRetriever(self.retriever)
         self.prevent_plugin_clearing_assets = prevent_plugin_clearing_assets
 
         if template_folder:
@@ -165,8 +231,19 @@ class Nemo(object):
         self._filters = copy(Nemo.FILTERS)
         self._filters = [tuple([filt] + [None]) for filt in self._filters]
 
-        # Reusing self._inventory across requests
-        self._inventory = None
+        # Reusing self._inventory and its lookup index across requests
+        self._inventory_index = None
+        self.inventory_ttl = inventory_ttl
+        self.inventory_snapshot = inventory_snapshot
+        self.compact_inventory = compact_inventory
+        self.passage_plus = passage_plus
+        self.local_prevnext = local_prevnext and self.cache is not None
+        self.executor = None
+        if fetch_workers:
+            self.executor = ThreadPoolExecutor(max_workers=fetch_workers)
+        self.__inventory_lock = threading.Lock()
+        self.__inventory_refreshing = False
+        self.__inventory_checked = None
         self.__transform = {
             "default": None
         }
@@ -177,6 +254,13 @@ class Nemo(object):
 
         if isinstance(transform, dict):
             self.__transform.update(transform)
+        self.__stylesheets = StylesheetCache()
+        self.xslt_pool = None
+        if xslt_processes:
+            self.xslt_pool = StylesheetPool(
+                [path for path in self.__transform.values() if isinstance(path, str)],
+                processes=xslt_processes, timeout=xslt_timeout
+            )
 
         if isinstance(urntransform, dict):
             self.__urntransform.update(urntransform)
@@ -186,8 +270,16 @@ class Nemo(object):
         if isinstance(chunker, dict):
             self.chunker.update(chunker)
 
+        self.stream = set(stream or [])
+        self.page_cache = dict(page_cache or {})
+        self.cache_control = dict(cache_control or {})
+        self.lang = "eng"
+        self.toc_depth = toc_depth
+
         self.prevnext = dict()
         self.prevnext["default"] = type(self).default_prevnext
+        if self.local_prevnext:
+            self.prevnext["default"] = self.reffs_prevnext
         if isinstance(prevnext, dict):
             self.prevnext.update(prevnext)
 
@@ -252,11 +344,20 @@ class Nemo(object):
 
         self.register()
 
+    def close(self):
+        """ Stop the worker processes applying XSL transforms and the thread pool of Nemo.fetch
+
+        .. note:: To be called when the application shuts down. Transforms and fetches are not available afterwards
+        """
+        if self.xslt_pool is not None:
+            self.xslt_pool.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
     def transform(self, work, xml):
         """ Transform input according to potentiallyregistered XSLT
 
-        .. note:: Due to XSLT not being able to be used twice, we rexsltise the xml at every call of xslt
-        .. warning:: Until a C libxslt error is fixed ( https://bugzilla.gnome.org/show_bug.cgi?id=620102 ), it is not possible to use strip tags in the xslt given to this application
+        .. note:: XSL files are compiled once per thread and recompiled when they are modified (See flask_nemo.xslt.StylesheetCache)
 
         :param work: Work object containing metadata about the xml
         :type work: MyCapytains.resources.inventory.Text
@@ -273,9 +374,10 @@ class Nemo(object):
 
         # If we have a string, it means we get a XSL filepath
         if isinstance(func, str):
-            with open(func) as f:
-                xslt = etree.XSLT(etree.parse(f))
-            return etree.tostring(xslt(xml), encoding=str, method="html", xml_declaration=None, pretty_print=False, with_tail=True, standalone=None)
+            if self.xslt_pool is not None:
+                return self.xslt_pool.transform(func, xml)
+            xslt = self.__stylesheets.get(func)
+            return xslt_tostring(xslt(xml))
 
         # If we have a function, it means we return the result of the function
         elif isinstance(func, Callable):
@@ -284,6 +386,21 @@ class Nemo(object):
         elif func is None:
             return etree.tostring(xml, encoding=str)
 
+    def transform_identity(self, urn):
+        """ Identify the transformation applied to the passages of a text, as used in cache keys
+
+        :param urn: URN of the text
+        :type urn: str
+        :return: XSL path and modification time, function name or "xml" when passages are not transformed
+        :rtype: str
+        """
+        func = self.__transform.get(str(urn), self.__transform["default"])
+        if isinstance(func, str):
+            return "{0}@{1}".format(func, os.stat(func).st_mtime)
+        elif func is None:
+            return "xml"
+        return "{0}.{1}".format(func.__module__, getattr(func, "__qualname__", func.__name__))
+
     def transform_urn(self, urn):
         """ Transform urn according to configurable function
 
@@ -305,31 +422,210 @@ class Nemo(object):
         # If we have None, it means we just give back the urn as string
         return urn
 
+    @property
+    def _inventory(self):
+        """ Inventory currently in use, shortcut to the inventory of the current index
+
+        :rtype: MyCapytain.resources.inventory.TextInventory
+        """
+        if self._inventory_index is not None:
+            return self._inventory_index.inventory
+
+    @_inventory.setter
+    def _inventory(self, inventory):
+        if inventory is None:
+            self._inventory_index = None
+        else:
+            self._inventory_index = InventoryIndex(inventory)
+        self.__inventory_checked = time.time()
+
     def get_inventory(self):
         """ Request the api endpoint to retrieve information about the inventory
 
         :return: The text inventory
         :rtype: MyCapytain.resources.inventory.TextInventory
         """
-        if self._inventory:
-            return self._inventory
+        return self.get_inventory_index().inventory
+
+    def get_cache(self, namespace):
+        """ Retrieve the cache used for a type of artefact
+
+        :param namespace: Name of the type of artefact (eg. "retriever" for the replies of the API)
+        :type namespace: str
+        :return: Cache of the namespace, None when Nemo has no cache
+        :rtype: flask_nemo.cache.NamespacedCache
+        """
+        if self.cache is None:
+            return None
+        if namespace not in self.__caches:
+            self.__caches[namespace] = NamespacedCache(
+                self.cache, namespace, timeout=self.cache_timeouts.get(namespace, self.expire)
+            )
+        return self.__caches[namespace]
+
+    def cache_stats(self):
+        """ Lookup metrics of the namespaces of the cache
 
+        :return: Dictionary of namespaces and their metrics (hits, misses and ratio)
+        :rtype: {str: dict}
+        """
+        return {namespace: cache.stats for namespace, cache in self.__caches.items()}
+
+    def fetch(self, *calls):
+        """ Run independent calls (eg. to the retriever) concurrently in the thread pool of Nemo
+
+        The first call is run in the current thread. Calls which no worker started by the time their result is \
+        needed are run in the current thread as well, so that fetch can be used from inside a fetched call without \
+        exhausting the pool. Calls run in the pool are outside of the Flask request context.
+
+        :param calls: Functions without arguments to run (See functools.partial)
+        :type calls: function
+        :return: Results of the calls, in the order of the calls
+        :rtype: list
+        :raises: The exception raised by the first failing call
+
+        :Example:
+            >>>    edition, passage = nemo.fetch(
+            >>>        partial(nemo.get_text, "latinLit", "phi1294", "phi002", "perseus-lat2"),
+            >>>        partial(nemo.get_passage, "latinLit", "phi1294", "phi002", "perseus-lat2", "1.pr")
+            >>>    )
+        """
+        if self.executor is None or len(calls) < 2:
+            return [call() for call in calls]
+
+        futures = [self.executor.submit(call) for call in calls[1:]]
+        try:
+            results = [calls[0]()]
+            for call, future in zip(calls[1:], futures):
+                if future.cancel():
+                    results.append(call())
+                else:
+                    results.append(future.result())
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+        return results
+
+    def get_inventory_index(self):
+        """ Retrieve the lookup index of the inventory, loading the inventory if necessary
+
+        .. note:: When inventory_snapshot is set, the first call loads the snapshot instead of requesting the API. \
+        The inventory is requested when the snapshot is missing or invalid. Otherwise, the snapshot is served and \
+        is revalidated by a background thread only when it is stale : once when inventory_ttl is not set, when \
+        it is older than inventory_ttl otherwise (See Nemo.refresh_inventory).
+
+        .. note:: When inventory_ttl is set and expired, the current index is still returned while a background \
+        thread refreshes it (See Nemo.refresh_inventory). The age of a snapshot counts towards this expiration.
+
+        :return: Case-normalized index of the inventory
+        :rtype: flask_nemo.inventory.InventoryIndex
+        """
+        index, snapshot = self._inventory_index, False
+        if index is None:
+            with self.__inventory_lock:
+                if self._inventory_index is None:
+                    index = self.load_inventory_snapshot()
+                    snapshot = index is not None
+                    if index is None:
+                        index = self.fetch_inventory()
+                        self.save_inventory_snapshot(index)
+                    self.__inventory_checked = index.fetched
+                    self._inventory_index = index
+                index = self._inventory_index
+        if (snapshot and self.inventory_ttl is None) or (
+            self.inventory_ttl is not None and time.time() - self.__inventory_checked > self.inventory_ttl
+        ):
+            self.refresh_inventory(background=True)
+        return index
+
+    def fetch_inventory(self, current=None):
+        """ Retrieve and parse the inventory from the API, without touching the inventory in use
+
+        :param current: Index to revalidate. If the API reply did not change since it was built, it is returned \
+        with an updated fetch time instead of parsing the reply again
+        :type current: flask_nemo.inventory.InventoryIndex
+        :return: Index of the freshly retrieved inventory
+        :rtype: flask_nemo.inventory.InventoryIndex
+        """
         reply = self.retriever.getCapabilities(inventory=self.api_inventory)
-        inventory = MyCapytain.resources.inventory.TextInventory(resource=reply)
-        self._inventory = inventory
-        return self._inventory
+        digest = InventoryIndex.make_digest(reply)
+        if current is not None and current.digest == digest:
+            current.fetched = time.time()
+            return current
+        return parse_inventory(reply, compact=self.compact_inventory, digest=digest)
+
+    def load_inventory_snapshot(self):
+        """ Load the inventory snapshot of this instance, if any
+
+        :return: Index stored in the snapshot, None if snapshots are disabled, missing or invalid
+        :rtype: flask_nemo.inventory.InventoryIndex
+        """
+        if not self.inventory_snapshot:
+            return None
+        index = load_snapshot(snapshot_path(self.inventory_snapshot, self.api_url, self.api_inventory))
+        if index is not None and isinstance(index.inventory, CompactInventory) != bool(self.compact_inventory):
+            index = None
+        if index is None:
+            logging.getLogger(__name__).info("No valid inventory snapshot found, requesting the API")
+        return index
+
+    def save_inventory_snapshot(self, index):
+        """ Store an inventory index as the snapshot of this instance, if snapshots are enabled
+
+        :param index: Index to store
+        :type index: flask_nemo.inventory.InventoryIndex
+        """
+        if not self.inventory_snapshot:
+            return None
+        try:
+            save_snapshot(index, snapshot_path(self.inventory_snapshot, self.api_url, self.api_inventory))
+        except Exception:
+            logging.getLogger(__name__).exception("Inventory snapshot could not be written")
+
+    def refresh_inventory(self, background=False):
+        """ Retrieve the inventory again and swap it with the one in use once parsed
+
+        Requests keep being served from the current inventory until the new one is ready. Only one refresh runs at \
+        a time : a refresh requested while another one is running is ignored.
+
+        :param background: Run the refresh in a daemon thread instead of the calling one
+        :type background: bool
+        :return: Thread running the refresh if it was started in background, None otherwise
+        :rtype: threading.Thread
+        """
+        with self.__inventory_lock:
+            if self.__inventory_refreshing:
+                return None
+            self.__inventory_refreshing = True
+
+        if background:
+            thread = threading.Thread(target=self.__refresh_inventory, name="nemo-inventory-refresh")
+            thread.daemon = True
+            thread.start()
+            return thread
+        self.__refresh_inventory()
+
+    def __refresh_inventory(self):
+        """ Refresh the inventory in use. Errors are logged and the inventory in use is kept.
+        """
+        try:
+            index = self.fetch_inventory(current=self._inventory_index)
+            self._inventory_index = index
+            self.save_inventory_snapshot(index)
+        except Exception:
+            logging.getLogger(__name__).exception("Inventory refresh failed, keeping the current inventory")
+        finally:
+            self.__inventory_checked = time.time()
+            self.__inventory_refreshing = False
 
     def get_collections(self):
         """ Filter inventory and make a list of available collections
 
-        :return: A set of CTS Namespaces
-        :rtype: set(str)
+        :return: CTS Namespaces, sorted so that pages listing them do not depend on the hash seed of the process
+        :rtype: [str]
         """
-        inventory = self.get_inventory()
-        urns = set(
-            [inventory.textgroups[textgroup].urn.namespace for textgroup in inventory.textgroups]
-        )
-        return urns
+        return sorted(self.get_inventory_index().namespaces)
 
     def get_textgroups(self, collection_urn=None):
         """ Retrieve textgroups
@@ -339,10 +635,10 @@ class Nemo(object):
         :return: List of textgroup filtered by collection
         :rtype: [MyCapytain.resources.inventory.Textgroup]
         """
-        inventory = self.get_inventory()
+        index = self.get_inventory_index()
         if collection_urn is not None:
-            return Nemo.map_urns(inventory, collection_urn, 2, "textgroups")
-        return list(inventory.textgroups.values())
+            return list(index.collections.get(collection_urn.lower().strip(), []))
+        return list(index.textgroups)
 
     def get_works(self, collection_urn=None, textgroup_urn=None):
         """ Retrieve works
@@ -355,15 +651,11 @@ class Nemo(object):
         :rtype: [MyCapytain.resources.inventory.Work]
         """
         if collection_urn is not None and textgroup_urn is not None:
-            textgroup = list(
-                filter(lambda x: Nemo.filter_urn(x, 3, textgroup_urn), self.get_textgroups(collection_urn))
+            return list(
+                self.get_inventory_index().works.get(InventoryIndex.normalize(collection_urn, textgroup_urn), [])
             )
-            if len(textgroup) == 1:
-                return textgroup[0].works.values()
-            else:
-                return []
         elif collection_urn is None and textgroup_urn is None:
-            return [work for textgroup in self.get_inventory().textgroups.values() for work in textgroup.works.values()]
+            return [work for works in self.get_inventory_index().works.values() for work in works]
         else:
             raise ValueError("Get_Work takes either two None value or two set up value")
 
@@ -380,26 +672,20 @@ class Nemo(object):
         :rtype: [MyCapytain.resources.inventory.Text]
         """
         if collection_urn is not None and textgroup_urn is not None and work_urn is not None:
-            work = list(
-                filter(lambda x: Nemo.filter_urn(x, 4, work_urn), self.get_works(collection_urn, textgroup_urn))
+            return list(
+                self.get_inventory_index().texts.get(
+                    InventoryIndex.normalize(collection_urn, textgroup_urn, work_urn), []
+                )
             )
-            if len(work) == 1:
-                return work[0].texts.values()
-            else:
-                return []
         elif collection_urn is not None and textgroup_urn is not None and work_urn is None:
+            index = self.get_inventory_index()
             return [
                 text
                 for work in self.get_works(collection_urn, textgroup_urn)
-                for text in work.texts.values()
+                for text in index.texts[str(work.urn).lower()]
             ]
         elif collection_urn is None and textgroup_urn is None and work_urn is None:
-            return [
-                text
-                for textgroup in self.get_inventory().textgroups.values()
-                for work in textgroup.works.values()
-                for text in work.texts.values()
-            ]
+            return [text for texts in self.get_inventory_index().texts.values() for text in texts]
         else:
             raise ValueError("Get_Work takes either two None value or two set up value")
 
@@ -417,17 +703,9 @@ class Nemo(object):
         :return: A Text represented by the various parameters
         :rtype: MyCapytain.resources.inventory.Text
         """
-        work = list(
-            filter(lambda x: Nemo.filter_urn(x, 4, work_urn), self.get_works(collection_urn, textgroup_urn))
-        )
-        if len(work) == 1:
-            texts = work[0].texts.values()
-        else:
-            texts = []
-
-        texts = [text for text in texts if text.urn.version == version_urn]
-        if len(texts) == 1:
-            return texts[0]
+        text = self.get_inventory_index().get(collection_urn, textgroup_urn, work_urn, version_urn)
+        if text is not None:
+            return text
         abort(404)
 
     def get_reffs(self, collection, textgroup, work, version):
@@ -448,16 +726,90 @@ class Nemo(object):
         :rtype: (MyCapytains.resources.texts.api.Text, lambda: [str])
         """
         text = self.get_text(collection, textgroup, work, version)
-        reffs = MyCapytain.resources.texts.api.Text(
-            "urn:cts:{0}:{1}.{2}.{3}".format(collection, textgroup, work, version),
-            self.retriever,
-            citation=text.citation
-        )
-        return text, lambda level: reffs.getValidReff(level=level)
+        urn = "urn:cts:{0}:{1}.{2}.{3}".format(collection, textgroup, work, version)
+        return text, self.make_reffs_callback(urn, text.citation)
 
-    def get_passage(self, collection, textgroup, work, version, passage_identifier):
-        """ Retrieve the passage identified by the parameters
+    def make_reffs_callback(self, urn, citation):
+        """ Build the callback retrieving the references of a text at a given level (See Nemo.get_valid_reff)
+
+        When references are read from the reference tree of the text, the callback has a reference_tree attribute \
+        returning the tree (See Nemo.get_reference_tree)
+
+        :param urn: URN of the text
+        :type urn: str
+        :param citation: Citation scheme of the text
+        :type citation: MyCapytain.resources.inventory.Citation
+        :return: Callback taking a level parameter and returning a list of passage URNs
+        :rtype: function
+        """
+        def reffs(level):
+            return self.get_valid_reff(urn, level, citation=citation)
+
+        if self.cache is not None and citation is not None and len(citation) > 0:
+            reffs.reference_tree = lambda: self.get_reference_tree(urn, citation)
+        return reffs
+
+    def get_valid_reff(self, urn, level, citation=None):
+        """ Retrieve the references of a text at a given citation level
+
+        When Nemo has a cache and the citation scheme is known, levels are read from the reference tree of the text \
+        (See Nemo.get_reference_tree). Otherwise, reference lists are kept in the "reffs" namespace, keyed by text \
+        URN and level
+
+        :param urn: URN of the text
+        :type urn: str
+        :param level: Citation level
+        :type level: int
+        :param citation: Citation scheme of the text
+        :type citation: MyCapytain.resources.inventory.Citation
+        :return: List of passage URNs
+        :rtype: [str]
+        """
+        cache, key = self.get_cache("reffs"), "{0}|{1}".format(urn, level)
+        if cache is not None and citation is not None and 0 < level <= len(citation):
+            return self.get_reference_tree(urn, citation).urns(level)
+
+        reffs = None
+        if cache is not None:
+            reffs = cache.get(key)
+        if reffs is None:
+            reffs = [
+                str(reff) for reff in MyCapytain.resources.texts.api.Text(
+                    urn, self.retriever, citation=citation
+                ).getValidReff(level=level)
+            ]
+            if cache is not None:
+                cache.set(key, reffs)
+        return list(reffs)
+
+    def get_reference_tree(self, urn, citation):
+        """ Retrieve the tree of the references of a text, built from a single GetValidReff at its deepest level
 
+        When Nemo has a cache, trees are kept in the "reffs" namespace, keyed by text URN
+
+        :param urn: URN of the text
+        :type urn: str
+        :param citation: Citation scheme of the text
+        :type citation: MyCapytain.resources.inventory.Citation
+        :rtype: flask_nemo.references.ReferenceTree
+        """
+        cache, key = self.get_cache("reffs"), "{0}|tree".format(urn)
+        tree = None
+        if cache is not None:
+            tree = cache.get(key)
+        if tree is None:
+            depth = len(citation)
+            tree = ReferenceTree(
+                urn,
+                MyCapytain.resources.texts.api.Text(urn, self.retriever, citation=citation).getValidReff(level=depth),
+                depth
+            )
+            if cache is not None:
+                cache.set(key, tree)
+        return tree
+
+    def get_passage(self, collection, textgroup, work, version, passage_identifier, plus=False, siblings=False):
+        """ Retrieve the passage identified by the parameters
 
         :param collection: Collection identifier
         :type collection: str
@@ -469,6 +821,12 @@ class Nemo(object):
         :type version: str
         :param passage_identifier: Reference Identifier
         :type passage_identifier: str
+        :param plus: Use GetPassagePlus : previous and next references as well as the metadata of the text are read \
+        from the same reply
+        :type plus: bool
+        :param siblings: Retrieve previous and next references with GetPrevNextUrn concurrently to GetPassage \
+        (See Nemo.fetch)
+        :type siblings: bool
         :return: A Passage object containing informations about the passage
         :rtype: MyCapytain.resources.texts.api.Passage
         """
@@ -476,6 +834,20 @@ class Nemo(object):
             "urn:cts:{0}:{1}.{2}.{3}".format(collection, textgroup, work, version),
             self.retriever
         )
+        if plus:
+            return text.getPassagePlus(passage_identifier)
+        elif siblings:
+            urn = "{0}:{1}".format(text.urn, passage_identifier)
+            reply, prevnext = self.fetch(
+                partial(self.retriever.getPassage, urn=urn),
+                partial(self.retriever.getPrevNextUrn, urn=urn)
+            )
+            # Siblings are added to the passage reply, where MyCapytain reads them as in a GetPassagePlus reply
+            reply = MyCapytain.common.utils.xmlparser(reply)
+            reply.xpath("//ti:reply", namespaces=MyCapytain.common.utils.NS)[0].extend(
+                MyCapytain.common.utils.xmlparser(prevnext).xpath("//ti:prevnext", namespaces=MyCapytain.common.utils.NS)
+            )
+            return MyCapytain.resources.texts.api.Passage(urn=urn, resource=reply, parent=text)
         passage = text.getPassage(passage_identifier)
         return passage
 
@@ -534,11 +906,94 @@ class Nemo(object):
             }
         """
         version, reffs = self.get_reffs(collection, textgroup, work, version)
+        citation = [level for level in version.citation]
+        if self.toc_depth and self.toc_depth < len(citation):
+            tree = self.get_reference_tree(str(version.urn), version.citation)
+            return {
+                "template": "main::version.html",
+                "version": version,
+                "reffs": [
+                    (reference, "%{}|{}%".format(citation[self.toc_depth - 1].name, reference.split(".")[-1]))
+                    for reference in tree.level(self.toc_depth)
+                ],
+                "lazy": True
+            }
+
         reffs = self.chunk(version, reffs)
+        if self.cache is None:
+            return {
+                "template": "main::version.html",
+                "version": version,
+                "reffs": reffs
+            }
         return {
             "template": "main::version.html",
             "version": version,
-            "reffs": reffs
+            "reffs": reffs,
+            "hierarchy": self.get_hierarchy(version, reffs)
+        }
+
+    def get_hierarchy(self, text, reffs):
+        """ Compute the citation hierarchy of chunked references, as the events of the hierarchical_passages_stream \
+        filter (See flask_nemo.filters.f_hierarchical_passages_stream)
+
+        When Nemo has a cache, hierarchies are kept in the "hierarchies" namespace, keyed by text URN and chunks
+
+        :param text: Text object from which comes the references
+        :type text: MyCapytains.resources.inventory.Text
+        :param reffs: Chunked references (See Nemo.chunk)
+        :type reffs: [(str, str)]
+        :return: Events opening and closing citation levels around passages
+        :rtype: [(str, str, str)]
+        """
+        cache, key = self.get_cache("hierarchies"), None
+        if cache is not None:
+            key = "{0}|{1}".format(text.urn, make_reffs_digest(["{0}\t{1}".format(*reff) for reff in reffs]))
+            hierarchy = cache.get(key)
+            if hierarchy is not None:
+                return hierarchy
+
+        hierarchy = list(flask_nemo.filters.f_hierarchical_passages_stream(reffs, text))
+        if cache is not None:
+            cache.set(key, hierarchy)
+        return hierarchy
+
+    def r_version_reffs(self, collection, textgroup, work, version, reference):
+        """ Passages of a text below a reference, as loaded on demand by version pages (See toc_depth parameter)
+
+        The "format" query parameter selects the response : "fragment" for the HTML of the table of contents \
+        below the reference, "json" for its chunks. Otherwise, a version page restricted to the reference is rendered.
+
+        :param collection: Collection identifier
+        :type collection: str
+        :param textgroup: Textgroup Identifier
+        :type textgroup: str
+        :param work: Work identifier
+        :type work: str
+        :param version: Version identifier
+        :type version: str
+        :param reference: Reference of the passage whose children are requested (eg. "1.pr")
+        :type reference: str
+        :return: Template, version inventory object and chunks below the reference
+        :rtype: {str: Any}
+        """
+        version, reffs = self.get_reffs(collection, textgroup, work, version)
+        prefix = reference + "."
+        reffs = [
+            (chunk, label) for chunk, label in self.chunk(version, reffs)
+            if chunk.split("-")[0] == reference or chunk.startswith(prefix)
+        ]
+        if len(reffs) == 0:
+            abort(404)
+
+        output = request.args.get("format")
+        if output == "json":
+            return jsonify(urn=str(version.urn), reference=reference, reffs=reffs)
+        return {
+            "template": "main::reffs.html" if output == "fragment" else "main::version.html",
+            "version": version,
+            "reffs": reffs,
+            "depth": len(reference.split(".")) if output == "fragment" else 0
         }
 
     def r_passage(self, collection, textgroup, work, version, passage_identifier):
@@ -556,20 +1011,46 @@ class Nemo(object):
         :type passage_identifier: str
         :return: Template, version inventory object and Markup object representing the text
         :rtype: {str: Any}
+
+        .. note:: When Nemo has a cache, the transformed passage and its siblings are kept in the "passages" \
+        namespace, keyed by passage URN, transformation (See Nemo.transform_identity) and inventory version
         """
+        # The text is looked up in the local inventory first, so that unknown texts do not reach the API
         edition = self.get_text(collection, textgroup, work, version)
-        text = self.get_passage(collection, textgroup, work, version, passage_identifier)
+        cache, key, cached = self.get_cache("passages"), None, None
+        if cache is not None:
+            key = "urn:cts:{0}:{1}.{2}.{3}:{4}|{5}|{6}".format(
+                collection, textgroup, work, version, passage_identifier,
+                self.transform_identity("urn:cts:{0}:{1}.{2}.{3}".format(collection, textgroup, work, version)),
+                self.get_inventory_index().digest
+            )
+            cached = cache.get(key)
+
+        if cached is None:
+            text = self.get_passage(
+                collection, textgroup, work, version, passage_identifier,
+                plus=self.passage_plus,
+                siblings=self.executor is not None and not self.passage_plus and not self.local_prevnext
+            )
+
+            passage = self.transform(edition, text.xml)
+            if self.passage_plus:
+                callback = lambda: (text.prev, text.next)
+            else:
+                callback = Nemo.prevnext_callback_generator(text)
+            prev, next = self.getprevnext(text, callback)
+            cached = {"text_passage": str(passage), "urn": self.transform_urn(text.urn), "prev": prev, "next": next}
+            # Passages whose transformation did not complete are not kept
+            if cache is not None and not isinstance(passage, RawXML):
+                cache.set(key, cached)
 
-        passage = self.transform(edition, text.xml)
-        prev, next = self.getprevnext(text, Nemo.prevnext_callback_generator(text))
-        urn = self.transform_urn(text.urn)
         return {
             "template": "main::text.html",
             "version": edition,
-            "text_passage": Markup(passage),
-            "urn": urn,
-            "prev": prev,
-            "next": next
+            "text_passage": Markup(cached["text_passage"]),
+            "urn": cached["urn"],
+            "prev": cached["prev"],
+            "next": cached["next"]
         }
 
     def r_assets(self, type, asset):
@@ -626,6 +1107,10 @@ class Nemo(object):
         self.register_assets()
         self.register_filters()
 
+        # Templates of this blueprint cache their fragments in the cache of this instance
+        self.app.jinja_env.add_extension(FragmentCacheExtension)
+        self.app.jinja_env.nemo_fragments[self.blueprint.name] = self
+
         # We extend the loading list by the instance value
         self.__templates_namespaces__.extend(self.__instance_templates__)
         # We generate a template loader
@@ -655,33 +1140,93 @@ class Nemo(object):
         else:
             return lambda **kwargs: self.route(getattr(self, name), **kwargs)
 
-    def render(self, template, **kwargs):
+    def render(self, template, stream=False, **kwargs):
         """ Render a route template and adds information to this route.
 
         :param template: Template name.
         :type template: str
+        :param stream: Send the template as a stream while it renders
+        :type stream: bool
         :param kwargs: dictionary of named arguments used to be passed to the template
         :type kwargs: dict
         :return: Http Response with rendered template
         :rtype: flask.Response
         """
 
-        kwargs["collections"] = self.get_collections()
-        kwargs["lang"] = "eng"
+        kwargs["collections"] = self.render_context("get_collections")
+        kwargs["lang"] = self.lang
 
         if Nemo.in_and_not_in("textgroup", "textgroups", kwargs):
-            kwargs["textgroups"] = self.get_textgroups(kwargs["url"]["collection"])
+            kwargs["textgroups"] = self.render_context("get_textgroups", kwargs["url"]["collection"])
 
             if Nemo.in_and_not_in("text", "texts", kwargs):
-                kwargs["texts"] = self.get_texts(kwargs["url"]["collection"], kwargs["url"]["textgroup"])
+                kwargs["texts"] = self.render_context(
+                    "get_texts", kwargs["url"]["collection"], kwargs["url"]["textgroup"]
+                )
 
         kwargs["assets"] = self.assets
 
         for plugin in self.__plugins_render_views__:
             kwargs.update(plugin.render(**kwargs))
 
+        if stream:
+            current_app.update_template_context(kwargs)
+            return Response(stream_with_context(
+                current_app.jinja_env.get_or_select_template(template).generate(kwargs)
+            ))
         return render_template(template, **kwargs)
 
+    def render_context(self, name, *args):
+        """ Lazy value of the render context : the method is called the first time a template or a plugin reads the \
+        value, and its result is kept for the rest of the request (on flask.g) so that other renders and plugins \
+        reuse it
+
+        :param name: Name of the Nemo method computing the value (eg. "get_textgroups")
+        :type name: str
+        :param args: Arguments of the method
+        :return: Proxy to the result of the method
+        :rtype: werkzeug.local.LocalProxy
+        """
+        key = (id(self), name) + args
+        local = {}
+
+        def value():
+            memo = g.setdefault("nemo_render_context", {}) if has_app_context() else local
+            if key not in memo:
+                memo[key] = getattr(self, name)(*args)
+            return memo[key]
+
+        return LocalProxy(value)
+
+    def cache_fragment(self, parts, render, timeout=None):
+        """ Retrieve a fragment of template from the cache or render it (See flask_nemo.fragments)
+
+        .. note:: Fragments are kept in the "fragments" namespace, keyed by the given values, the root URL of the \
+        request, the blueprint and URL prefix of the instance and the inventory version
+
+        :param parts: Values identifying the fragment (eg. name of the fragment, collection and lang)
+        :type parts: list
+        :param render: Function rendering the fragment
+        :type render: function
+        :param timeout: Time in seconds before the fragment expires. None for the timeout of the namespace
+        :type timeout: int
+        :return: Rendered fragment
+        :rtype: str
+        """
+        cache = self.get_cache("fragments")
+        if cache is None:
+            return render()
+
+        key = "|".join(
+            [str(part) for part in parts] +
+            [request.script_root, str(request.blueprint), self.prefix, str(self.get_inventory_index().digest)]
+        )
+        fragment = cache.get(key)
+        if fragment is None:
+            fragment = str(render())
+            cache.set(key, fragment, timeout=timeout)
+        return fragment
+
     def route(self, fn, **kwargs):
         """ Route helper : apply fn function but keep the calling object, *ie* kwargs, for other functions
 
@@ -692,14 +1237,129 @@ class Nemo(object):
         :return: HTTP Response with rendered template
         :rtype: flask.Response
         """
+        if self.page_cacheable(fn):
+            return self.cached_route(fn, **kwargs)
+
         new_kwargs = fn(**kwargs)
 
         # If there is no templates, we assume that the response is finalized :
         if not isinstance(new_kwargs, dict):
-            return new_kwargs
+            return self.make_conditional(fn, new_kwargs)
 
         new_kwargs["url"] = kwargs
-        return self.render(**new_kwargs)
+        if getattr(fn, "__name__", None) in self.stream:
+            new_kwargs.setdefault("stream", True)
+        return self.make_conditional(fn, self.render(**new_kwargs))
+
+    def make_conditional(self, fn, response):
+        """ Add validators and caching headers to the response of a route and answer conditional requests
+
+        Complete responses with a 200 status get a strong ETag computed from their content, unless they already \
+        have one. When the validators of the request (If-None-Match, If-Modified-Since) match the response, it is \
+        turned into a 304 Not Modified without body. The Cache-Control header of the route, if any, is set (See \
+        the cache_control parameter of Nemo).
+
+        .. note:: Outside of a request, the response is returned as is
+
+        :param fn: Route function
+        :type fn: function
+        :param response: Response or return value of a route which Flask can convert to a response
+        :return: HTTP Response
+        :rtype: flask.Response
+        """
+        if not has_request_context():
+            return response
+
+        response = current_app.make_response(response)
+        name = getattr(fn, "__name__", None)
+        if name in self.cache_control:
+            response.headers["Cache-Control"] = self.cache_control[name]
+        if response.status_code == 200 and not response.is_streamed:
+            if response.get_etag()[0] is None:
+                response.add_etag()
+            response.make_conditional(request)
+        return response
+
+    def page_cacheable(self, fn):
+        """ Check if the responses of a route function can be kept in the cache
+
+        Responses are cached when Nemo has a cache, when the function is listed in page_cache, for GET and HEAD \
+        requests, and when neither the plugin owning the route nor any plugin augmenting the render is declared \
+        as non cacheable (See PluginPrototype.CACHEABLE)
+
+        :param fn: Route function
+        :type fn: function
+        :rtype: bool
+        """
+        if self.cache is None or getattr(fn, "__name__", None) not in self.page_cache:
+            return False
+        if request.method not in ("GET", "HEAD"):
+            return False
+        instance = getattr(fn, "__self__", None)
+        if isinstance(instance, PluginPrototype) and not instance.cacheable:
+            return False
+        return all(plugin.cacheable for plugin in self.__plugins_render_views__)
+
+    def page_key(self, fn, kwargs):
+        """ Build the key of the cached response of a route
+
+        .. note:: Keys change with the inventory version and, on routes of a text, with its transformation \
+        (See Nemo.transform_identity) : cached pages are invalidated when either changes
+
+        :param fn: Route function
+        :type fn: function
+        :param kwargs: Parsed url arguments
+        :type kwargs: dict
+        :rtype: str
+        """
+        transform = None
+        if "version" in kwargs:
+            transform = self.transform_identity("urn:cts:{collection}:{textgroup}.{work}.{version}".format(**kwargs))
+        return json.dumps([
+            request.endpoint, sorted(kwargs.items()), sorted(request.args.items(multi=True)), self.lang,
+            request.script_root, self.get_inventory_index().digest, transform
+        ])
+
+    def cached_route(self, fn, **kwargs):
+        """ Route helper keeping the response of fn in the "pages" namespace of the cache (See Nemo.page_cacheable)
+
+        .. note:: Only complete responses with a 200 status which do not depend on cookies are cached. Cached \
+        routes are not streamed. Cached responses keep their ETag and, as Last-Modified, the time they were \
+        rendered : conditional requests on cached pages are answered without rendering (See Nemo.make_conditional)
+
+        :param fn: Function to run the route with
+        :type fn: function
+        :param kwargs: Parsed url arguments
+        :type kwargs: dict
+        :return: HTTP Response, from the cache when available
+        :rtype: flask.Response
+        """
+        cache, key = self.get_cache("pages"), self.page_key(fn, kwargs)
+        cached = cache.get(key)
+        if cached is not None:
+            return self.make_conditional(
+                fn, Response(cached["data"], status=cached["status"], headers=cached["headers"])
+            )
+
+        new_kwargs = fn(**kwargs)
+        if isinstance(new_kwargs, dict):
+            new_kwargs["url"] = kwargs
+            new_kwargs["stream"] = False
+            new_kwargs = self.render(**new_kwargs)
+
+        response = current_app.make_response(new_kwargs)
+        if response.status_code == 200 and not response.is_streamed and "Set-Cookie" not in response.headers \
+                and "Cookie" not in response.vary:
+            if response.get_etag()[0] is None:
+                response.add_etag()
+            if response.last_modified is None:
+                response.last_modified = time.time()
+            cache.set(
+                key,
+                {"data": response.get_data(), "status": response.status_code, "headers": list(response.headers)},
+                timeout=self.page_cache[fn.__name__]
+            )
+        return self.make_conditional(fn, response)
 
     def register(self):
         """ Register the app using Blueprint
@@ -771,12 +1431,170 @@ class Nemo(object):
         :type text: MyCapytains.resources.texts.api.Text
         :param reffs: Callback function to retrieve a list of string with a level parameter
         :type reffs: callback(level)
-        :return: Transformed list of references
-        :rtype: [str]
+        :return: Transformed list of references. Chunkers may return a generator, which is then given as is to the \
+        template and consumed while it renders
+        :rtype: [(str, str)] or iterator((str, str))
+
+        .. note:: When Nemo has a cache, chunks are kept in the "chunks" namespace, keyed by text URN and chunker \
+        (See Nemo.chunker_identity). They are computed again when the references they come from change : chunks \
+        of references read from the reference tree of the text are checked against the digest of the tree, other \
+        chunks against a digest of their references. Chunkers which can not be identified are not cached.
+        """
+        entry = self.chunk_entry(text, reffs)
+        if entry is None:
+            return self.chunker.get(str(text.urn), self.chunker["default"])(text, reffs)
+        return list(entry["chunks"])
+
+    def chunk_entry(self, text, reffs):
+        """ Retrieve the cached chunks of a text or compute them (See Nemo.chunk)
+
+        :param text: Text object from which comes the references
+        :type text: MyCapytains.resources.texts.api.Text
+        :param reffs: Callback function to retrieve a list of string with a level parameter
+        :type reffs: callback(level)
+        :return: Cache entry with the chunks and the position of each chunk by reference, None when Nemo has no \
+        cache or when the chunker can not be identified (See Nemo.chunker_identity)
+        :rtype: {"chunks": [(str, str)], "positions": {str: int}}
+
+        .. note:: The entry is shared with the cache and must not be modified
         """
-        if str(text.urn) in self.chunker:
-            return self.chunker[str(text.urn)](text, reffs)
-        return self.chunker["default"](text, reffs)
+        chunker = self.chunker.get(str(text.urn), self.chunker["default"])
+        cache = self.get_cache("chunks")
+        if cache is None:
+            return None
+
+        identity = self.chunker_identity(str(text.urn))
+        if identity is None:
+            return None
+        key = "{0}|{1}".format(text.urn, identity)
+        cached = cache.get(key)
+        reference_tree = getattr(reffs, "reference_tree", None)
+        if cached is not None:
+            if cached["tree"]:
+                valid = reference_tree is not None and cached["digest"] == reference_tree().digest
+            else:
+                valid = cached["digest"] == make_reffs_digest(
+                    [reff for level in cached["levels"] for reff in reffs(level=level)]
+                )
+            if valid:
+                return cached
+
+        # Levels requested by the chunker and their references identify the reference lists the chunks come from
+        levels, requested, trees = [], [], set()
+
+        def recorded(level):
+            references = reffs(level=level)
+            levels.append(level)
+            requested.extend(references)
+            trees.add(getattr(getattr(references, "tree", None), "digest", None))
+            return references
+
+        chunks = list(chunker(text, recorded))
+        entry = {
+            "levels": levels, "tree": False, "digest": None, "chunks": chunks,
+            "positions": {chunk[0]: index for index, chunk in reversed(list(enumerate(chunks)))}
+        }
+        if reference_tree is not None and levels and len(trees) == 1 and None not in trees:
+            entry["tree"], entry["digest"] = True, trees.pop()
+        else:
+            entry["digest"] = make_reffs_digest(requested)
+        cache.set(key, entry)
+        return entry
+
+    def chunker_identity(self, urn):
+        """ Identify the chunker applied to the references of a text and its parameters, as used in cache keys
+
+        :param urn: URN of the text
+        :type urn: str
+        :return: Identity of the chunker (See Nemo.identify), None when it can not be identified
+        :rtype: str
+
+        .. note:: Parameters are read from partial functions, bound instances, defaults, variables of closures and \
+        the constants of the code (eg. groupby in `lambda x, y: level_grouper(x, y, groupby=30)`). Chunkers \
+        depending on other state should be distinct functions or define a cache_key attribute
+        """
+        return Nemo.identify(self.chunker.get(str(urn), self.chunker["default"]))
+
+    @staticmethod
+    def identify(value, seen=()):
+        """ Represent a value in the same way in every process, so that it can be used in persistent cache keys
+
+        - Objects with a cache_key attribute are identified by their type and this attribute
+        - Strings, bytes, numbers, None, and tuples and frozensets of them are identified by their repr
+        - Classes and builtin functions are identified by their module and name
+        - Partial functions, bound methods and functions are identified by the function, the digest of its code \
+        and the values bound to it : arguments, instance, defaults and variables of closures
+
+        Other values, such as objects using the default repr which contains their address in memory, can not be \
+        identified.
+
+        :param value: Value to identify
+        :param seen: Identifiers of the functions being identified, to stop on recursive closures
+        :type seen: tuple
+        :return: Identity of the value, None if it can not be identified
+        :rtype: str
+        """
+        cache_key = getattr(value, "cache_key", None)
+        if cache_key is not None:
+            return "{0}.{1}[{2}]".format(type(value).__module__, type(value).__qualname__, cache_key)
+        elif isinstance(value, (str, bytes, int, float, type(None))):
+            return repr(value)
+        elif isinstance(value, (tuple, frozenset)):
+            members = [Nemo.identify(member, seen) for member in value]
+            if None in members:
+                return None
+            if isinstance(value, frozenset):
+                # Order of sets depends on the hash seed
+                members = sorted(members)
+            return "{0}({1})".format(type(value).__name__, ",".join(members))
+        elif isinstance(value, type) or (
+            isinstance(value, types.BuiltinFunctionType) and
+            (value.__self__ is None or isinstance(value.__self__, types.ModuleType))
+        ):
+            return "{0}.{1}".format(value.__module__, value.__qualname__)
+        elif id(value) in seen:
+            return "{0}.{1}".format(getattr(value, "__module__", None), getattr(value, "__qualname__", None))
+
+        seen = seen + (id(value), )
+        if isinstance(value, partial):
+            parts = [value.func, value.args, tuple(sorted((value.keywords or {}).items()))]
+        elif isinstance(value, types.MethodType):
+            parts = [value.__func__, value.__self__]
+        elif isinstance(value, types.FunctionType):
+            parts = [
+                value.__defaults__, tuple(sorted((value.__kwdefaults__ or {}).items())),
+                tuple(cell.cell_contents for cell in value.__closure__ or ())
+            ]
+        else:
+            return None
+
+        parts = [Nemo.identify(part, seen) for part in parts]
+        if None in parts:
+            return None
+        if isinstance(value, types.FunctionType):
+            parts.extend([str(value.__code__.co_firstlineno), Nemo.code_digest(value.__code__)])
+            return "{0}.{1}({2})".format(value.__module__, value.__qualname__, ",".join(parts))
+        return "{0}({1})".format(type(value).__name__, ",".join(parts))
+
+    @staticmethod
+    def code_digest(code):
+        """ Compute the digest of compiled code, its names and its constants, including nested functions
+
+        :param code: Code object of a function
+        :type code: code
+        :return: Hexadecimal SHA1 digest
+        :rtype: str
+        """
+        digest = hashlib.sha1(code.co_code)
+        digest.update(repr(code.co_names).encode("utf-8"))
+        for const in code.co_consts:
+            if isinstance(const, type(code)):
+                const = Nemo.code_digest(const)
+            elif isinstance(const, frozenset):
+                # Order of sets depends on the hash seed
+                const = sorted(repr(item) for item in const)
+            digest.update(repr(const).encode("utf-8"))
+        return digest.hexdigest()
 
     def getprevnext(self, passage, callback):
         """ Retrieve previous and next passage using
@@ -830,6 +1648,42 @@ class Nemo(object):
             following = str(following.reference)
         return previous, following
 
+    def reffs_prevnext(self, passage, callback):
+        """ Deliver prevnext informations computed from the cached references of the text, without requesting the API
+
+        Neighbours of a passage are found in the chunked references of its text (See Nemo.chunk) or, when the passage \
+        is not a chunk, in the references of its citation level, with the same number of references for ranges \
+        (See Nemo.get_reference_tree). Passages of unknown texts or references fall back to Nemo.default_prevnext
+
+        :param passage: Passage for which to get previous and following reference
+        :type passage: MyCapytain.resources.texts.api.Passage
+        :param callback: Function to retrieve those information from the API
+        :type callback: function
+
+        :return: Tuple representing previous and following reference
+        :rtype: (str, str)
+        """
+        urn, neighbours = URN(str(passage.urn)), None
+        text = self.get_inventory_index().get(urn.namespace, urn.textgroup, urn.work, urn.version)
+        if self.cache is not None and text is not None and urn.reference is not None:
+            text_urn = str(urn.upTo(URN.NO_PASSAGE))
+            entry, index = self.chunk_entry(text, self.make_reffs_callback(text_urn, text.citation)), None
+            if entry is not None:
+                chunks, index = entry["chunks"], entry["positions"].get(str(urn.reference))
+            if index is not None:
+                neighbours = (
+                    chunks[index - 1][0] if index > 0 else None,
+                    chunks[index + 1][0] if index + 1 < len(chunks) else None
+                )
+            else:
+                end = urn.reference.end
+                neighbours = self.get_reference_tree(text_urn, text.citation).neighbours(
+                    str(urn.reference.start), str(end) if end is not None else None
+                )
+        if neighbours is None:
+            return Nemo.default_prevnext(passage, callback)
+        return neighbours
+
     @staticmethod
     def prevnext_callback_generator(passage):
         """ Default callback generator to retrieve prev and next value of a passage
@@ -933,7 +1787,10 @@ def cmd():
 
         # We run the app
         app.debug = args.debug
-        app.run(port=args.port, host=args.host)
+        try:
+            app.run(port=args.port, host=args.host)
+        finally:
+            nemo.close()
 
 if __name__ == "__main__":
     cmd()
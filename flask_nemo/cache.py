@@ -0,0 +1,517 @@
+# -*- coding: utf-8 -*-
+"""
+    Cache backends shared by Nemo to keep API replies and the artefacts derived from them.
+
+    Backends follow the interface of werkzeug.contrib.cache : any werkzeug cache (Redis, Memcached, etc.) can be used \
+    as a tier of a TieredCache. As in werkzeug, None can not be cached as it is the value returned on cache miss, \
+    and a timeout of 0 means that the entry never expires.
+"""
+
+import hashlib
+import os
+import os.path as op
+import pickle
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class BaseCache(object):
+    """ Prototype for cache backends
+
+    :param default_timeout: Timeout used when set() is called without timeout. 0 for entries which never expire
+    :type default_timeout: int
+    """
+    def __init__(self, default_timeout=0):
+        self.default_timeout = default_timeout
+
+    def expires(self, timeout=None):
+        """ Compute the expiration timestamp of an entry
+
+        :param timeout: Timeout in seconds, None for the default timeout
+        :type timeout: int
+        :return: Expiration timestamp, 0 when the entry never expires
+        :rtype: float
+        """
+        if timeout is None:
+            timeout = self.default_timeout
+        if not timeout:
+            return 0
+        return time.time() + timeout
+
+    @staticmethod
+    def expired(expires):
+        """ Check if an expiration timestamp is in the past
+
+        :param expires: Expiration timestamp (See BaseCache.expires)
+        :type expires: float
+        :rtype: bool
+        """
+        return expires != 0 and expires <= time.time()
+
+    def get(self, key):
+        """ Retrieve a value
+
+        :param key: Key of the entry
+        :type key: str
+        :return: Value of the entry, None if it does not exist or expired
+        """
+        raise NotImplementedError()
+
+    def set(self, key, value, timeout=None):
+        """ Store a value
+
+        :param key: Key of the entry
+        :type key: str
+        :param value: Value to store
+        :param timeout: Timeout in seconds, None for the default timeout, 0 for no expiration
+        :type timeout: int
+        """
+        raise NotImplementedError()
+
+    def delete(self, key):
+        """ Remove an entry
+
+        :param key: Key of the entry
+        :type key: str
+        """
+        raise NotImplementedError()
+
+    def clear(self):
+        """ Remove every entry
+        """
+        raise NotImplementedError()
+
+    def delete_prefix(self, prefix):
+        """ Remove every entry whose key starts with a prefix
+
+        :param prefix: Prefix of the keys to remove
+        :type prefix: str
+        """
+        raise NotImplementedError()
+
+
+def sizeof(value):
+    """ Approximate the size in memory of a cached value
+
+    :param value: Cached value
+    :return: Size in bytes of the value and of the members of its tuples, lists and dictionaries
+    :rtype: int
+    """
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(sizeof(member) for member in value)
+    elif isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sizeof(key) + sizeof(member) for key, member in value.items())
+    return sys.getsizeof(value)
+
+
+class LRUCache(BaseCache):
+    """ Bounded in-process cache dropping the least recently used entries first
+
+    .. note:: Values are stored as is : they are shared by every reader and should not be modified.
+
+    :param max_entries: Maximum number of entries kept
+    :type max_entries: int
+    :param default_timeout: Timeout used when set() is called without timeout
+    :type default_timeout: int
+    :param max_size: Maximum size in bytes of the entries kept (See sizeof). None for no limit
+    :type max_size: int
+
+    :ivar size: Size in bytes of the entries kept
+    :type size: int
+    """
+    def __init__(self, max_entries=1024, default_timeout=0, max_size=None):
+        super(LRUCache, self).__init__(default_timeout=default_timeout)
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.size = 0
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __remove(self, key):
+        entry = self.__entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+    def get(self, key):
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                return None
+            if BaseCache.expired(entry[0]):
+                self.__remove(key)
+                return None
+            self.__entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, timeout=None):
+        size = sizeof(value)
+        with self.__lock:
+            self.__remove(key)
+            if self.max_size is not None and size > self.max_size:
+                return
+            self.__entries[key] = (self.expires(timeout), value, size)
+            self.size += size
+            while len(self.__entries) > self.max_entries or \
+                    (self.max_size is not None and self.size > self.max_size):
+                self.__remove(next(iter(self.__entries)))
+
+    def delete(self, key):
+        with self.__lock:
+            self.__remove(key)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.size = 0
+
+    def delete_prefix(self, prefix):
+        with self.__lock:
+            for key in [key for key in self.__entries if key.startswith(prefix)]:
+                self.__remove(key)
+
+
+class SQLiteCache(BaseCache):
+    """ Persistent cache stored in a SQLite database using Write-Ahead Logging, shareable between processes
+
+    :param path: Path of the SQLite database
+    :type path: str
+    :param default_timeout: Timeout used when set() is called without timeout
+    :type default_timeout: int
+    """
+    def __init__(self, path, default_timeout=0):
+        super(SQLiteCache, self).__init__(default_timeout=default_timeout)
+        self.path = path
+        self.__local = threading.local()
+        with self.connection as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS nemo_cache (key TEXT PRIMARY KEY, expires REAL, value BLOB)"
+            )
+
+    @property
+    def connection(self):
+        """ Connection to the database for the current thread
+
+        :rtype: sqlite3.Connection
+        """
+        connection = getattr(self.__local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self.__local.connection = connection
+        return connection
+
+    def get(self, key):
+        row = self.connection.execute("SELECT expires, value FROM nemo_cache WHERE key = ?", (key, )).fetchone()
+        if row is None:
+            return None
+        if BaseCache.expired(row[0]):
+            self.delete(key)
+            return None
+        return pickle.loads(row[1])
+
+    def set(self, key, value, timeout=None):
+        with self.connection as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO nemo_cache (key, expires, value) VALUES (?, ?, ?)",
+                (key, self.expires(timeout), sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)))
+            )
+
+    def delete(self, key):
+        with self.connection as connection:
+            connection.execute("DELETE FROM nemo_cache WHERE key = ?", (key, ))
+
+    def clear(self):
+        with self.connection as connection:
+            connection.execute("DELETE FROM nemo_cache")
+
+    def delete_prefix(self, prefix):
+        with self.connection as connection:
+            connection.execute("DELETE FROM nemo_cache WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+
+
+class FileSystemCache(BaseCache):
+    """ Persistent cache storing each entry in its own file, shareable between processes
+
+    Each file holds the pickled key of the entry followed by its pickled expiration timestamp and value, so that \
+    keys can be read back without loading the values (See FileSystemCache.delete_prefix).
+
+    :param directory: Directory where entries are stored
+    :type directory: str
+    :param default_timeout: Timeout used when set() is called without timeout
+    :type default_timeout: int
+    """
+    EXTENSION = ".nemocache"
+
+    def __init__(self, directory, default_timeout=0):
+        super(FileSystemCache, self).__init__(default_timeout=default_timeout)
+        self.directory = directory
+        if not op.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, key):
+        """ Path of the file storing an entry
+
+        :param key: Key of the entry
+        :type key: str
+        :rtype: str
+        """
+        return op.join(self.directory, hashlib.sha1(key.encode("utf-8")).hexdigest() + FileSystemCache.EXTENSION)
+
+    def get(self, key):
+        try:
+            with open(self.path(key), "rb") as f:
+                if pickle.load(f) != key:
+                    return None
+                expires, value = pickle.load(f)
+        except (IOError, OSError, EOFError, ValueError, TypeError, pickle.UnpicklingError):
+            return None
+        if BaseCache.expired(expires):
+            self.delete(key)
+            return None
+        return value
+
+    def set(self, key, value, timeout=None):
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as f:
+                pickle.dump(key, f, pickle.HIGHEST_PROTOCOL)
+                pickle.dump((self.expires(timeout), value), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, self.path(key))
+        except Exception:
+            if op.exists(temporary):
+                os.remove(temporary)
+            raise
+
+    def delete(self, key):
+        FileSystemCache.delete_path(self.path(key))
+
+    def clear(self):
+        for filename in os.listdir(self.directory):
+            if filename.endswith(FileSystemCache.EXTENSION):
+                os.remove(op.join(self.directory, filename))
+
+    def delete_prefix(self, prefix):
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(FileSystemCache.EXTENSION):
+                continue
+            path = op.join(self.directory, filename)
+            try:
+                with open(path, "rb") as f:
+                    key = pickle.load(f)
+            except (IOError, OSError, EOFError, pickle.UnpicklingError):
+                continue
+            # Files written without their key can not be read anymore (See FileSystemCache.get)
+            if not isinstance(key, str) or key.startswith(prefix):
+                FileSystemCache.delete_path(path)
+
+    @staticmethod
+    def delete_path(path):
+        """ Remove the file of an entry, if it still exists
+
+        :param path: Path of the file
+        :type path: str
+        """
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class TieredCache(BaseCache):
+    """ Cache looking up entries in its tiers from the first (fastest) to the last (slowest)
+
+    Entries are written to every tier. An entry found in a lower tier is copied to the upper ones for the time it \
+    has left to live. Expiration timestamps are computed by the TieredCache from the default timeout of each tier, \
+    so that werkzeug caches can be used as tiers. As werkzeug caches can not enumerate their keys, they are \
+    cleared entirely by delete_prefix.
+
+    :param tiers: Caches used as tiers, from L1 to Ln
+    :type tiers: BaseCache or werkzeug.contrib.cache.BaseCache
+    """
+    def __init__(self, *tiers):
+        super(TieredCache, self).__init__()
+        self.tiers = tiers
+
+    def get(self, key):
+        for level, tier in enumerate(self.tiers):
+            entry = tier.get(key)
+            if entry is None:
+                continue
+            expires, value = entry
+            if BaseCache.expired(expires):
+                tier.delete(key)
+                continue
+            for upper in self.tiers[:level]:
+                upper.set(key, entry, timeout=TieredCache.remaining(expires))
+            return value
+        return None
+
+    def set(self, key, value, timeout=None):
+        for tier in self.tiers:
+            expires = TieredCache.tier_expires(tier, timeout)
+            tier.set(key, (expires, value), timeout=TieredCache.remaining(expires))
+
+    def delete(self, key):
+        for tier in self.tiers:
+            tier.delete(key)
+
+    def clear(self):
+        for tier in self.tiers:
+            tier.clear()
+
+    def delete_prefix(self, prefix):
+        for tier in self.tiers:
+            delete_prefix = getattr(tier, "delete_prefix", None)
+            if delete_prefix is None:
+                tier.clear()
+            else:
+                delete_prefix(prefix)
+
+    @staticmethod
+    def tier_expires(tier, timeout=None):
+        """ Compute the expiration timestamp of an entry in a tier
+
+        :param tier: Tier in which the entry is written
+        :type tier: BaseCache or werkzeug.contrib.cache.BaseCache
+        :param timeout: Timeout in seconds, None for the default timeout of the tier
+        :type timeout: int
+        :return: Expiration timestamp, 0 when the entry never expires
+        :rtype: float
+        """
+        if timeout is None:
+            timeout = getattr(tier, "default_timeout", 0)
+        if not timeout:
+            return 0
+        return time.time() + timeout
+
+    @staticmethod
+    def remaining(expires):
+        """ Compute the timeout matching an expiration timestamp
+
+        :param expires: Expiration timestamp
+        :type expires: float
+        :return: Remaining time in seconds, 0 for entries which never expire
+        :rtype: float
+        """
+        if expires == 0:
+            return 0
+        return max(expires - time.time(), 0.001)
+
+
+class NamespacedCache(BaseCache):
+    """ View of a cache restricted to one type of artefact, with its own timeout
+
+    :param cache: Cache in which entries are stored
+    :type cache: BaseCache
+    :param namespace: Name of the type of artefact, used as a key prefix
+    :type namespace: str
+    :param timeout: Timeout of the entries of this namespace, None for the timeout of the cache
+    :type timeout: int
+
+    :ivar hits: Number of lookups which found an entry
+    :type hits: int
+    :ivar misses: Number of lookups which did not find an entry
+    :type misses: int
+    """
+    def __init__(self, cache, namespace, timeout=None):
+        super(NamespacedCache, self).__init__(default_timeout=timeout)
+        self.cache = cache
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def ratio(self):
+        """ Share of lookups which found an entry
+
+        :rtype: float
+        """
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.0
+        return self.hits / lookups
+
+    @property
+    def stats(self):
+        """ Lookup metrics of the namespace
+
+        :return: Dictionary with hits, misses and ratio
+        :rtype: dict
+        """
+        return {"hits": self.hits, "misses": self.misses, "ratio": self.ratio}
+
+    def key(self, key):
+        """ Prefix a key with the namespace
+
+        :param key: Key of the entry
+        :type key: str
+        :rtype: str
+        """
+        return "{0}:{1}".format(self.namespace, key)
+
+    def get(self, key):
+        value = self.cache.get(self.key(key))
+        with self.__lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value, timeout=None):
+        if timeout is None:
+            timeout = self.default_timeout
+        self.cache.set(self.key(key), value, timeout=timeout)
+
+    def delete(self, key):
+        self.cache.delete(self.key(key))
+
+    def clear(self):
+        """ Remove every entry of the namespace. A werkzeug backend, which can not enumerate its keys, is cleared \
+        entirely
+        """
+        self.delete_prefix("")
+
+    def delete_prefix(self, prefix):
+        delete_prefix = getattr(self.cache, "delete_prefix", None)
+        if delete_prefix is None:
+            self.cache.clear()
+        else:
+            delete_prefix(self.key(prefix))
+
+
+def make_cache(config, default_timeout=0):
+    """ Build a cache from a Nemo cache configuration
+
+    - A string ending with a path separator or pointing to a directory is a FileSystemCache directory
+    - Another string is a SQLite database path, used behind an in-process LRUCache of 64MB at most
+    - A list or tuple is a list of tiers, each of them being a configuration
+    - Anything else is considered as a cache backend and returned as is
+
+    :param config: Cache configuration
+    :type config: str or list or BaseCache
+    :param default_timeout: Default timeout of the backends created from strings
+    :type default_timeout: int
+    :return: Cache backend, None if config is None or empty
+    :rtype: BaseCache
+    """
+    if config is None or config == "":
+        return None
+    elif isinstance(config, str):
+        if config.endswith(os.sep) or op.isdir(config):
+            return FileSystemCache(config, default_timeout=default_timeout)
+        return TieredCache(
+            LRUCache(default_timeout=default_timeout, max_size=64 * 1024 * 1024),
+            SQLiteCache(config, default_timeout=default_timeout)
+        )
+    elif isinstance(config, (list, tuple)):
+        return TieredCache(*[make_cache(tier, default_timeout=default_timeout) for tier in config])
+    return config
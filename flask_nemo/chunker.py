@@ -48,9 +48,20 @@ def line_chunker(text, getreffs, lines=30):
     :type lines: int
     :return: List of grouped urn references with their human readable version
     :rtype: [(str, str)]
+
+    .. note:: References carrying their compact representation (See flask_nemo.references.ReferenceList) are \
+    grouped without building the string of each reference
     """
     level = len(text.citation)
-    source_reffs = [reff.split(":")[-1] for reff in getreffs(level=level)]
+    references = getreffs(level=level)
+    compact = getattr(references, "array", None)
+    if compact is not None:
+        return [
+            (compact.reference(start) + "-" + compact.reference(end - 1), compact.reference(start))
+            for start, end in compact.groups(0, lines)
+        ]
+
+    source_reffs = [reff.split(":")[-1] for reff in references]
     reffs = []
     i = 0
     while i + lines - 1 < len(source_reffs):
@@ -83,11 +94,22 @@ def level_grouper(text, getValidReff, level=None, groupby=20):
     :param level: Level of citation to retrieve
     :param groupby: Number of level to groupby
     :return: Automatically curated references
+
+    .. note:: References carrying their compact representation (See flask_nemo.references.ReferenceList) are \
+    grouped without building the string of each reference
     """
     if level is None or level > len(text.citation):
         level = len(text.citation)
 
-    references = [ref.split(":")[-1] for ref in getValidReff(level=level)]
+    references = getValidReff(level=level)
+    compact = getattr(references, "array", None)
+    if compact is not None:
+        return [
+            tuple([join_or_single(compact.reference(start), compact.reference(end - 1))] * 2)
+            for start, end in compact.groups(level - 1, groupby)
+        ]
+
+    references = [ref.split(":")[-1] for ref in references]
     _refs = OrderedDict()
 
     for key in references:
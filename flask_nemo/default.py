@@ -40,16 +40,18 @@ class Breadcrumb(PluginPrototype):
                 # what we want to display as the crumb title depends upon what it is
                 # in the future, having a common display_name property on the model would be helpful to avoid
                 # this logic here
-                if crumb_type[0] == "textgroup":
-                    # get the groupname of the current textgroup
-                    item = list(filter(lambda textgroup: textgroup.urn.textgroup == kwargs["url"]["textgroup"], kwargs["textgroups"]))
-                    crumb["title"] = item[0].metadata["groupname"][kwargs["lang"]]
-                elif crumb_type[0] == "version":
-                    # get the label of the current version
-                    crumb["title"] = kwargs["version"].metadata["label"][kwargs["lang"]]
-                else:
-                    # for everything else, just use the value as metadata isn't applicable
-                    crumb["title"] = kwargs["url"][crumb_type[0]]
+                # default to the value in the url, as metadata isn't applicable to every crumb
+                crumb["title"] = kwargs["url"][crumb_type[0]]
+                try:
+                    if crumb_type[0] == "textgroup":
+                        # get the groupname of the current textgroup
+                        crumb["title"] = self.textgroup(kwargs).metadata["groupname"][kwargs["lang"]]
+                    elif crumb_type[0] == "version":
+                        # get the label of the current version
+                        crumb["title"] = kwargs["version"].metadata["label"][kwargs["lang"]]
+                except KeyError:
+                    # metadata missing in the language of the page (eg. in a compact inventory) : keep the value
+                    pass
                 # iterate through the crumb types and pull together the args that lead up to this type
                 # so that we can reconstruct the route to just this part of the breadcrumb trail
                 crumb_args = {}
@@ -70,3 +72,22 @@ class Breadcrumb(PluginPrototype):
             breadcrumbs[-1]["link"] = None
 
         return {"breadcrumbs": breadcrumbs}
+
+    def textgroup(self, kwargs):
+        """ Find the textgroup of a route
+
+        The inventory index of Nemo is used when the plugin is registered, so that the textgroups of the route are \
+        not read (and computed, see Nemo.render_context) only for the breadcrumb.
+
+        :param kwargs: dictionary of named arguments used to construct the view
+        :type kwargs: dict
+        :return: Textgroup of the route
+        :rtype: MyCapytain.resources.inventory.TextGroup
+        """
+        if self.nemo is not None:
+            textgroup = self.nemo.get_inventory_index().get(kwargs["url"]["collection"], kwargs["url"]["textgroup"])
+            if textgroup is not None:
+                return textgroup
+        return next(
+            textgroup for textgroup in kwargs["textgroups"] if textgroup.urn.textgroup == kwargs["url"]["textgroup"]
+        )
@@ -10,10 +10,13 @@ def f_order_author(textgroups, lang="eng"):
     :param lang: Language to display
     :return: Sorted list
     """
-    __textgroups__ = {
-        tg.metadata["groupname"][lang] or str(tg.urn): tg
-        for tg in textgroups
-    }
+    __textgroups__ = {}
+    for tg in textgroups:
+        try:
+            name = tg.metadata["groupname"][lang]
+        except KeyError:
+            name = None
+        __textgroups__[name or str(tg.urn)] = tg
 
     return [
        __textgroups__[key]
@@ -134,6 +137,41 @@ def f_hierarchical_passages(reffs, version):
     return d
 
 
+def f_hierarchical_passages_stream(reffs, version, depth=0):
+    """ Iterate over the citation layers of a text as a stream of events, without building the whole hierarchy
+
+    Levels are opened and closed as the parent levels of consecutive passages change : passages sharing parent \
+    levels should be consecutive, as they are in the output of chunkers.
+
+    :param reffs: passage references with human-readable equivalent, as a list or an iterator
+    :type reffs: [(str, str)]
+    :param version: text from which the reference comes
+    :type version: MyCapytain.resources.inventory.Text
+    :param depth: Number of leading citation levels shared by every passage, which are not opened
+    :type depth: int
+    :return: Iterator of ("open", level name, None), ("passage", human-readable reference, reference) and \
+    ("close", None, None) events
+    :rtype: iterator((str, str, str))
+    """
+    levels = [x for x in version.citation]
+    opened = []
+    for cit, name in reffs:
+        ref = cit.split('-')[0]
+        levs = ['%{}|{}%'.format(levels[i].name, v) for i, v in enumerate(ref.split('.'))][depth:-1]
+        common = 0
+        while common < min(len(opened), len(levs)) and opened[common] == levs[common]:
+            common += 1
+        while len(opened) > common:
+            opened.pop()
+            yield "close", None, None
+        for lev in levs[common:]:
+            opened.append(lev)
+            yield "open", lev, None
+        yield "passage", name, cit
+    for _ in opened:
+        yield "close", None, None
+
+
 def f_is_str(value):
     """ Check if object is a string
 
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+    Jinja extension caching fragments of templates in the cache of Nemo
+"""
+
+from flask import request, has_request_context, Markup
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+
+class FragmentCacheExtension(Extension):
+    """ Add a cache tag to Jinja : the body of the tag is rendered once and kept in the cache of the Nemo instance \
+    serving the request (See Nemo.cache_fragment), under the values given to the tag.
+
+    When the request is not served by a Nemo blueprint or when Nemo has no cache, the body is rendered every time.
+
+    :Example:
+        >>> {% cache "menu", url.collection, url.textgroup, lang %}...{% endcache %}
+        >>> {% cache "texts", url.collection, url.textgroup, lang, timeout=600 %}...{% endcache %}
+
+    The optional timeout is given in seconds. Without it, the timeout of the "fragments" namespace of the cache \
+    is used.
+
+    .. note:: The body may only depend on the values of the tag, the inventory and the root URL of the application.
+
+    :ivar environment.nemo_fragments: Nemo instances, by name of their blueprint
+    :type environment.nemo_fragments: {str: flask_nemo.Nemo}
+    """
+    tags = {"cache"}
+
+    def __init__(self, environment):
+        super(FragmentCacheExtension, self).__init__(environment)
+        environment.extend(nemo_fragments={})
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts, timeout = [], nodes.Const(None)
+        first = True
+
+        while parser.stream.current.type != "block_end":
+            if not first:
+                parser.stream.expect("comma")
+            first = False
+            if parser.stream.current.test("name:timeout") and parser.stream.look().test("assign"):
+                parser.stream.skip(2)
+                timeout = parser.parse_expression()
+            else:
+                parts.append(parser.parse_expression())
+
+        if not parts:
+            parser.fail("cache tag requires at least one value to key the fragment", lineno)
+
+        body = parser.parse_statements(["name:endcache"], drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method("_cache", [nodes.List(parts), timeout]), [], [], body
+        ).set_lineno(lineno)
+
+    def _cache(self, parts, timeout, caller):
+        """ Retrieve the body of a cache tag from the cache of Nemo or render it
+
+        :param parts: Values of the tag
+        :type parts: list
+        :param timeout: Time in seconds before the fragment expires
+        :type timeout: int
+        :param caller: Function rendering the body of the tag
+        :type caller: function
+        :rtype: Markup
+        """
+        nemo = None
+        if has_request_context():
+            nemo = self.environment.nemo_fragments.get(request.blueprint)
+        if nemo is None:
+            return caller()
+        return Markup(nemo.cache_fragment(parts, caller, timeout=timeout))
@@ -0,0 +1,527 @@
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+import hashlib
+import os
+import os.path as op
+import pickle
+import tempfile
+import time
+from lxml import etree
+from MyCapytain.common.reference import URN
+from MyCapytain.common.utils import NS
+import MyCapytain.resources.inventory
+
+
+""" Version of the snapshot format. Snapshots written with another version are ignored
+"""
+SNAPSHOT_VERSION = 2
+
+
+class InventoryIndex(object):
+    """ Case-normalized lookup tables over a text inventory, built once when the inventory is loaded
+
+    :param inventory: Text Inventory to index
+    :type inventory: MyCapytain.resources.inventory.TextInventory
+    :param fetched: Timestamp at which the inventory was retrieved from the API (Default : now)
+    :type fetched: float
+    :param digest: Digest of the API reply the inventory was parsed from (See InventoryIndex.make_digest)
+    :type digest: str
+
+    :ivar inventory: Indexed inventory
+    :ivar fetched: Timestamp at which the inventory was retrieved from the API
+    :type fetched: float
+    :ivar digest: Digest of the API reply the inventory was parsed from
+    :type digest: str
+    :ivar namespaces: Set of CTS namespaces (collections) found in the inventory
+    :type namespaces: set(str)
+    :ivar textgroups: Ordered list of every textgroup
+    :type textgroups: [MyCapytain.resources.inventory.TextGroup]
+    :ivar collections: Normalized collection identifier -> list of textgroups
+    :type collections: {str: [MyCapytain.resources.inventory.TextGroup]}
+    :ivar works: Normalized textgroup urn -> list of works
+    :type works: {str: [MyCapytain.resources.inventory.Work]}
+    :ivar texts: Normalized work urn -> list of texts
+    :type texts: {str: [MyCapytain.resources.inventory.Text]}
+    :ivar urns: Normalized full urn -> inventory object
+    :type urns: {str: MyCapytain.resources.proto.inventory.Resource}
+    """
+    def __init__(self, inventory=None, fetched=None, digest=None):
+        self.inventory = inventory
+        self.digest = digest
+        self.fetched = fetched
+        if fetched is None:
+            self.fetched = time.time()
+        self.namespaces = set()
+        self.textgroups = []
+        self.collections = OrderedDict()
+        self.works = dict()
+        self.texts = dict()
+        self.urns = dict()
+
+        if inventory is not None:
+            for textgroup in inventory.textgroups.values():
+                self.add_textgroup(textgroup)
+
+    @staticmethod
+    def make_digest(reply):
+        """ Compute the digest of a GetCapabilities reply
+
+        :param reply: GetCapabilities reply
+        :type reply: str
+        :return: Hexadecimal SHA1 digest of the reply
+        :rtype: str
+        """
+        return hashlib.sha1(reply.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def normalize(*parts):
+        """ Build a normalized urn key from its parts
+
+        :param parts: Parts of the urn (namespace, textgroup, work, version)
+        :type parts: str
+        :return: Lower-cased, stripped urn
+        :rtype: str
+
+        :Example:
+            >>>    InventoryIndex.normalize("greekLIT", "TLG0003 ") == "urn:cts:greeklit:tlg0003"
+        """
+        return "urn:cts:" + ":".join([
+            parts[0].lower().strip(),
+            ".".join([part.lower().strip() for part in parts[1:]])
+        ]).rstrip(":")
+
+    def add_textgroup(self, textgroup):
+        """ Register a textgroup, its works and its texts in the index
+
+        :param textgroup: Textgroup to index
+        :type textgroup: MyCapytain.resources.inventory.TextGroup
+        """
+        namespace = str(textgroup.urn.namespace)
+        self.namespaces.add(namespace)
+        self.textgroups.append(textgroup)
+        self.collections.setdefault(namespace.lower(), []).append(textgroup)
+
+        textgroup_key = str(textgroup.urn).lower()
+        self.urns[textgroup_key] = textgroup
+        self.works[textgroup_key] = list(textgroup.works.values())
+
+        for work in self.works[textgroup_key]:
+            work_key = str(work.urn).lower()
+            self.urns[work_key] = work
+            self.texts[work_key] = list(work.texts.values())
+            for text in self.texts[work_key]:
+                self.urns[str(text.urn).lower()] = text
+
+    def get(self, *parts):
+        """ Retrieve an inventory object given the parts of its urn
+
+        :param parts: Parts of the urn (namespace, textgroup, work, version)
+        :type parts: str
+        :return: Matching inventory object, None if not found
+        """
+        return self.urns.get(InventoryIndex.normalize(*parts))
+
+
+def iter_textgroups(reply, keep=False, chunk_size=65536):
+    """ Parse a GetCapabilities reply incrementally and yield each ti:textgroup node as soon as it is complete
+
+    The reply is fed to the parser chunk by chunk and textgroups already yielded are removed from the tree, so that \
+    the complete tree of the reply never exists in memory.
+
+    :param reply: GetCapabilities reply
+    :type reply: str
+    :param keep: Keep the content of yielded nodes (for objects retaining their node). Otherwise nodes are cleared \
+    once the consumer is done with them
+    :type keep: bool
+    :param chunk_size: Number of characters fed to the parser at once
+    :type chunk_size: int
+    :return: Iterator over ti:textgroup nodes
+    :rtype: iter(lxml.etree._Element)
+    """
+    parser = etree.XMLPullParser(events=("end", ), tag="{http://chs.harvard.edu/xmlns/cts}textgroup")
+    for start in range(0, len(reply), chunk_size):
+        parser.feed(reply[start:start + chunk_size])
+        for node in _release_textgroups(parser, keep):
+            yield node
+    parser.close()
+    for node in _release_textgroups(parser, keep):
+        yield node
+
+
+def _release_textgroups(parser, keep):
+    """ Yield the textgroups parsed so far and remove them from the tree once consumed
+
+    .. note:: Only previous siblings are removed : detaching the node libxml2 is currently working on is unsafe
+
+    :param parser: Parser fed with the reply
+    :type parser: lxml.etree.XMLPullParser
+    :param keep: Keep the content of yielded nodes
+    :type keep: bool
+    """
+    for _, node in parser.read_events():
+        yield node
+        if not keep:
+            node.clear()
+        while node.getprevious() is not None:
+            del node.getparent()[0]
+
+
+def parse_inventory(reply, compact=False, digest=None):
+    """ Parse a GetCapabilities reply incrementally, filling the inventory and its index textgroup by textgroup
+
+    :param reply: GetCapabilities reply
+    :type reply: str
+    :param compact: Build a CompactInventory instead of a MyCapytain TextInventory
+    :type compact: bool
+    :param digest: Digest of the reply (See InventoryIndex.make_digest)
+    :type digest: str
+    :return: Index of the parsed inventory
+    :rtype: InventoryIndex
+    """
+    if compact:
+        inventory = CompactInventory()
+    else:
+        inventory = MyCapytain.resources.inventory.TextInventory()
+    index = InventoryIndex(inventory, digest=digest)
+
+    for node in iter_textgroups(reply, keep=not compact):
+        if compact:
+            textgroup = inventory.make_textgroup(node)
+        else:
+            textgroup = MyCapytain.resources.inventory.TextGroup(
+                resource=node, urn=node.get("urn"), parents=[inventory]
+            )
+        inventory.textgroups[str(textgroup.urn)] = textgroup
+        index.add_textgroup(textgroup)
+    return index
+
+
+def snapshot_path(folder, api_url, inventory=None):
+    """ Compute the path of the snapshot file of an inventory
+
+    :param folder: Directory where snapshots are stored
+    :type folder: str
+    :param api_url: URL of the API Endpoint
+    :type api_url: str
+    :param inventory: Name of the inventory
+    :type inventory: str
+    :return: Path of the snapshot file
+    :rtype: str
+    """
+    key = hashlib.sha1("{0}|{1}".format(api_url, inventory or "").encode("utf-8")).hexdigest()
+    return op.join(folder, "nemo-inventory-{0}.pickle".format(key))
+
+
+def save_snapshot(index, path):
+    """ Serialize an inventory index (and its inventory) to a snapshot file
+
+    .. note:: The file is written next to its destination and then moved, so that concurrent workers never read \
+    a partially written snapshot
+
+    :param index: Index to serialize
+    :type index: InventoryIndex
+    :param path: Path of the snapshot file
+    :type path: str
+    """
+    directory = op.dirname(op.abspath(path))
+    if not op.isdir(directory):
+        os.makedirs(directory)
+    handle, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(handle, "wb") as f:
+            pickle.dump({"version": SNAPSHOT_VERSION, "index": index}, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+    except Exception:
+        if op.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def load_snapshot(path):
+    """ Load an inventory index from a snapshot file
+
+    :param path: Path of the snapshot file
+    :type path: str
+    :return: Index stored in the snapshot, None if the snapshot does not exist or is not valid
+    :rtype: InventoryIndex
+    """
+    if not op.isfile(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            snapshot = pickle.load(f)
+    except Exception:
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION:
+        return None
+    if not isinstance(snapshot.get("index"), InventoryIndex):
+        return None
+    return snapshot["index"]
+
+
+class CompactUrn(object):
+    """ Lightweight URN for compact inventory records, up to the version level
+
+    :param namespace: CTS Namespace
+    :param textgroup: CTS Textgroup
+    :param work: CTS Work
+    :param version: CTS Version
+    """
+    __slots__ = ("namespace", "textgroup", "work", "version")
+
+    urn_namespace = "cts"
+    reference = None
+
+    def __init__(self, namespace, textgroup, work=None, version=None):
+        self.namespace = namespace
+        self.textgroup = textgroup
+        self.work = work
+        self.version = version
+
+    @staticmethod
+    def parse(urn):
+        """ Parse a string urn
+
+        :param urn: URN of a textgroup, a work or a text
+        :type urn: str
+        :rtype: CompactUrn
+        """
+        namespace, identifier = urn.split(":")[2:4]
+        return CompactUrn(namespace, *identifier.split("."))
+
+    def upTo(self, key):
+        """ Returns the urn up to given level, using MyCapytain.common.reference.URN constants
+
+        :param key: Identifier of the wished resource (URN.NAMESPACE, URN.TEXTGROUP, URN.WORK, URN.VERSION)
+        :rtype: str
+        """
+        if key == URN.NAMESPACE:
+            return "urn:cts:{0}".format(self.namespace)
+        parts = [self.textgroup, self.work, self.version][:{URN.TEXTGROUP: 1, URN.WORK: 2}.get(key, 3)]
+        return "urn:cts:{0}:{1}".format(self.namespace, ".".join([part for part in parts if part is not None]))
+
+    def __len__(self):
+        return 3 + len([part for part in (self.work, self.version) if part is not None])
+
+    def __str__(self):
+        return self.upTo(URN.VERSION)
+
+    def __eq__(self, other):
+        return str(self) == str(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(str(self))
+
+
+class CompactMetadatum(object):
+    """ Single-language view of a compact record field, usable like MyCapytain metadatum : record.metadata["title"][lang]
+
+    Only the language kept by the compact inventory is available : other languages raise a KeyError.
+
+    :param value: Value of the field in the language kept by the compact inventory
+    :param lang: Language of the value
+    :type lang: str
+    """
+    __slots__ = ("value", "lang")
+
+    def __init__(self, value, lang=None):
+        self.value = value
+        self.lang = lang
+
+    def __getitem__(self, lang):
+        if self.value is None or lang != self.lang:
+            raise KeyError(lang)
+        return self.value
+
+
+class CompactRecord(object):
+    """ Base class for compact inventory records
+
+    :cvar METADATA: Metadata fields stored by the record
+    """
+    __slots__ = ("urn", "parents")
+    METADATA = ()
+
+    @property
+    def metadata(self):
+        """ Metadata accessor mimicking MyCapytain.common.metadata.Metadata : record.metadata[field][lang]
+
+        :rtype: {str: CompactMetadatum}
+        """
+        return {field: getattr(self, field) for field in type(self).METADATA}
+
+
+class CompactTextGroup(CompactRecord):
+    """ Compact textgroup record
+
+    :ivar urn: URN of the textgroup
+    :ivar groupname: Groupname in the language of the inventory
+    :type groupname: CompactMetadatum
+    :ivar works: Works of the textgroup
+    :type works: OrderedDict
+    """
+    __slots__ = ("groupname", "works")
+    METADATA = ("groupname", )
+
+
+class CompactWork(CompactRecord):
+    """ Compact work record
+
+    :ivar urn: URN of the work
+    :ivar parents: Parent textgroup as a 1-tuple
+    :ivar title: Title in the language of the inventory
+    :type title: CompactMetadatum
+    :ivar lang: Language of the work
+    :ivar texts: Texts of the work
+    :type texts: OrderedDict
+    """
+    __slots__ = ("title", "lang", "texts")
+    METADATA = ("title", )
+
+
+class CompactText(CompactRecord):
+    """ Compact text record
+
+    :ivar urn: URN of the text
+    :ivar parents: Parent work and textgroup
+    :ivar subtype: Edition or Translation
+    :ivar lang: Language of the text
+    :ivar label: Label in the language of the inventory
+    :type label: CompactMetadatum
+    :ivar description: Description in the language of the inventory
+    :type description: CompactMetadatum
+    :ivar citation: Citation scheme, shared between texts with the same scheme. An empty tuple when the text has none
+    :type citation: MyCapytain.resources.inventory.Citation
+    """
+    __slots__ = ("subtype", "lang", "label", "description", "citation")
+    METADATA = ("label", "description")
+
+
+class CompactInventory(object):
+    """ Compact, read-only inventory keeping only the informations Nemo displays
+
+    Textgroups, works and texts are slotted records instead of MyCapytain object graphs : metadata are kept in a \
+    single language, citation schemes are shared between texts and no XML node is retained.
+
+    :param resource: GetCapabilities reply
+    :type resource: str
+    :param lang: Language in which to keep metadata. If a field is not available in this language, the first one \
+    found is kept
+    :type lang: str
+
+    :ivar textgroups: Textgroups of the inventory
+    :type textgroups: OrderedDict
+    """
+    def __init__(self, resource=None, lang="eng"):
+        self.lang = lang
+        self.textgroups = OrderedDict()
+        self.__citations = dict()
+        if resource is not None:
+            self.parse(resource)
+
+    def parse(self, resource):
+        """ Parse a GetCapabilities reply
+
+        :param resource: GetCapabilities reply
+        :type resource: str
+        """
+        for node in iter_textgroups(resource):
+            textgroup = self.make_textgroup(node)
+            self.textgroups[str(textgroup.urn)] = textgroup
+
+    def make_textgroup(self, node):
+        """ Build a textgroup record from a ti:textgroup node
+
+        :param node: ti:textgroup node
+        :type node: lxml.etree._Element
+        :rtype: CompactTextGroup
+        """
+        textgroup = CompactTextGroup()
+        textgroup.urn = CompactUrn.parse(node.get("urn"))
+        textgroup.parents = ()
+        textgroup.groupname = self.localized(node, "ti:groupname")
+        textgroup.works = OrderedDict()
+
+        for work_node in node.xpath("ti:work", namespaces=NS):
+            work = CompactWork()
+            identifier = work_node.get("urn").split(":")[3].split(".")
+            work.urn = CompactUrn(textgroup.urn.namespace, textgroup.urn.textgroup, identifier[1])
+            work.parents = (textgroup, )
+            work.title = self.localized(work_node, "ti:title")
+            work.lang = work_node.get("{http://www.w3.org/XML/1998/namespace}lang")
+            work.texts = OrderedDict()
+            textgroup.works[str(work.urn)] = work
+
+            for text_node in work_node.xpath("ti:edition|ti:translation", namespaces=NS):
+                text = self.make_text(text_node, work)
+                work.texts[str(text.urn)] = text
+        return textgroup
+
+    def make_text(self, node, work):
+        """ Build a text record from a ti:edition or ti:translation node
+
+        :param node: ti:edition or ti:translation node
+        :type node: lxml.etree._Element
+        :param work: Parent work record
+        :type work: CompactWork
+        :rtype: CompactText
+        """
+        text = CompactText()
+        text.urn = CompactUrn(
+            work.urn.namespace, work.urn.textgroup, work.urn.work, node.get("urn").split(":")[3].split(".")[2]
+        )
+        text.parents = (work, work.parents[0])
+        text.lang = work.lang
+        text.subtype = "Edition"
+        if node.tag == "{http://chs.harvard.edu/xmlns/cts}translation":
+            text.subtype = "Translation"
+            text.lang = node.get("{http://www.w3.org/XML/1998/namespace}lang") or work.lang
+        text.label = self.localized(node, "ti:label")
+        text.description = self.localized(node, "ti:description")
+
+        scheme = tuple(
+            (citation.get("label"), citation.get("xpath"), citation.get("scope"))
+            for citation in node.xpath("ti:online/ti:citationMapping//ti:citation", namespaces=NS)
+        )
+        if scheme not in self.__citations:
+            self.__citations[scheme] = CompactInventory.make_citation(scheme)
+        text.citation = self.__citations[scheme]
+        return text
+
+    @staticmethod
+    def make_citation(scheme):
+        """ Build a citation scheme from the attributes of its levels
+
+        :param scheme: Label, xpath and scope of each level, from the highest one
+        :type scheme: ((str, str, str))
+        :return: Citation of the highest level, an empty tuple for an empty scheme
+        :rtype: MyCapytain.resources.inventory.Citation
+        """
+        citation = ()
+        for name, xpath, scope in reversed(scheme):
+            citation = MyCapytain.resources.inventory.Citation(
+                name=name, xpath=xpath, scope=scope, child=citation or None
+            )
+        return citation
+
+    def localized(self, node, xpath):
+        """ Retrieve the text of a multilingual child in the language of the inventory
+
+        :param node: Parent node
+        :type node: lxml.etree._Element
+        :param xpath: XPath of the multilingual children
+        :type xpath: str
+        :return: Value in the language of the inventory, first value found otherwise
+        :rtype: CompactMetadatum
+        """
+        children = node.xpath(xpath, namespaces=NS)
+        for child in children:
+            if child.get("{http://www.w3.org/XML/1998/namespace}lang") == self.lang:
+                return CompactMetadatum(child.text, self.lang)
+        if len(children) > 0:
+            return CompactMetadatum(children[0].text, children[0].get("{http://www.w3.org/XML/1998/namespace}lang"))
+        return CompactMetadatum(None)
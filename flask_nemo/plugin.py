@@ -18,6 +18,8 @@ class PluginPrototype(object):
     :type FILTERS: list
     :cvar HAS_AUGMENT_RENDER: Enables post-processing in view rendering function Nemo().render(template, **kwargs)
     :type HAS_AUGMENT_RENDER: bool
+    :cvar CACHEABLE: Indicates that pages rendered with this plugin can be kept in the page cache of Nemo. Plugins whose routes or render method depend on the user should set it to False
+    :type CACHEABLE: bool
     :cvar CLEAR_ROUTES: Removes original nemo routes
     :type CLEAR_ROUTES: bool
     :cvar CLEAR_ASSETS: Removes original nemo secondary assets
@@ -35,6 +37,8 @@ class PluginPrototype(object):
     :type assets: dict(str:[str])
     :ivar augment: If true, means that the plugin has a render method which needs to be called upon rendering the view
     :type augment: bool
+    :ivar cacheable: If false, pages using the routes or the render method of the plugin are not cached by Nemo
+    :type cacheable: bool
     :ivar clear_routes: If true, means that the plugin requires Nemo original routes to be removed
     :type clear_routes: bool
     :ivar clear_assets: If true, means that the plugin required Nemo original assets to be removed
@@ -69,6 +73,7 @@ class PluginPrototype(object):
     TEMPLATES = {}
     FILTERS = []
     HAS_AUGMENT_RENDER = False
+    CACHEABLE = True
     CLEAR_ROUTES = False
     CLEAR_ASSETS = False
     CSS = []
@@ -89,6 +94,7 @@ class PluginPrototype(object):
         self.__filters__ = copy(type(self).FILTERS)
         self.__templates__ = copy(type(self).TEMPLATES)
         self.__augment__ = copy(type(self).HAS_AUGMENT_RENDER)
+        self.__cacheable__ = copy(type(self).CACHEABLE)
         self.__namespaced__ = namespacing
 
         if namespacing:
@@ -126,6 +132,10 @@ class PluginPrototype(object):
     def augment(self):
         return self.__augment__
 
+    @property
+    def cacheable(self):
+        return self.__cacheable__
+
     @property
     def clear_routes(self):
         return self.__clear_routes__
@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+"""
+    Local representation of the references of a text
+"""
+
+import hashlib
+import sys
+from array import array
+from collections import OrderedDict
+from itertools import compress, count, islice, repeat
+from operator import ne
+from flask_nemo.common import join_or_single
+
+
+def make_digest(references):
+    """ Compute the digest of a list of references
+
+    :param references: References or URNs
+    :type references: [str]
+    :return: Hexadecimal SHA1 digest of the references
+    :rtype: str
+    """
+    return hashlib.sha1("\n".join(references).encode("utf-8")).hexdigest()
+
+
+class ReferenceArray(object):
+    """ Compact references of a citation level : each citation part is a column, packed into an array of integers \
+    when every part of the column is a number and kept as strings otherwise
+
+    Chunkers group and slice references on columns and only build the strings of the references they return.
+
+    :param urn: URN of the text
+    :type urn: str
+    :param columns: Parts of the references, one list per citation part
+    :type columns: [[str]]
+
+    :ivar columns: Packed columns
+    :type columns: [array.array or [str]]
+    """
+    def __init__(self, urn, columns):
+        self.urn = urn
+        self.columns = [ReferenceArray.pack(column) for column in columns]
+
+    @staticmethod
+    def pack(column):
+        """ Pack a column into an array of integers if every part is written as an integer (eg. "12" but not "012")
+
+        :param column: Parts of a column
+        :type column: [str]
+        :rtype: array.array or [str]
+        """
+        # Parts repeat across passages : each distinct part is converted and checked once
+        try:
+            values = {part: int(part) for part in set(column)}
+        except ValueError:
+            return column
+        if any(str(value) != part for part, value in values.items()):
+            return column
+        try:
+            return array("l", map(values.__getitem__, column))
+        except OverflowError:
+            return column
+
+    def __len__(self):
+        if not self.columns:
+            return 0
+        return len(self.columns[0])
+
+    def reference(self, index):
+        """ Build the reference at a given index
+
+        :param index: Index of the reference
+        :type index: int
+        :return: Reference (eg. "1.pr.1")
+        :rtype: str
+        """
+        return ".".join([str(column[index]) for column in self.columns])
+
+    def boundaries(self, depth):
+        """ Indexes where the parts of the first citation levels change
+
+        :param depth: Number of citation parts to compare
+        :type depth: int
+        :return: Sorted indexes starting a new group, including 0 when the array is not empty
+        :rtype: [int]
+        """
+        boundaries = set([0]) if len(self) else set()
+        for column in self.columns[:depth]:
+            boundaries.update(compress(count(1), map(ne, column, islice(column, 1, None))))
+        return sorted(boundaries)
+
+    def groups(self, depth, size):
+        """ Split references in groups sharing their first citation parts, then in groups of at most size references
+
+        :param depth: Number of citation parts shared by the references of a group
+        :type depth: int
+        :param size: Maximum number of references per group
+        :type size: int
+        :return: Start and end (excluded) indexes of each group
+        :rtype: [(int, int)]
+        """
+        boundaries = self.boundaries(depth) + [len(self)]
+        return [
+            (start, min(start + size, end))
+            for first, end in zip(boundaries, boundaries[1:])
+            for start in range(first, end, size)
+        ]
+
+
+class ReferenceList(list):
+    """ URNs of the references of a citation level, giving access to their compact representation (See ReferenceArray)
+
+    :param urns: URNs of the references
+    :type urns: [str]
+    :param tree: Tree the references come from
+    :type tree: ReferenceTree
+    :param level: Citation level of the references
+    :type level: int
+    """
+    def __init__(self, urns, tree, level):
+        super(ReferenceList, self).__init__(urns)
+        self.tree = tree
+        self.level = level
+
+    @property
+    def array(self):
+        """ Compact representation of the references
+
+        :rtype: ReferenceArray
+        """
+        return self.tree.array(self.level)
+
+
+class ReferenceTree(object):
+    """ Tree of the references of a text, built from the references of its deepest citation level
+
+    Every reference of a level is the prefix of references of the next level : shallower levels, counts and ranges \
+    are answered from the tree without requesting the API.
+
+    .. note:: Passages which have no children at the deepest level are not part of the tree
+
+    :param urn: URN of the text
+    :type urn: str
+    :param references: References or URNs of the deepest level, in the order of the text
+    :type references: [str]
+    :param depth: Number of citation levels of the text
+    :type depth: int
+
+    :ivar root: Trie of citation parts : each node is an OrderedDict of parts and children, leaves are None
+    :type root: OrderedDict
+    :ivar digest: Hexadecimal SHA1 digest of the references the tree was built from, computed once so that \
+    artefacts derived from the tree can be checked against it
+    :type digest: str
+    """
+    def __init__(self, urn, references, depth):
+        self.urn = urn
+        self.depth = depth
+        self.root = OrderedDict()
+        self.__levels = {}
+        self.__positions = {}
+        self.__arrays = {}
+
+        digest = hashlib.sha1()
+        for reference in references:
+            node = self.root
+            reference = reference.split(":")[-1]
+            digest.update(reference.encode("utf-8") + b"\n")
+            parts = reference.split(".")
+            for part in parts[:-1]:
+                child = node.get(part)
+                if child is None:
+                    child = node[part] = OrderedDict()
+                node = child
+            node.setdefault(parts[-1], None)
+        self.digest = digest.hexdigest()
+
+    def __getstate__(self):
+        return self.urn, self.depth, self.root, self.digest
+
+    def __setstate__(self, state):
+        self.urn, self.depth, self.root, self.digest = state
+        self.__levels = {}
+        self.__positions = {}
+        self.__arrays = {}
+
+    def __sizeof__(self):
+        """ Size in memory of the tree, including the nodes and parts of the trie, so that caches bounded in size \
+        account for it (See flask_nemo.cache.sizeof)
+
+        :rtype: int
+        """
+        size = object.__sizeof__(self) + sys.getsizeof(self.__dict__) + sys.getsizeof(self.urn) + \
+            sys.getsizeof(self.digest)
+        nodes = [self.root]
+        while nodes:
+            node = nodes.pop()
+            size += sys.getsizeof(node)
+            for part, children in node.items():
+                size += sys.getsizeof(part)
+                if children is not None:
+                    nodes.append(children)
+        return size
+
+    @staticmethod
+    def walk(node, level, prefix=()):
+        """ Iterate over the references of a level below a node
+
+        :param node: Node of the tree
+        :type node: OrderedDict
+        :param level: Number of parts of the references
+        :type level: int
+        :param prefix: Parts leading to the node
+        :type prefix: tuple
+        :return: Iterator of references
+        :rtype: str
+        """
+        for part, children in node.items():
+            parts = prefix + (part, )
+            if len(parts) == level:
+                yield ".".join(parts)
+            elif children is not None:
+                for reference in ReferenceTree.walk(children, level, parts):
+                    yield reference
+
+    def level(self, level):
+        """ References of a citation level
+
+        :param level: Citation level, starting at 1
+        :type level: int
+        :return: References (eg. "1.pr"), in the order of the text
+        :rtype: [str]
+        """
+        return list(self.__level(level))
+
+    def __level(self, level):
+        if level not in self.__levels:
+            self.__levels[level] = list(ReferenceTree.walk(self.root, level))
+        return self.__levels[level]
+
+    def urns(self, level):
+        """ URNs of the passages of a citation level, as given by GetValidReff
+
+        :param level: Citation level, starting at 1
+        :type level: int
+        :return: Passage URNs
+        :rtype: ReferenceList
+        """
+        return ReferenceList(
+            ["{0}:{1}".format(self.urn, reference) for reference in self.__level(level)], self, level
+        )
+
+    def array(self, level):
+        """ Compact representation of the references of a citation level
+
+        :param level: Citation level, starting at 1
+        :type level: int
+        :rtype: ReferenceArray
+        """
+        if level not in self.__arrays:
+            columns = [[] for _ in range(level)]
+            ReferenceTree.fill(self.root, columns)
+            self.__arrays[level] = ReferenceArray(self.urn, columns)
+        return self.__arrays[level]
+
+    @staticmethod
+    def fill(node, columns, depth=0):
+        """ Add the parts of the references below a node to columns
+
+        :param node: Node of the tree
+        :type node: OrderedDict
+        :param columns: Columns to fill, one per citation part
+        :type columns: [list]
+        :param depth: Depth of the node
+        :type depth: int
+        :return: Number of references added
+        :rtype: int
+        """
+        if depth + 1 == len(columns):
+            columns[depth].extend(node)
+            return len(node)
+
+        added = 0
+        for part, children in node.items():
+            if children is not None:
+                count = ReferenceTree.fill(children, columns, depth + 1)
+                columns[depth].extend(repeat(part, count))
+                added += count
+        return added
+
+    def count(self, level):
+        """ Number of passages of a citation level
+
+        :param level: Citation level, starting at 1
+        :type level: int
+        :rtype: int
+        """
+        return len(self.__level(level))
+
+    def position(self, reference):
+        """ Index of a reference in the references of its level
+
+        :param reference: Reference (eg. "1.pr")
+        :type reference: str
+        :return: Index of the reference, None if it is unknown
+        :rtype: int
+        """
+        level = len(reference.split("."))
+        if level not in self.__positions:
+            self.__positions[level] = {known: index for index, known in enumerate(self.__level(level))}
+        return self.__positions[level].get(reference)
+
+    def neighbours(self, start, end=None):
+        """ Previous and next passages of a reference or of a range, at the same level and with the same number of \
+        references
+
+        :param start: Reference or first reference of a range
+        :type start: str
+        :param end: Last reference of the range
+        :type end: str
+        :return: Previous and next passages, None when there is none. None if start or end is unknown, or if they \
+        are not at the same level
+        :rtype: (str, str)
+        """
+        level = len(start.split("."))
+        first, last = self.position(start), None
+        if end is None:
+            last = first
+        elif len(end.split(".")) == level:
+            last = self.position(end)
+        if first is None or last is None or last < first:
+            return None
+
+        span = last - first + 1
+        references = self.__level(level)
+
+        previous, following = None, None
+        if first > 0:
+            previous = references[max(first - span, 0):first]
+            previous = join_or_single(previous[0], previous[-1])
+        if last + 1 < len(references):
+            following = references[last + 1:last + 1 + span]
+            following = join_or_single(following[0], following[-1])
+        return previous, following
+
+    def children(self, reference=None):
+        """ References directly below a reference
+
+        :param reference: Reference of the parent passage. None for the first level
+        :type reference: str
+        :return: References of the children, empty if the reference is unknown or has no children
+        :rtype: [str]
+        """
+        node, parts = self.root, ()
+        if reference:
+            parts = tuple(reference.split("."))
+            for part in parts:
+                node = node.get(part) if node is not None else None
+            if not node:
+                return []
+        return [".".join(parts + (part, )) for part in node]
+
+    def range(self, start, end):
+        """ References from start to end, both included, at the level of start
+
+        :param start: First reference of the range
+        :type start: str
+        :param end: Last reference of the range
+        :type end: str
+        :return: References of the range, empty if start or end is unknown or if end comes before start
+        :rtype: [str]
+        """
+        level = len(start.split("."))
+        first, last = self.position(start), self.position(end)
+        if first is None or last is None or len(end.split(".")) != level:
+            return []
+        return self.__level(level)[first:last + 1]
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+import json
+import re
+import threading
+from MyCapytain.retrievers.proto import CTS as CtsProtoRetriever
+
+
+def request_key(request, endpoint, inventory, parameters):
+    """ Build the key identifying a CTS request
+
+    :param request: Name of the CTS request
+    :type request: str
+    :param endpoint: Endpoint of the API
+    :type endpoint: str
+    :param inventory: Inventory requested
+    :type inventory: str
+    :param parameters: Parameters of the request
+    :type parameters: dict
+    :rtype: str
+    """
+    return json.dumps([request, endpoint, inventory, sorted(parameters.items())])
+
+
+ROOT_TAG = re.compile(r"\s*(?:<\?.*?\?>\s*|<!--.*?-->\s*)*<(?:[\w.-]+:)?([\w.-]+)", re.DOTALL)
+
+
+def is_error_reply(reply):
+    """ Check whether a reply of a CTS API is an error : an empty reply, a reply which is not an XML document \
+    (such as the HTML page of a proxy during an outage) or a CTSError document
+
+    :param reply: Reply of a CTS request
+    :type reply: str
+    :rtype: bool
+    """
+    if not reply:
+        return True
+    if not isinstance(reply, str):
+        return False
+    root = ROOT_TAG.match(reply)
+    return root is None or root.group(1) in ("CTSError", "html")
+
+
+class SingleFlight(object):
+    """ Run a function only once at a time per key : callers asking for a key which is already being computed wait \
+    for the running call and share its result or its exception
+
+    :ivar coalesced: Number of calls which waited for another one instead of running
+    :type coalesced: int
+    """
+    def __init__(self):
+        self.coalesced = 0
+        self.__calls = {}
+        self.__lock = threading.Lock()
+
+    def do(self, key, function, *args, **kwargs):
+        """ Run function or wait for the running call with the same key
+
+        :param key: Key identifying the call
+        :type key: str
+        :param function: Function to run
+        :type function: function
+        :return: Result of the call
+        """
+        with self.__lock:
+            flight = self.__calls.get(key)
+            running = flight is not None
+            if running:
+                self.coalesced += 1
+            else:
+                flight = self.__calls[key] = {"done": threading.Event(), "result": None, "error": None}
+
+        if running:
+            flight["done"].wait()
+            if flight["error"] is not None:
+                raise flight["error"]
+            return flight["result"]
+
+        try:
+            flight["result"] = function(*args, **kwargs)
+        except Exception as E:
+            flight["error"] = E
+            raise
+        finally:
+            with self.__lock:
+                del self.__calls[key]
+            flight["done"].set()
+        return flight["result"]
+
+
+class CachedRetriever(CtsProtoRetriever):
+    """ CTS Retriever proxy which keeps the replies of another retriever in a cache
+
+    GetCapabilities is not cached : the inventory has its own lifecycle in Nemo (See Nemo.get_inventory). Error \
+    replies (See is_error_reply) and calls raising an exception are not cached either.
+
+    :param retriever: Retriever to proxy
+    :type retriever: MyCapytain.retrievers.proto.CTS
+    :param cache: Cache in which replies are kept
+    :type cache: flask_nemo.cache.BaseCache
+    :param expire: Time in seconds before a reply expires. 0 for replies which never expire, None for the default \
+    timeout of the cache
+    :type expire: int
+
+    :ivar retriever: Proxied retriever
+    :ivar hits: Number of replies served from the cache
+    :type hits: int
+    :ivar misses: Number of replies requested from the proxied retriever
+    :type misses: int
+    """
+    def __init__(self, retriever, cache, expire=None):
+        super(CachedRetriever, self).__init__(getattr(retriever, "endpoint", None))
+        self.retriever = retriever
+        self.expire = expire
+        self.storage = cache
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def inventory(self):
+        """ Default inventory of the proxied retriever
+        """
+        return getattr(self.retriever, "inventory", None)
+
+    @inventory.setter
+    def inventory(self, value):
+        self.retriever.inventory = value
+
+    def cached(self, request, method, **parameters):
+        """ Retrieve a reply from the cache or, if it is missing or expired, from the proxied retriever
+
+        :param request: Name of the CTS request
+        :type request: str
+        :param method: Method of the proxied retriever to call on cache miss
+        :type method: function
+        :param parameters: Parameters of the request
+        :return: Reply of the request
+        :rtype: str
+        """
+        key = request_key(request, self.endpoint, self.inventory, parameters)
+        reply = self.storage.get(key)
+        if reply is not None:
+            with self.__lock:
+                self.hits += 1
+            return reply
+
+        with self.__lock:
+            self.misses += 1
+        reply = method(**parameters)
+        if not is_error_reply(reply):
+            self.storage.set(key, reply, timeout=self.expire)
+        return reply
+
+    def getCapabilities(self, inventory=None):
+        return self.retriever.getCapabilities(inventory=inventory)
+
+    def getValidReff(self, urn, inventory=None, level=None):
+        return self.cached("GetValidReff", self.retriever.getValidReff, urn=urn, inventory=inventory, level=level)
+
+    def getFirstUrn(self, urn, inventory=None):
+        return self.cached("GetFirstUrn", self.retriever.getFirstUrn, urn=urn, inventory=inventory)
+
+    def getPrevNextUrn(self, urn, inventory=None):
+        return self.cached("GetPrevNextUrn", self.retriever.getPrevNextUrn, urn=urn, inventory=inventory)
+
+    def getLabel(self, urn, inventory=None):
+        return self.cached("GetLabel", self.retriever.getLabel, urn=urn, inventory=inventory)
+
+    def getPassage(self, urn, inventory=None, context=None):
+        return self.cached("GetPassage", self.retriever.getPassage, urn=urn, inventory=inventory, context=context)
+
+    def getPassagePlus(self, urn, inventory=None, context=None):
+        return self.cached(
+            "GetPassagePlus", self.retriever.getPassagePlus, urn=urn, inventory=inventory, context=context
+        )
+
+
+class CoalescingRetriever(CtsProtoRetriever):
+    """ CTS Retriever proxy which sends identical concurrent requests only once to another retriever : the callers \
+    of a request which is already running wait for its reply (See SingleFlight)
+
+    :param retriever: Retriever to proxy
+    :type retriever: MyCapytain.retrievers.proto.CTS
+
+    :ivar retriever: Proxied retriever
+    :ivar flight: Calls currently running
+    :type flight: SingleFlight
+    """
+    def __init__(self, retriever):
+        super(CoalescingRetriever, self).__init__(getattr(retriever, "endpoint", None))
+        self.retriever = retriever
+        self.flight = SingleFlight()
+
+    @property
+    def inventory(self):
+        """ Default inventory of the proxied retriever
+        """
+        return getattr(self.retriever, "inventory", None)
+
+    @inventory.setter
+    def inventory(self, value):
+        self.retriever.inventory = value
+
+    def coalesced(self, request, method, **parameters):
+        """ Run a request on the proxied retriever or wait for the identical request already running
+
+        :param request: Name of the CTS request
+        :type request: str
+        :param method: Method of the proxied retriever to call
+        :type method: function
+        :param parameters: Parameters of the request
+        :return: Reply of the request
+        :rtype: str
+        """
+        return self.flight.do(request_key(request, self.endpoint, self.inventory, parameters), method, **parameters)
+
+    def getCapabilities(self, inventory=None):
+        return self.coalesced("GetCapabilities", self.retriever.getCapabilities, inventory=inventory)
+
+    def getValidReff(self, urn, inventory=None, level=None):
+        return self.coalesced("GetValidReff", self.retriever.getValidReff, urn=urn, inventory=inventory, level=level)
+
+    def getFirstUrn(self, urn, inventory=None):
+        return self.coalesced("GetFirstUrn", self.retriever.getFirstUrn, urn=urn, inventory=inventory)
+
+    def getPrevNextUrn(self, urn, inventory=None):
+        return self.coalesced("GetPrevNextUrn", self.retriever.getPrevNextUrn, urn=urn, inventory=inventory)
+
+    def getLabel(self, urn, inventory=None):
+        return self.coalesced("GetLabel", self.retriever.getLabel, urn=urn, inventory=inventory)
+
+    def getPassage(self, urn, inventory=None, context=None):
+        return self.coalesced("GetPassage", self.retriever.getPassage, urn=urn, inventory=inventory, context=context)
+
+    def getPassagePlus(self, urn, inventory=None, context=None):
+        return self.coalesced(
+            "GetPassagePlus", self.retriever.getPassagePlus, urn=urn, inventory=inventory, context=context
+        )
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+    Compiled XSLT stylesheets used by Nemo.transform
+"""
+
+import logging
+import multiprocessing
+import os
+import threading
+from copy import deepcopy
+from lxml import etree
+
+
+XSL_NAMESPACE = "http://www.w3.org/1999/XSL/Transform"
+
+
+class Stylesheet(object):
+    """ Compiled XSL stylesheet
+
+    .. note:: libxslt strips whitespace of the input document in place when the stylesheet uses xsl:strip-space \
+    ( https://bugzilla.gnome.org/show_bug.cgi?id=620102 ). Such stylesheets are applied to a copy of the input so \
+    that they can be reused and that the given tree stays untouched.
+
+    :param path: Path of the XSL file
+    :type path: str
+
+    :ivar mtime: Modification time of the file when it was compiled
+    :type mtime: float
+    :ivar strip_space: Indicates if the stylesheet uses xsl:strip-space
+    :type strip_space: bool
+    """
+    def __init__(self, path):
+        self.path = path
+        self.mtime = os.stat(path).st_mtime
+        with open(path) as f:
+            document = etree.parse(f)
+        self.strip_space = len(document.xpath("//xsl:strip-space", namespaces={"xsl": XSL_NAMESPACE})) > 0
+        self.xslt = etree.XSLT(document)
+
+    def __call__(self, xml):
+        """ Apply the stylesheet
+
+        :param xml: XML to transform
+        :type xml: etree._Element
+        :return: Result of the transformation
+        :rtype: etree._XSLTResultTree
+        """
+        if self.strip_space:
+            xml = deepcopy(xml)
+        return self.xslt(xml)
+
+
+class StylesheetCache(object):
+    """ Cache of compiled stylesheets, recompiled when their file is modified
+
+    lxml XSLT objects should not be shared by threads : each thread gets its own compiled instance of a stylesheet.
+    """
+    def __init__(self):
+        self.__local = threading.local()
+
+    def get(self, path):
+        """ Retrieve the compiled stylesheet of a file for the current thread
+
+        :param path: Path of the XSL file
+        :type path: str
+        :rtype: Stylesheet
+        """
+        stylesheets = getattr(self.__local, "stylesheets", None)
+        if stylesheets is None:
+            stylesheets = self.__local.stylesheets = {}
+
+        stylesheet = stylesheets.get(path)
+        if stylesheet is None or stylesheet.mtime != os.stat(path).st_mtime:
+            stylesheet = stylesheets[path] = Stylesheet(path)
+        return stylesheet
+
+
+class RawXML(str):
+    """ XML of a passage given instead of the output of a transformation which could not complete
+    """
+
+
+def tostring(result):
+    """ Serialize the result of a stylesheet to HTML
+
+    :param result: Result of a stylesheet
+    :type result: etree._XSLTResultTree
+    :rtype: str
+    """
+    return etree.tostring(
+        result, encoding=str, method="html", xml_declaration=None, pretty_print=False, with_tail=True, standalone=None
+    )
+
+
+# Stylesheets of a StylesheetPool worker process
+_worker_stylesheets = None
+
+
+def preload_in_worker(paths):
+    """ Compile stylesheets when a StylesheetPool worker process starts
+
+    :param paths: Path of the XSL files to compile
+    :type paths: [str]
+    """
+    global _worker_stylesheets
+    _worker_stylesheets = StylesheetCache()
+    for path in paths:
+        _worker_stylesheets.get(path)
+
+
+def transform_in_worker(path, xml):
+    """ Apply a stylesheet in a StylesheetPool worker process
+
+    :param path: Path of the XSL file
+    :type path: str
+    :param xml: Serialized XML to transform
+    :type xml: bytes
+    :return: HTML output
+    :rtype: str
+    """
+    return tostring(_worker_stylesheets.get(path)(etree.fromstring(xml)))
+
+
+class StylesheetPool(object):
+    """ Apply stylesheets in worker processes, so that transformations use every core and do not hold the threads \
+    serving requests. Workers compile the stylesheets when they start and keep them (See StylesheetCache).
+
+    The pool is started on first use. Workers are not forked from the process serving requests, whose other threads \
+    (fetch executor, inventory refresh, SQLite connections) may hold locks at that time : they are started by a fork \
+    server or, where it is not available, spawned.
+
+    Transformations which fail or time out give back the XML itself. A transformation which times out keeps its \
+    worker busy : the pool is then retired and replaced by a new one, so that later transformations do not wait \
+    behind it. The retired pool is terminated once the jobs it was given have had the time to finish.
+
+    :param paths: Path of the XSL files to compile when workers start
+    :type paths: [str]
+    :param processes: Number of worker processes. None for the number of cores
+    :type processes: int
+    :param timeout: Time in seconds after which a transformation is abandoned and the XML returned
+    :type timeout: float
+    :param start_method: Method used to start the workers (See multiprocessing.get_context). None for \
+    "forkserver" where available, "spawn" otherwise
+    :type start_method: str
+    """
+    def __init__(self, paths, processes=None, timeout=30, start_method=None):
+        self.paths = list(paths)
+        self.processes = processes
+        self.timeout = timeout
+        self.start_method = start_method
+        if start_method is None:
+            self.start_method = "spawn"
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                self.start_method = "forkserver"
+        self.__pool = None
+        self.__retired = []
+        self.__lock = threading.Lock()
+
+    @property
+    def pool(self):
+        """ Pool of worker processes
+
+        :rtype: multiprocessing.pool.Pool
+        """
+        if self.__pool is None:
+            with self.__lock:
+                if self.__pool is None:
+                    self.__pool = multiprocessing.get_context(self.start_method).Pool(
+                        self.processes, initializer=preload_in_worker, initargs=(self.paths, )
+                    )
+        return self.__pool
+
+    def transform(self, path, xml):
+        """ Apply a stylesheet in a worker process
+
+        :param path: Path of the XSL file
+        :type path: str
+        :param xml: XML to transform
+        :type xml: etree._Element
+        :return: HTML output or, when the transformation failed or timed out, the XML itself
+        :rtype: str
+        """
+        pool = self.pool
+        try:
+            return pool.apply_async(transform_in_worker, (path, etree.tostring(xml))).get(self.timeout)
+        except multiprocessing.TimeoutError:
+            logging.getLogger(__name__).warning(
+                "Transformation of %s with %s timed out after %ss", xml.tag, path, self.timeout
+            )
+            self.retire(pool)
+        except Exception as E:
+            logging.getLogger(__name__).warning("Transformation of %s with %s failed : %s", xml.tag, path, E)
+        return RawXML(etree.tostring(xml, encoding=str))
+
+    def retire(self, pool):
+        """ Replace a pool by a new one for later transformations, and terminate it after the timeout so that the \
+        jobs it was given can finish
+
+        :param pool: Pool to retire
+        :type pool: multiprocessing.pool.Pool
+        """
+        with self.__lock:
+            if self.__pool is not pool:
+                return
+            self.__pool = None
+            pool.close()
+            timer = threading.Timer(self.timeout, self.terminate, (pool, ))
+            timer.daemon = True
+            self.__retired.append((pool, timer))
+        timer.start()
+
+    def terminate(self, pool):
+        """ Terminate a retired pool
+
+        :param pool: Retired pool
+        :type pool: multiprocessing.pool.Pool
+        """
+        with self.__lock:
+            self.__retired = [retired for retired in self.__retired if retired[0] is not pool]
+        pool.terminate()
+
+    def close(self):
+        """ Stop the worker processes, including the ones of retired pools
+        """
+        with self.__lock:
+            retired, self.__retired = self.__retired, []
+            pools = [pool for pool, timer in retired]
+            if self.__pool is not None:
+                pools.append(self.__pool)
+                self.__pool = None
+        for pool, timer in retired:
+            timer.cancel()
+        for pool in pools:
+            pool.terminate()
@@ -12,7 +12,6 @@ setup(
     test_suite="tests",
     install_requires=[
         "MyCapytain>=1.0.1",
-        "requests_cache>=0.4.9",
         "Flask>=0.10.1"
     ],
     tests_require=[
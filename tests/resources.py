@@ -58,6 +58,10 @@ class NemoResource(unittest.TestCase):
             self.getPrevNext = RequestPatch(f)
             self.getPassage_Route = RequestPatchChained([self.getCapabilities, self.getPassage, self.getPrevNext])
 
+        with open("tests/test_data/getpassageplus.xml", "r") as f:
+            self.getPassagePlus = RequestPatch(f)
+            self.getPassagePlus_Route = RequestPatchChained([self.getCapabilities, self.getPassagePlus])
+
         self.nemo = Nemo(
             api_url=NemoResource.endpoint,
             app=Flask(__name__)
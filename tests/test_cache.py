@@ -0,0 +1,223 @@
+"""
+    Test for the cache backends
+"""
+import os
+import shutil
+import sys
+import tempfile
+from unittest import TestCase
+from mock import patch
+from werkzeug.contrib.cache import SimpleCache
+from flask_nemo.cache import LRUCache, SQLiteCache, FileSystemCache, TieredCache, NamespacedCache, make_cache
+
+
+class BackendTests(object):
+    """ Tests shared by every backend """
+
+    def make(self, default_timeout=0):
+        raise NotImplementedError()
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_set_get_delete(self):
+        """ Entries should be stored, retrieved and removed """
+        cache = self.make()
+        self.assertIsNone(cache.get("key"))
+        cache.set("key", {"reply": "<xml/>"})
+        self.assertEqual(cache.get("key"), {"reply": "<xml/>"})
+        cache.delete("key")
+        self.assertIsNone(cache.get("key"))
+        cache.delete("key")
+
+    def test_timeout(self):
+        """ Entries should expire after their own timeout or the default one """
+        cache = self.make(default_timeout=10)
+        with patch("flask_nemo.cache.time.time", return_value=1000):
+            cache.set("default", "a")
+            cache.set("own", "b", timeout=100)
+            cache.set("never", "c", timeout=0)
+        with patch("flask_nemo.cache.time.time", return_value=1050):
+            self.assertIsNone(cache.get("default"))
+            self.assertEqual(cache.get("own"), "b")
+        with patch("flask_nemo.cache.time.time", return_value=100000):
+            self.assertIsNone(cache.get("own"))
+            self.assertEqual(cache.get("never"), "c")
+
+    def test_clear(self):
+        """ Clearing should remove every entry """
+        cache = self.make()
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.clear()
+        self.assertEqual((cache.get("a"), cache.get("b")), (None, None))
+
+    def test_delete_prefix(self):
+        """ Deleting a prefix should only remove the entries whose key starts with it """
+        cache = self.make()
+        cache.set("ns:a", 1)
+        cache.set("ns:b", 2)
+        cache.set("other:ns:a", 3)
+        cache.set("n", 4)
+        cache.delete_prefix("ns:")
+        self.assertEqual([cache.get(key) for key in ["ns:a", "ns:b", "other:ns:a", "n"]], [None, None, 3, 4])
+
+
+class TestLRUCache(BackendTests, TestCase):
+
+    def make(self, default_timeout=0):
+        return LRUCache(max_entries=10, default_timeout=default_timeout)
+
+    def test_bounded(self):
+        """ Least recently used entries should be dropped first """
+        cache = LRUCache(max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), (1, None, 3))
+
+
+    def test_bounded_size(self):
+        """ Entries should be dropped once the size limit is reached, too large entries are not kept """
+        cache = LRUCache(max_size=3 * sys.getsizeof("x" * 1000))
+        for key in "abc":
+            cache.set(key, "x" * 1000)
+        self.assertEqual(cache.size, 3 * sys.getsizeof("x" * 1000))
+        cache.set("d", "x" * 1000)
+        self.assertEqual((cache.get("a"), len(cache)), (None, 3))
+        cache.set("e", "x" * 10000)
+        self.assertEqual((cache.get("e"), len(cache)), (None, 3))
+        cache.delete("b")
+        cache.set("c", "y")
+        self.assertEqual(cache.size, sys.getsizeof("x" * 1000) + sys.getsizeof("y"))
+
+
+class TestSQLiteCache(BackendTests, TestCase):
+
+    def make(self, default_timeout=0):
+        return SQLiteCache(os.path.join(self.folder, "cache.sqlite"), default_timeout=default_timeout)
+
+    def test_wal_and_shared(self):
+        """ The database should use WAL and be shared by instances using the same file """
+        cache = self.make()
+        self.assertEqual(cache.connection.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        cache.set("key", "value")
+        self.assertEqual(self.make().get("key"), "value")
+
+
+class TestFileSystemCache(BackendTests, TestCase):
+
+    def make(self, default_timeout=0):
+        return FileSystemCache(os.path.join(self.folder, "cache"), default_timeout=default_timeout)
+
+    def test_shared(self):
+        """ Entries should be shared by instances using the same directory """
+        self.make().set("key", "value")
+        self.assertEqual(self.make().get("key"), "value")
+        self.assertEqual(len(os.listdir(os.path.join(self.folder, "cache"))), 1)
+
+
+class TestTieredCache(BackendTests, TestCase):
+
+    def make(self, default_timeout=0):
+        self.l1 = LRUCache(default_timeout=default_timeout)
+        self.l2 = SQLiteCache(os.path.join(self.folder, "cache.sqlite"), default_timeout=default_timeout)
+        return TieredCache(self.l1, self.l2)
+
+    def test_promotion(self):
+        """ Entries found in a lower tier should be copied to upper tiers for the time they have left """
+        cache = self.make()
+        with patch("flask_nemo.cache.time.time", return_value=1000):
+            cache.set("key", "value", timeout=100)
+        self.l1.clear()
+        with patch("flask_nemo.cache.time.time", return_value=1060):
+            self.assertEqual(cache.get("key"), "value")
+            self.assertIsNotNone(self.l1.get("key"))
+        self.l2.clear()
+        with patch("flask_nemo.cache.time.time", return_value=1099):
+            self.assertEqual(cache.get("key"), "value")
+        with patch("flask_nemo.cache.time.time", return_value=1101):
+            self.assertIsNone(cache.get("key"))
+
+
+class TestWerkzeugTieredCache(BackendTests, TestCase):
+
+    def make(self, default_timeout=0):
+        self.l1 = LRUCache(default_timeout=default_timeout)
+        self.l2 = SimpleCache(default_timeout=default_timeout)
+        return make_cache([self.l1, self.l2])
+
+    def test_werkzeug_default_timeout(self):
+        """ Entries should expire after the default timeout of a werkzeug tier """
+        cache = TieredCache(SimpleCache(default_timeout=100))
+        with patch("flask_nemo.cache.time.time", return_value=1000):
+            cache.set("key", "value")
+            self.assertEqual(cache.tiers[0].get("key"), (1100, "value"))
+
+class TestNamespacedCache(TestCase):
+
+    def test_namespaces(self):
+        """ Namespaces should not share keys and should apply their own timeout """
+        backend = LRUCache()
+        replies, passages = NamespacedCache(backend, "replies", timeout=10), NamespacedCache(backend, "passages")
+        with patch("flask_nemo.cache.time.time", return_value=1000):
+            replies.set("urn", "reply")
+            passages.set("urn", "passage")
+            self.assertEqual(backend.get("replies:urn"), "reply")
+        with patch("flask_nemo.cache.time.time", return_value=1020):
+            self.assertIsNone(replies.get("urn"))
+            self.assertEqual(passages.get("urn"), "passage")
+        self.assertEqual(replies.stats, {"hits": 0, "misses": 1, "ratio": 0.0})
+        self.assertEqual(passages.ratio, 1.0)
+
+    def test_clear(self):
+        """ Clearing a namespace should only remove its own entries """
+        folder = tempfile.mkdtemp()
+        try:
+            backend = TieredCache(LRUCache(), FileSystemCache(os.path.join(folder, "cache")))
+            replies, passages = NamespacedCache(backend, "replies"), NamespacedCache(backend, "passages")
+            replies.set("urn", "reply")
+            passages.set("urn", "passage")
+            replies.clear()
+            self.assertIsNone(replies.get("urn"))
+            self.assertEqual(passages.get("urn"), "passage")
+            self.assertEqual(backend.tiers[1].get("passages:urn")[1], "passage")
+        finally:
+            shutil.rmtree(folder)
+
+    def test_clear_werkzeug(self):
+        """ Clearing a namespace stored in a werkzeug cache should clear the whole cache """
+        backend = SimpleCache()
+        replies, passages = NamespacedCache(backend, "replies"), NamespacedCache(backend, "passages")
+        replies.set("urn", "reply")
+        passages.set("urn", "passage")
+        replies.clear()
+        self.assertEqual((replies.get("urn"), passages.get("urn")), (None, None))
+
+
+class TestMakeCache(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_configurations(self):
+        """ Configurations should be turned into backends """
+        self.assertIsNone(make_cache(None))
+        self.assertIsNone(make_cache(""))
+        sqlite = make_cache(os.path.join(self.folder, "cache.sqlite"), default_timeout=5)
+        self.assertIsInstance(sqlite, TieredCache)
+        self.assertEqual([type(tier) for tier in sqlite.tiers], [LRUCache, SQLiteCache])
+        self.assertEqual(sqlite.tiers[1].default_timeout, 5)
+        self.assertIsInstance(make_cache(self.folder), FileSystemCache)
+        backend = LRUCache()
+        self.assertIs(make_cache(backend), backend)
+        tiered = make_cache([backend, os.path.join(self.folder, "files") + os.sep])
+        self.assertEqual([type(tier) for tier in tiered.tiers], [LRUCache, FileSystemCache])
@@ -11,6 +11,8 @@ from mock import patch, call, Mock
 import MyCapytain
 from .resources import NemoResource
 from flask_nemo.chunker import default_chunker, line_chunker, scheme_chunker, level_chunker, level_grouper
+from flask_nemo.references import ReferenceTree
+from lxml import etree
 
 
 class TestChunkers(NemoResource):
@@ -122,3 +124,28 @@ class TestChunkers(NemoResource):
             ("2.1.11-2.1.12", "2.1.11-2.1.12"),
             curated_references
         )
+
+    def test_compact_references(self):
+        """ Chunkers should group references carrying their compact representation as they group plain references
+        """
+        text = self.inventory["urn:cts:latinLit:phi1294.phi002.perseus-lat2"]
+        with open("tests/test_data/getvalidreff.xml") as f:
+            urns = [
+                urn for urn in etree.parse(f).xpath("//*[local-name()='reff']/*[local-name()='urn']/text()")
+            ]
+        tree = ReferenceTree("urn:cts:latinLit:phi1294.phi002.perseus-lat2", urns, 3)
+        self.assertIsNotNone(tree.urns(3).array)
+
+        def compact(level):
+            return tree.urns(level)
+
+        def plain(level):
+            return list(tree.urns(level))
+
+        for level, groupby in [(None, 20), (3, 10), (2, 5), (1, 20)]:
+            self.assertEqual(
+                level_grouper(text, compact, level=level, groupby=groupby),
+                level_grouper(text, plain, level=level, groupby=groupby)
+            )
+        for lines in [30, 7, 1]:
+            self.assertEqual(line_chunker(text, compact, lines=lines), line_chunker(text, plain, lines=lines))
@@ -4,6 +4,8 @@ Test only controllers functions, ie function that should not be accessible direc
 greatly tied to the app/blueprint instance
 
 """
+import threading
+from functools import partial
 from flask.ext.nemo import Nemo
 from mock import patch, call, Mock
 import MyCapytain
@@ -67,7 +69,7 @@ class NemoTestControllers(NemoResource):
                     "request": "GetCapabilities"
                 }
             )
-            self.assertEqual(collections, {"latinLit", "greekLit"})
+            self.assertEqual(collections, ["greekLit", "latinLit"])
 
     def test_get_authors(self):
         """ Check that authors textgroups are returned with informations
@@ -210,3 +212,117 @@ class NemoTestControllers(NemoResource):
             passage = self.nemo.get_passage("latinLit", "phi1294", "phi002", "perseus-lat2", "1.pr")
             self.assertIsInstance(passage, MyCapytain.resources.texts.api.Passage)
             self.assertEqual(len(passage.xml.xpath("//tei:l[@n]", namespaces={"tei":"http://www.tei-c.org/ns/1.0"})), 6)
+
+    def test_get_passage_plus(self):
+        """ GetPassagePlus replies should give the passage, its siblings and the text metadata """
+        self.nemo = Nemo(api_url=NemoTestControllers.endpoint, inventory="annotsrc")
+        with patch('requests.get', return_value=self.getPassagePlus) as patched:
+            passage = self.nemo.get_passage("latinLit", "phi1294", "phi002", "perseus-lat2", "1.1", plus=True)
+            self.assertIsInstance(passage, MyCapytain.resources.texts.api.Passage)
+            self.assertEqual((str(passage.prev), str(passage.next)), (
+                "urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.pr", "urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.2"
+            ))
+            self.assertEqual(str(passage.parent.metadata["groupname"]["eng"]), "Martial")
+            self.assertEqual(patched.call_count, 1)
+
+    def test_fetch_without_workers(self):
+        """ Without fetch_workers, calls should be run one after the other in the current thread """
+        threads = []
+
+        def call(value):
+            threads.append(threading.current_thread())
+            return value
+        self.assertIsNone(self.nemo.executor)
+        self.assertEqual(self.nemo.fetch(partial(call, 1), partial(call, 2), partial(call, 3)), [1, 2, 3])
+        self.assertEqual(threads, [threading.current_thread()] * 3)
+
+    def test_fetch_concurrent(self):
+        """ Calls should run at the same time, results keep the order of the calls and errors are raised """
+        nemo = Nemo(api_url=NemoTestControllers.endpoint, fetch_workers=2)
+        started = threading.Event()
+
+        def waiting():
+            return started.wait(5)
+
+        def starting():
+            started.set()
+            return "started"
+        self.assertEqual(nemo.fetch(waiting, starting), [True, "started"])
+
+        def failing():
+            raise ValueError("API down")
+        with self.assertRaises(ValueError):
+            nemo.fetch(lambda: 1, failing)
+
+    def test_fetch_nested(self):
+        """ Fetching from fetched calls should not exhaust the pool """
+        nemo = Nemo(api_url=NemoTestControllers.endpoint, fetch_workers=1)
+
+        def nested(value):
+            return nemo.fetch(lambda: value, lambda: value * 2, lambda: value * 3)
+        self.assertEqual(
+            nemo.fetch(partial(nested, 1), partial(nested, 2), partial(nested, 3)),
+            [[1, 2, 3], [2, 4, 6], [3, 6, 9]]
+        )
+
+    def test_inventory_without_ttl_is_kept(self):
+        """ Without inventory_ttl, the inventory is requested only once
+        """
+        with patch('requests.get', return_value=self.getCapabilities) as patched_get:
+            inventory = self.nemo.get_inventory()
+            self.nemo._Nemo__inventory_checked = 0
+            self.assertIs(self.nemo.get_inventory(), inventory)
+            self.assertEqual(patched_get.call_count, 1)
+
+    def test_inventory_ttl_refreshes_in_background(self):
+        """ Once inventory_ttl is expired, the old inventory is served while a refresh is started in background
+        """
+        self.nemo.inventory_ttl = 60
+        with patch('requests.get', return_value=self.getCapabilities):
+            inventory = self.nemo.get_inventory()
+            with patch.object(self.nemo, "refresh_inventory") as refresh:
+                self.assertIs(self.nemo.get_inventory(), inventory)
+                self.assertFalse(refresh.called)
+                self.nemo._Nemo__inventory_checked -= 61
+                self.assertIs(self.nemo.get_inventory(), inventory)
+                refresh.assert_called_once_with(background=True)
+
+    def test_refresh_inventory_swaps_inventory(self):
+        """ Refreshing in background replaces the inventory once parsed when the reply changed
+        """
+        with patch('requests.get', return_value=self.getCapabilities):
+            inventory = self.nemo.get_inventory()
+            self.nemo.refresh_inventory(background=True).join()
+            self.assertIs(self.nemo.get_inventory(), inventory, "Unchanged reply should not be parsed again")
+
+        with patch('requests.get', return_value=Mock(text=self.getCapabilities.text + "\n")):
+            self.nemo.refresh_inventory(background=True).join()
+            self.assertIsNot(self.nemo.get_inventory(), inventory)
+            self.assertEqual(len(self.nemo.get_inventory().textgroups), 4)
+
+    def test_refresh_inventory_failure_keeps_inventory(self):
+        """ A failing refresh keeps the current inventory in use
+        """
+        with patch('requests.get', return_value=self.getCapabilities):
+            inventory = self.nemo.get_inventory()
+        with patch('requests.get', side_effect=ValueError("API is down")):
+            with patch("flask_nemo.logging"):
+                self.nemo.refresh_inventory(background=True).join()
+        self.assertIs(self.nemo.get_inventory(), inventory)
+
+    def test_fragment_cache_tag(self):
+        """ The cache tag accepts its timeout before or after the values keying the fragment
+        """
+        with patch.object(self.nemo, "cache_fragment", side_effect=lambda parts, render, timeout=None: render()) \
+                as cache_fragment:
+            for source in [
+                "{% cache timeout=600, \"x\", lang %}body{% endcache %}",
+                "{% cache \"x\", lang, timeout=600 %}body{% endcache %}"
+            ]:
+                template = self.nemo.app.jinja_env.from_string(source)
+                with self.nemo.app.test_request_context("/"):
+                    self.assertEqual(template.render(lang="eng"), "body")
+                with self.nemo.app.test_request_context("/nemo/read/latinLit"):
+                    self.assertEqual(template.render(lang="eng"), "body")
+                cache_fragment.assert_called_once_with(["x", "eng"], cache_fragment.call_args[0][1], timeout=600)
+                cache_fragment.reset_mock()
@@ -6,8 +6,12 @@
 
 from .resources import NemoResource
 from flask_nemo import Nemo
+from flask_nemo.cache import LRUCache
+from flask_nemo.chunker import level_grouper
+from functools import partial
 import MyCapytain
 from lxml import etree
+from mock import patch, Mock
 
 
 class TestCustomizer(NemoResource):
@@ -163,6 +167,99 @@ class TestCustomizer(NemoResource):
         )
         self.assertEqual(transformed, "<b></b>")
 
+    def test_chunker_cached(self):
+        """ Chunks should be computed once per text and chunker, and again when references change
+        """
+        calls = []
+
+        def default(text, getreffs):
+            calls.append(str(text.urn))
+            return [(reff, reff) for reff in getreffs(level=1)]
+        # The closure over calls can not be identified
+        default.cache_key = "default"
+
+        nemo = Nemo(chunker={"default": default}, cache=LRUCache())
+        text = MyCapytain.resources.inventory.Text(urn="urn:cts:phi1294.phi002.perseus-lat2")
+        reffs = ["1", "2"]
+        self.assertEqual(nemo.chunk(text, lambda level: list(reffs)), [("1", "1"), ("2", "2")])
+        self.assertEqual(nemo.chunk(text, lambda level: list(reffs)), [("1", "1"), ("2", "2")])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(nemo.cache_stats()["chunks"]["hits"], 1)
+
+        reffs.append("3")
+        self.assertEqual(nemo.chunk(text, lambda level: list(reffs)), [("1", "1"), ("2", "2"), ("3", "3")])
+        self.assertEqual(len(calls), 2, "Chunks of other references should be computed again")
+
+        entry = nemo.chunk_entry(text, lambda level: list(reffs))
+        self.assertEqual(entry["positions"], {"1": 0, "2": 1, "3": 2})
+        self.assertIs(nemo.chunk_entry(text, lambda level: list(reffs)), entry, "Positions should be cached")
+
+    def test_chunker_identity(self):
+        """ Chunkers should be identified by their function and their parameters
+        """
+        def identities(chunker):
+            return Nemo(chunker={"default": chunker}).chunker_identity("urn:cts:latinLit:phi1294.phi002.perseus-lat2")
+
+        self.assertIn("level_grouper", identities(level_grouper))
+        self.assertEqual(identities(partial(level_grouper, groupby=5)), identities(partial(level_grouper, groupby=5)))
+        self.assertNotEqual(identities(partial(level_grouper, groupby=5)), identities(partial(level_grouper, groupby=10)))
+        self.assertNotEqual(
+            identities((lambda groupby: lambda x, y: level_grouper(x, y, groupby=groupby))(5)),
+            identities((lambda groupby: lambda x, y: level_grouper(x, y, groupby=groupby))(10))
+        )
+        # Lambdas differing only in their body share their module, name and line
+        groupby_30, groupby_5 = lambda x, y: level_grouper(x, y, groupby=30), lambda x, y: level_grouper(x, y, groupby=5)
+        self.assertNotEqual(identities(groupby_30), identities(groupby_5))
+
+    def test_chunker_identity_unstable(self):
+        """ Chunkers bound to values without a stable representation should only be identified by their cache_key
+        """
+        class Chunker(object):
+            def __init__(self, groupby):
+                self.groupby = groupby
+
+            def __call__(self, text, getreffs):
+                return level_grouper(text, getreffs, groupby=self.groupby)
+
+        def identities(chunker):
+            return Nemo(chunker={"default": chunker}).chunker_identity("urn:cts:latinLit:phi1294.phi002.perseus-lat2")
+
+        self.assertIsNone(identities(Chunker(5)))
+        self.assertIsNone(identities(Chunker(5).__call__))
+        self.assertIsNone(identities(partial(level_grouper, groupby=object())))
+        self.assertIsNone(identities((lambda calls: lambda x, y: level_grouper(x, y, groupby=len(calls)))([])))
+        self.assertIsNotNone(identities(partial(level_grouper, groupby=(5, frozenset([1, 2])))))
+
+        five, other_five, ten = Chunker(5), Chunker(5), Chunker(10)
+        five.cache_key, other_five.cache_key, ten.cache_key = "groupby=5", "groupby=5", "groupby=10"
+        self.assertEqual(identities(five), identities(other_five))
+        self.assertNotEqual(identities(five), identities(ten))
+
+        calls = []
+        nemo = Nemo(chunker={"default": lambda x, y: calls.append(1) or [("1", "1")]}, cache=LRUCache())
+        text = MyCapytain.resources.inventory.Text(urn="urn:cts:latinLit:phi1294.phi002.perseus-lat2")
+        nemo.chunk(text, lambda level: ["1"])
+        nemo.chunk(text, lambda level: ["1"])
+        self.assertEqual(len(calls), 2, "Chunkers which can not be identified should not be cached")
+        self.assertEqual(nemo.get_cache("chunks").stats["misses"], 0)
+
+    def test_transform_identity(self):
+        """ Transformations should be identified by their function, XSL file version or absence
+        """
+        def transformer(work, xml):
+            return "<b></b>"
+        nemo = Nemo(transform={
+            "default": transformer,
+            "urn:cts:latinLit:phi1294.phi002.perseus-lat2": "tests/test_data/xsl_test.xml",
+            "urn:cts:latinLit:phi1294.phi002.perseus-lat3": None
+        })
+        self.assertIn("transformer", nemo.transform_identity("urn:cts:latinLit:phi1294.phi002.perseus-lat1"))
+        identity = nemo.transform_identity("urn:cts:latinLit:phi1294.phi002.perseus-lat2")
+        self.assertTrue(identity.startswith("tests/test_data/xsl_test.xml@"))
+        with patch("flask_nemo.os.stat", return_value=Mock(st_mtime=1)):
+            self.assertNotEqual(nemo.transform_identity("urn:cts:latinLit:phi1294.phi002.perseus-lat2"), identity)
+        self.assertEqual(nemo.transform_identity("urn:cts:latinLit:phi1294.phi002.perseus-lat3"), "xml")
+
     def test_transform_default_none(self):
         """ Test that the transform default is called and applied
         """
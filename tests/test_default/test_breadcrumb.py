@@ -1,4 +1,5 @@
 from ..resources import NemoResource
+from flask_nemo import Nemo
 from mock import patch
 from flask_nemo.default import Breadcrumb
 
@@ -78,3 +79,21 @@ class TestBreadcrumb(NemoResource):
             self.assertEqual(bc, [
                 {'link': None, 'title': 'latinLit', 'args': {'collection': 'latinLit'}}
             ])
+
+    def test_make_breadcrumb_compact_missing_language(self):
+        """ metadata missing in the language of the page should be replaced by the value of the url
+        """
+        nemo = Nemo(api_url=NemoResource.endpoint, compact_inventory=True)
+        with patch("requests.get", return_value=self.getCapabilities):
+            make_breadcrumbs = Breadcrumb().render
+            bc = make_breadcrumbs(
+                textgroups=nemo.get_textgroups(),
+                version=nemo.get_text("latinLit", "phi1294", "phi002", "perseus-lat2"),
+                lang="fre",
+                url={
+                    "collection": "latinLit",
+                    "textgroup": "phi1294",
+                    "work": "phi002",
+                    "version": "perseus-lat2"
+                    })["breadcrumbs"]
+            self.assertEqual([crumb["title"] for crumb in bc], ["latinLit", "phi1294", "perseus-lat2"])
@@ -7,7 +7,7 @@ Test file for filters.
 from flask import Flask
 from flask_nemo import Nemo
 from flask_nemo.filters import f_active_link, f_collection_i18n, f_formatting_passage_reference, f_group_texts, \
-    f_hierarchical_passages, f_i18n_citation_type, f_i18n_iso, f_is_str, f_order_author,\
+    f_hierarchical_passages, f_hierarchical_passages_stream, f_i18n_citation_type, f_i18n_iso, f_is_str, f_order_author,\
     f_order_text_edition_translation
 import MyCapytain
 from .resources import NemoResource
@@ -125,6 +125,34 @@ class TestFilters(NemoResource):
         self.assertEqual(len(converted["%book|1%"]["%poem|6%"]), 1)
         self.assertEqual(len(converted["%book|2%"]), 1)
 
+    def test_f_hierarchical_passages_stream(self):
+        """Test for the streamed hierarchical conversion, from a generator
+        :return:
+        """
+        reffs = [("1.5.8-1.5.9", "Line 8"), ("1.5.9", "Line 9"), ("1.6.8", "Line 7"), ("2.5.8", "Line 12")]
+        citation_line = MyCapytain.common.reference.Citation(name="line")
+        citation_poem = MyCapytain.common.reference.Citation(name="poem", child=citation_line)
+        citation_book = MyCapytain.common.reference.Citation(name="book", child=citation_poem)
+        text = MyCapytain.resources.inventory.Text()
+        text.citation = citation_book
+        converted = f_hierarchical_passages_stream((reff for reff in reffs), text)
+        self.assertEqual(next(converted), ("open", "%book|1%", None))
+        self.assertEqual(list(converted), [
+            ("open", "%poem|5%", None),
+            ("passage", "Line 8", "1.5.8-1.5.9"),
+            ("passage", "Line 9", "1.5.9"),
+            ("close", None, None),
+            ("open", "%poem|6%", None),
+            ("passage", "Line 7", "1.6.8"),
+            ("close", None, None),
+            ("close", None, None),
+            ("open", "%book|2%", None),
+            ("open", "%poem|5%", None),
+            ("passage", "Line 12", "2.5.8"),
+            ("close", None, None),
+            ("close", None, None)
+        ])
+
     def test_f_is_str(self):
         """ Test string
         """
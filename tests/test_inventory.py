@@ -0,0 +1,286 @@
+"""
+    Test for the inventory helpers : lookup index, snapshots, compact and streamed inventories
+"""
+import os
+import shutil
+import tempfile
+from mock import patch
+import MyCapytain
+from flask_nemo import Nemo
+from MyCapytain.common.reference import URN
+from MyCapytain.common.utils import NS
+from flask_nemo.filters import f_order_author, f_group_texts
+from flask_nemo.inventory import InventoryIndex, CompactInventory, CompactMetadatum, iter_textgroups, \
+    parse_inventory, snapshot_path, save_snapshot, load_snapshot
+
+from .resources import NemoResource
+
+
+class TestInventoryIndex(NemoResource):
+
+    def setUp(self):
+        super(TestInventoryIndex, self).setUp()
+        self.inventory = MyCapytain.resources.inventory.TextInventory(resource=self.getCapabilities.text)
+        self.index = InventoryIndex(self.inventory)
+
+    def test_normalize(self):
+        """ Normalization should lower and strip each part of the urn """
+        self.assertEqual(InventoryIndex.normalize("greekLIT"), "urn:cts:greeklit")
+        self.assertEqual(InventoryIndex.normalize("greekLIT", " TLG0003"), "urn:cts:greeklit:tlg0003")
+        self.assertEqual(
+            InventoryIndex.normalize("greekLIT", "TLG0003", "tlg001", "perseus-GRC2"),
+            "urn:cts:greeklit:tlg0003.tlg001.perseus-grc2"
+        )
+
+    def test_tables(self):
+        """ Index tables should map every level of the inventory """
+        self.assertEqual(self.index.namespaces, {"latinLit", "greekLit"})
+        self.assertEqual(len(self.index.textgroups), 4)
+        self.assertEqual(len(self.index.collections["latinlit"]), 3)
+        self.assertEqual(
+            [str(work.urn) for work in self.index.works["urn:cts:greeklit:tlg0003"]],
+            ["urn:cts:greekLit:tlg0003.tlg001"]
+        )
+        self.assertEqual(
+            sorted([str(text.urn) for text in self.index.texts["urn:cts:latinlit:phi1294.phi002"]]),
+            ["urn:cts:latinLit:phi1294.phi002.perseus-eng2", "urn:cts:latinLit:phi1294.phi002.perseus-lat2"]
+        )
+
+    def test_get(self):
+        """ Direct access should resolve any level of urn, regardless of case """
+        self.assertIs(
+            self.index.get("latinLit", "PHI1294", "phi002", "perseus-lat2"),
+            self.inventory["urn:cts:latinLit:phi1294.phi002.perseus-lat2"]
+        )
+        self.assertIs(self.index.get("latinLit", "phi1294"), self.inventory["urn:cts:latinLit:phi1294"])
+        self.assertIsNone(self.index.get("latinLit", "phi1294", "phi999"))
+
+    def test_nemo_does_not_scan(self):
+        """ Nemo getters should rely on the index instead of filtering the inventory """
+        with patch('requests.get', return_value=self.getCapabilities):
+            with patch.object(Nemo, "filter_urn") as filter_urn:
+                self.nemo.get_textgroups("latinLit")
+                self.nemo.get_works("latinLit", "phi1294")
+                self.nemo.get_texts("latinLit", "phi1294")
+                self.nemo.get_text("latinLit", "phi1294", "phi002", "perseus-lat2")
+                self.assertFalse(filter_urn.called)
+
+    def test_nemo_rebuilds_index(self):
+        """ An inventory set by hand should be indexed on next access """
+        self.nemo._inventory = self.inventory
+        self.assertIs(self.nemo.get_inventory_index().inventory, self.inventory)
+        self.assertEqual(len(self.nemo.get_textgroups("greekLit")), 1)
+
+
+class TestInventorySnapshot(NemoResource):
+
+    def setUp(self):
+        super(TestInventorySnapshot, self).setUp()
+        self.folder = tempfile.mkdtemp()
+        self.nemo.inventory_snapshot = self.folder
+        self.path = snapshot_path(self.folder, NemoResource.endpoint)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_snapshot_path(self):
+        """ Snapshot path should depend on both api_url and inventory """
+        self.assertEqual(self.path, snapshot_path(self.folder, NemoResource.endpoint, None))
+        self.assertNotEqual(self.path, snapshot_path(self.folder, NemoResource.endpoint, "annotsrc"))
+        self.assertNotEqual(self.path, snapshot_path(self.folder, "http://other.com/api"))
+
+    def test_snapshot_written_and_read(self):
+        """ First load writes the snapshot, which is used by the next instance without waiting for the API """
+        with patch('requests.get', return_value=self.getCapabilities):
+            self.nemo.get_inventory()
+        self.assertTrue(os.path.isfile(self.path))
+
+        nemo = Nemo(api_url=NemoResource.endpoint, inventory_snapshot=self.folder)
+        with patch('requests.get') as patched, patch.object(nemo, "refresh_inventory"):
+            self.assertEqual(len(nemo.get_textgroups("latinLit")), 3)
+            self.assertEqual(
+                str(nemo.get_text("latinLit", "phi1294", "phi002", "perseus-lat2").urn),
+                "urn:cts:latinLit:phi1294.phi002.perseus-lat2"
+            )
+            self.assertFalse(patched.called)
+
+    def test_invalid_snapshot(self):
+        """ An invalid snapshot is ignored and replaced """
+        with open(self.path, "wb") as f:
+            f.write(b"Not a pickle")
+        self.assertIsNone(load_snapshot(self.path))
+
+        with patch('requests.get', return_value=self.getCapabilities) as patched:
+            self.assertEqual(len(self.nemo.get_textgroups()), 4)
+            self.assertTrue(patched.called)
+        self.assertIsInstance(load_snapshot(self.path), InventoryIndex)
+
+    def test_stale_snapshot_revalidated(self):
+        """ A snapshot older than inventory_ttl is served and revalidated in background """
+        inventory = MyCapytain.resources.inventory.TextInventory(resource=self.getCapabilities.text)
+        save_snapshot(InventoryIndex(inventory, fetched=0), self.path)
+        nemo = Nemo(api_url=NemoResource.endpoint, inventory_snapshot=self.folder, inventory_ttl=3600)
+        with patch.object(nemo, "refresh_inventory") as refresh:
+            self.assertEqual(len(nemo.get_textgroups()), 4)
+            refresh.assert_called_once_with(background=True)
+
+    def test_fresh_snapshot_not_revalidated(self):
+        """ A snapshot younger than inventory_ttl is served without requesting the API """
+        inventory = MyCapytain.resources.inventory.TextInventory(resource=self.getCapabilities.text)
+        save_snapshot(InventoryIndex(inventory), self.path)
+        nemo = Nemo(api_url=NemoResource.endpoint, inventory_snapshot=self.folder, inventory_ttl=3600)
+        with patch('requests.get', return_value=self.getCapabilities) as patched:
+            with patch.object(nemo, "refresh_inventory", wraps=nemo.refresh_inventory) as refresh:
+                self.assertEqual(len(nemo.get_textgroups()), 4)
+                self.assertEqual(len(nemo.get_textgroups("latinLit")), 3)
+                self.assertFalse(refresh.called)
+            self.assertFalse(patched.called, "A fresh snapshot should not trigger GetCapabilities")
+
+    def test_snapshot_revalidated_without_ttl(self):
+        """ A snapshot is revalidated once in background even without inventory_ttl, and replaced if stale """
+        save_snapshot(InventoryIndex(
+            MyCapytain.resources.inventory.TextInventory(resource=self.getCapabilities.text), fetched=0, digest="old"
+        ), self.path)
+        nemo = Nemo(api_url=NemoResource.endpoint, inventory_snapshot=self.folder)
+        threads, refresh_inventory = [], nemo.refresh_inventory
+        with patch.object(
+            nemo, "refresh_inventory", side_effect=lambda **kwargs: threads.append(refresh_inventory(**kwargs))
+        ) as refresh:
+            with patch('requests.get', return_value=self.getCapabilities) as patched:
+                self.assertEqual(nemo.get_inventory_index().digest, "old")
+                refresh.assert_called_once_with(background=True)
+                threads[0].join()
+                self.assertTrue(patched.called)
+                self.assertEqual(len(nemo.get_textgroups()), 4)
+                self.assertEqual(refresh.call_count, 1, "Snapshot should be revalidated once")
+        self.assertNotEqual(nemo.get_inventory_index().digest, "old")
+        self.assertEqual(load_snapshot(self.path).digest, nemo.get_inventory_index().digest)
+
+
+class TestCompactInventory(NemoResource):
+
+    def setUp(self):
+        super(TestCompactInventory, self).setUp()
+        self.inventory = MyCapytain.resources.inventory.TextInventory(resource=self.getCapabilities.text)
+        self.compact = CompactInventory(resource=self.getCapabilities.text)
+
+    def test_same_urns(self):
+        """ Compact inventory should index the same resources """
+        self.assertEqual(list(InventoryIndex(self.compact).urns), list(InventoryIndex(self.inventory).urns))
+
+    def test_records(self):
+        """ Compact records should expose what templates and filters read """
+        text = self.compact.textgroups["urn:cts:latinLit:phi1294"].works["urn:cts:latinLit:phi1294.phi002"]\
+            .texts["urn:cts:latinLit:phi1294.phi002.perseus-lat2"]
+        self.assertEqual(str(text.urn), "urn:cts:latinLit:phi1294.phi002.perseus-lat2")
+        self.assertEqual(text.urn.version, "perseus-lat2")
+        self.assertEqual(text.urn.upTo(URN.WORK), "urn:cts:latinLit:phi1294.phi002")
+        self.assertEqual(text.metadata["label"]["eng"], "Epigrammata Label")
+        self.assertEqual(text.parents[0].metadata["title"]["eng"], "Epigrammata")
+        self.assertEqual(text.parents[1].metadata["groupname"]["eng"], "Martial")
+        self.assertEqual([citation.name for citation in text.citation], ["book", "poem", "line"])
+        self.assertEqual(text.subtype, "Edition")
+        with self.assertRaises(KeyError):
+            CompactMetadatum(None)["eng"]
+
+    def test_metadata_languages(self):
+        """ Compact metadata should only answer in the language they were kept in """
+        textgroup = CompactInventory(resource=self.getCapabilities.text, lang="fre")\
+            .textgroups["urn:cts:latinLit:phi0959"]
+        work = textgroup.works["urn:cts:latinLit:phi0959.phi003"]
+        self.assertEqual(work.metadata["title"]["fre"], "Les Fards ou Soins du visage")
+        with self.assertRaises(KeyError):
+            work.metadata["title"]["eng"]
+        self.assertEqual(textgroup.metadata["groupname"]["eng"], "Ovid", "First value found should be kept")
+        with self.assertRaises(KeyError):
+            textgroup.metadata["groupname"]["fre"]
+        self.assertEqual(CompactMetadatum("Martial", "eng")["eng"], "Martial")
+        with self.assertRaises(KeyError):
+            CompactMetadatum("Martial", "eng")["lat"]
+
+    def test_citation(self):
+        """ Compact citation schemes should expose the fields of the MyCapytain ones """
+        text = self.compact.textgroups["urn:cts:latinLit:phi1294"].works["urn:cts:latinLit:phi1294.phi002"]\
+            .texts["urn:cts:latinLit:phi1294.phi002.perseus-lat2"]
+        original = self.inventory["urn:cts:latinLit:phi1294.phi002.perseus-lat2"]
+        self.assertEqual(len(text.citation), 3)
+        for level, expected in zip(text.citation, original.citation):
+            self.assertEqual(
+                (level.name, level.xpath, level.scope, level.refsDecl),
+                (expected.name, expected.xpath, expected.scope, expected.refsDecl)
+            )
+        self.assertIs(text.citation.child.child, list(text.citation)[2])
+        self.assertIsNone(text.citation.child.child.child)
+        self.assertEqual(CompactInventory.make_citation(()), ())
+
+    def test_citations_shared(self):
+        """ Texts with the same citation scheme should share their citation """
+        index = InventoryIndex(self.compact)
+        self.assertIs(
+            index.texts["urn:cts:latinlit:phi0959.phi001"][0].citation,
+            index.texts["urn:cts:latinlit:phi0959.phi008"][0].citation
+        )
+
+    def test_filters(self):
+        """ Filters should accept compact records """
+        index = InventoryIndex(self.compact)
+        self.assertEqual(
+            [str(tg.urn) for tg in f_order_author(index.textgroups)],
+            [str(tg.urn) for tg in f_order_author(InventoryIndex(self.inventory).textgroups)]
+        )
+        self.assertEqual(
+            [str(tg.urn) for tg in f_order_author(index.textgroups, lang="fre")],
+            sorted(str(tg.urn) for tg in index.textgroups), "Missing groupnames should fall back to the URN"
+        )
+        texts = index.texts["urn:cts:latinlit:phi1294.phi002"]
+        self.assertEqual(f_group_texts(texts), [(texts[0].parents[0], texts)])
+
+    def test_nemo_compact_inventory(self):
+        """ Nemo should build a compact inventory when asked to """
+        nemo = Nemo(api_url=NemoResource.endpoint, compact_inventory=True)
+        with patch('requests.get', return_value=self.getCapabilities):
+            self.assertIsInstance(nemo.get_inventory(), CompactInventory)
+            self.assertEqual(
+                nemo.get_text("latinLit", "phi1294", "phi002", "perseus-lat2").metadata["label"]["eng"],
+                "Epigrammata Label"
+            )
+
+
+class TestStreamingInventory(NemoResource):
+
+    def test_iter_textgroups(self):
+        """ Textgroups should be yielded complete, and released once consumed """
+        nodes = []
+        for node in iter_textgroups(self.getCapabilities.text, chunk_size=512):
+            self.assertGreater(len(node.xpath("ti:groupname", namespaces=NS)), 0)
+            if len(nodes) > 0:
+                self.assertIs(node.getprevious(), nodes[-1])
+                self.assertIsNone(nodes[-1].getprevious(), "Older textgroups should have been removed from the tree")
+            nodes.append(node)
+        self.assertEqual(len(nodes), 4)
+        self.assertEqual(len(nodes[0]), 0, "Consumed nodes should be cleared")
+
+    def test_iter_textgroups_keep(self):
+        """ Kept textgroups should keep their content """
+        nodes = list(iter_textgroups(self.getCapabilities.text, keep=True, chunk_size=512))
+        self.assertEqual([len(node.xpath("ti:work", namespaces=NS)) for node in nodes], [1, 10, 1, 1])
+
+    def test_parse_inventory(self):
+        """ Streamed inventories should be equivalent to the ones parsed at once """
+        inventory = MyCapytain.resources.inventory.TextInventory(resource=self.getCapabilities.text)
+        index = parse_inventory(self.getCapabilities.text, digest="abc")
+        self.assertEqual(index.digest, "abc")
+        self.assertEqual(list(index.urns), list(InventoryIndex(inventory).urns))
+        self.assertIs(index.inventory.textgroups["urn:cts:latinLit:phi1294"], index.get("latinLit", "phi1294"))
+        self.assertEqual(
+            index.inventory["urn:cts:latinLit:phi1294.phi002.perseus-lat2"].metadata["label"]["eng"],
+            "Epigrammata Label"
+        )
+        self.assertEqual(
+            [citation.name for citation in index.get("latinLit", "phi1294", "phi002", "perseus-lat2").citation],
+            ["book", "poem", "line"]
+        )
+
+        compact = parse_inventory(self.getCapabilities.text, compact=True)
+        self.assertIsInstance(compact.inventory, CompactInventory)
+        self.assertEqual(list(compact.urns), list(index.urns))
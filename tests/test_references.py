@@ -0,0 +1,116 @@
+"""
+    Test for the local representation of references
+"""
+import pickle
+import sys
+from array import array
+from unittest import TestCase
+from flask_nemo.cache import LRUCache
+from flask_nemo.references import ReferenceTree, ReferenceArray, ReferenceList
+
+
+class TestReferenceTree(TestCase):
+
+    def setUp(self):
+        self.urn = "urn:cts:latinLit:phi1294.phi002.perseus-lat2"
+        self.tree = ReferenceTree(
+            self.urn,
+            [self.urn + ":" + reference for reference in ["1.pr.1", "1.pr.2", "1.1.1", "1.1.2", "1.1.3", "2.1.1"]],
+            3
+        )
+
+    def test_levels(self):
+        """ Shallower levels should be derived from the deepest one, in the order of the text """
+        self.assertEqual(self.tree.level(1), ["1", "2"])
+        self.assertEqual(self.tree.level(2), ["1.pr", "1.1", "2.1"])
+        self.assertEqual(self.tree.level(3), ["1.pr.1", "1.pr.2", "1.1.1", "1.1.2", "1.1.3", "2.1.1"])
+        self.assertEqual(self.tree.urns(2)[0], "urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.pr")
+        self.assertEqual([self.tree.count(level) for level in range(1, 4)], [2, 3, 6])
+
+    def test_levels_not_shared(self):
+        """ Returned lists should be copies """
+        self.tree.level(1).append("3")
+        self.assertEqual(self.tree.level(1), ["1", "2"])
+
+    def test_children(self):
+        """ Children should be answered from the tree """
+        self.assertEqual(self.tree.children(), ["1", "2"])
+        self.assertEqual(self.tree.children("1.1"), ["1.1.1", "1.1.2", "1.1.3"])
+        self.assertEqual(self.tree.children("1.1.1"), [])
+        self.assertEqual(self.tree.children("3"), [])
+
+    def test_range(self):
+        """ Ranges should be answered at the level of their start """
+        self.assertEqual(self.tree.range("1.pr.2", "1.1.2"), ["1.pr.2", "1.1.1", "1.1.2"])
+        self.assertEqual(self.tree.range("1.pr", "2.1"), ["1.pr", "1.1", "2.1"])
+        self.assertEqual(self.tree.range("1.1.2", "1.pr.1"), [])
+        self.assertEqual(self.tree.range("1.1.2", "9.9.9"), [])
+
+    def test_neighbours(self):
+        """ Neighbours should be found at the same level and with the same size """
+        self.assertEqual(self.tree.neighbours("1.pr.2"), ("1.pr.1", "1.1.1"))
+        self.assertEqual(self.tree.neighbours("1.pr.1"), (None, "1.pr.2"))
+        self.assertEqual(self.tree.neighbours("2.1.1"), ("1.1.3", None))
+        self.assertEqual(self.tree.neighbours("1.1"), ("1.pr", "2.1"))
+        self.assertEqual(self.tree.neighbours("1.pr.2", "1.1.1"), ("1.pr.1", "1.1.2-1.1.3"))
+        self.assertEqual(self.tree.neighbours("1.1.2", "1.1.3"), ("1.pr.2-1.1.1", "2.1.1"))
+
+    def test_neighbours_unknown(self):
+        """ Unknown references and ranges across levels should have no neighbours """
+        self.assertIsNone(self.tree.neighbours("9.9.9"))
+        self.assertIsNone(self.tree.neighbours("1.1.1", "2.1"))
+        self.assertIsNone(self.tree.neighbours("1.1.2", "1.1.1"))
+
+    def test_array(self):
+        """ Numeric citation parts should be packed into arrays, others kept as strings """
+        references = self.tree.array(3)
+        self.assertEqual(len(references), 6)
+        self.assertIsInstance(references.columns[0], array)
+        self.assertEqual(references.columns[1], ["pr", "pr", "1", "1", "1", "1"])
+        self.assertIsInstance(references.columns[2], array)
+        self.assertEqual([references.reference(index) for index in range(6)], self.tree.level(3))
+        self.assertEqual(references.boundaries(2), [0, 2, 5])
+        self.assertEqual(references.groups(2, 2), [(0, 2), (2, 4), (4, 5), (5, 6)])
+        self.assertEqual(references.groups(0, 4), [(0, 4), (4, 6)])
+
+    def test_array_pack(self):
+        """ Parts which would not be written back the same should not be packed """
+        self.assertIsInstance(ReferenceArray.pack(["1", "12"]), array)
+        self.assertEqual(ReferenceArray.pack(["1", "01"]), ["1", "01"])
+        self.assertEqual(ReferenceArray.pack(["1", "+2"]), ["1", "+2"])
+        self.assertEqual(ReferenceArray.pack(["1", "9" * 30]), ["1", "9" * 30])
+
+    def test_urns_array(self):
+        """ URNs of a level should give access to their compact representation """
+        urns = self.tree.urns(2)
+        self.assertIsInstance(urns, ReferenceList)
+        self.assertIs(urns.array, self.tree.array(2))
+        self.assertEqual(urns.array.reference(1), "1.1")
+
+    def test_digest(self):
+        """ Trees should have the digest of the references they were built from """
+        references = self.tree.urns(3)
+        self.assertEqual(ReferenceTree(self.tree.urn, references, 3).digest, self.tree.digest)
+        self.assertEqual(ReferenceTree(self.tree.urn, self.tree.level(3), 3).digest, self.tree.digest)
+        self.assertNotEqual(ReferenceTree(self.tree.urn, references[1:], 3).digest, self.tree.digest)
+
+    def test_sizeof(self):
+        """ Size of a tree should account for its references, so that caches bounded in size hold it """
+        references = [
+            "{0}.{1}.{2}".format(book, poem, line) for book in range(10) for poem in range(10) for line in range(100)
+        ]
+        tree = ReferenceTree(self.urn, references, 3)
+        self.assertGreater(sys.getsizeof(tree), 10000 * sys.getsizeof("1"))
+        self.assertGreater(sys.getsizeof(tree), sys.getsizeof(self.tree))
+        cache = LRUCache(max_size=sys.getsizeof(tree) - 1)
+        cache.set("reffs", tree)
+        self.assertIsNone(cache.get("reffs"), "Trees bigger than the cache should not be kept")
+        self.assertEqual(cache.size, 0)
+
+    def test_pickle(self):
+        """ Trees should be stored in persistent caches """
+        self.tree.level(2)
+        tree = pickle.loads(pickle.dumps(self.tree))
+        self.assertEqual(tree.digest, self.tree.digest)
+        self.assertEqual(tree.level(2), self.tree.level(2))
+        self.assertEqual(tree.depth, 3)
@@ -0,0 +1,200 @@
+"""
+    Test for the retriever proxies : cached replies
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+from mock import patch, call, Mock
+import MyCapytain
+from flask_nemo import Nemo
+from flask_nemo.retriever import CachedRetriever, CoalescingRetriever
+from flask_nemo.cache import SQLiteCache, TieredCache, NamespacedCache
+
+from .resources import NemoResource
+
+
+class TestCachedRetriever(NemoResource):
+
+    def setUp(self):
+        super(TestCachedRetriever, self).setUp()
+        self.folder = tempfile.mkdtemp()
+        self.cache = os.path.join(self.folder, "cache.sqlite")
+        self.retriever = CachedRetriever(
+            MyCapytain.retrievers.cts5.CTS(NemoResource.endpoint), cache=SQLiteCache(self.cache), expire=3600
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_replies_cached(self):
+        """ Identical requests should be sent only once """
+        with patch('requests.get', return_value=self.getPassage) as patched:
+            first = self.retriever.getPassage(urn="urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.pr")
+            second = self.retriever.getPassage(urn="urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.pr")
+            self.assertEqual(first, second)
+            self.retriever.getPassage(urn="urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.1")
+            self.assertEqual(patched.call_count, 2)
+        self.assertEqual((self.retriever.hits, self.retriever.misses), (1, 2))
+
+    def test_replies_persisted(self):
+        """ Replies should be available to another instance using the same file """
+        with patch('requests.get', return_value=self.getPrevNext):
+            self.retriever.getPrevNextUrn(urn="urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.pr")
+        retriever = CachedRetriever(
+            MyCapytain.retrievers.cts5.CTS(NemoResource.endpoint), cache=SQLiteCache(self.cache)
+        )
+        with patch('requests.get') as patched:
+            self.assertEqual(
+                retriever.getPrevNextUrn(urn="urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.pr"),
+                self.getPrevNext.text
+            )
+            self.assertFalse(patched.called)
+
+    def test_replies_expire(self):
+        """ Expired replies should be requested again """
+        with patch('requests.get', return_value=self.getValidReff_single) as patched:
+            with patch("flask_nemo.cache.time.time", return_value=1000):
+                self.retriever.getValidReff(urn="urn:cts:latinLit:phi1294.phi002.perseus-lat2", level=3)
+            with patch("flask_nemo.cache.time.time", return_value=4599):
+                self.retriever.getValidReff(urn="urn:cts:latinLit:phi1294.phi002.perseus-lat2", level=3)
+                self.assertEqual(patched.call_count, 1)
+            with patch("flask_nemo.cache.time.time", return_value=4601):
+                self.retriever.getValidReff(urn="urn:cts:latinLit:phi1294.phi002.perseus-lat2", level=3)
+                self.assertEqual(patched.call_count, 2)
+
+    def test_errors_not_cached(self):
+        """ Error replies and failing calls should be requested again """
+        errors = [
+            Mock(text="<CTSError><message>Invalid URN</message><code>3</code></CTSError>"),
+            Mock(text="<!DOCTYPE html><html><body>Service Unavailable</body></html>"),
+            Mock(text="")
+        ]
+        for error in errors:
+            with patch('requests.get', return_value=error) as patched:
+                self.retriever.getPassage(urn="urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.pr")
+                self.retriever.getPassage(urn="urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.pr")
+                self.assertEqual(patched.call_count, 2, "Error replies should not be cached")
+        with patch('requests.get', side_effect=ValueError("API is down")):
+            with self.assertRaises(ValueError):
+                self.retriever.getPassage(urn="urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.pr")
+        with patch('requests.get', return_value=self.getPassage) as patched:
+            self.retriever.getPassage(urn="urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.pr")
+            self.retriever.getPassage(urn="urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.pr")
+            self.assertEqual(patched.call_count, 1)
+
+    def test_inventory_is_part_of_key(self):
+        """ The same request on another inventory should not be served from the cache """
+        with patch('requests.get', return_value=self.getPassage) as patched:
+            self.retriever.getPassage(urn="urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.pr")
+            self.retriever.inventory = "annotsrc"
+            self.retriever.getPassage(urn="urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.pr")
+            self.assertEqual(patched.call_count, 2)
+            self.assertEqual(patched.call_args, call(NemoResource.endpoint, params={
+                "inv": "annotsrc", "request": "GetPassage", "urn": "urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.pr"
+            }))
+
+    def test_capabilities_not_cached(self):
+        """ GetCapabilities should always be forwarded """
+        with patch('requests.get', return_value=self.getCapabilities) as patched:
+            self.retriever.getCapabilities()
+            self.retriever.getCapabilities()
+            self.assertEqual(patched.call_count, 2)
+        self.assertEqual((self.retriever.hits, self.retriever.misses), (0, 0))
+
+    def test_nemo_cache(self):
+        """ Nemo should wrap its retriever when a cache file is given """
+        nemo = Nemo(
+            api_url=NemoResource.endpoint, cache=self.cache, expire=60, cache_timeouts={"retriever": 30},
+            inventory="annotsrc"
+        )
+        self.assertIsInstance(nemo.retriever, CachedRetriever)
+        self.assertIsInstance(nemo.cache, TieredCache)
+        self.assertIsInstance(nemo.retriever.storage, NamespacedCache)
+        self.assertIs(nemo.retriever.storage, nemo.get_cache("retriever"))
+        self.assertEqual(nemo.get_cache("retriever").default_timeout, 30)
+        self.assertEqual(nemo.get_cache("passages").default_timeout, 60)
+        with patch('requests.get', return_value=self.getPassage) as patched:
+            nemo.get_passage("latinLit", "phi1294", "phi002", "perseus-lat2", "1.pr")
+            passage = nemo.get_passage("latinLit", "phi1294", "phi002", "perseus-lat2", "1.pr")
+            self.assertEqual(patched.call_count, 1)
+            self.assertEqual(
+                len(passage.xml.xpath("//tei:l[@n]", namespaces={"tei": "http://www.tei-c.org/ns/1.0"})), 6
+            )
+
+        self.assertIsNone(Nemo(api_url=NemoResource.endpoint).cache)
+        self.assertIsNone(Nemo(api_url=NemoResource.endpoint).get_cache("retriever"))
+
+
+class TestCoalescingRetriever(NemoResource):
+
+    def setUp(self):
+        super(TestCoalescingRetriever, self).setUp()
+        self.retriever = CoalescingRetriever(MyCapytain.retrievers.cts5.CTS(NemoResource.endpoint))
+        self.started, self.release = threading.Event(), threading.Event()
+
+    def slow(self, reply):
+        """ Build a requests.get replacement which blocks until self.release is set """
+        def get(*args, **kwargs):
+            self.started.set()
+            self.release.wait(5)
+            if isinstance(reply, Exception):
+                raise reply
+            return reply
+        return get
+
+    def run_concurrently(self, callers, function):
+        """ Run function in callers threads while the first one is blocked in the API """
+        results = []
+
+        def call():
+            try:
+                results.append(function())
+            except Exception as E:
+                results.append(E)
+        threads = [threading.Thread(target=call) for _ in range(callers)]
+        threads[0].start()
+        self.started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        deadline = time.time() + 5
+        while self.retriever.flight.coalesced < callers - 1 and time.time() < deadline:
+            time.sleep(0.01)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    def test_concurrent_requests_coalesced(self):
+        """ Identical concurrent requests should be sent once and share the reply """
+        with patch('requests.get', side_effect=self.slow(self.getPassage)) as patched:
+            results = self.run_concurrently(
+                5, lambda: self.retriever.getPassage(urn="urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.pr")
+            )
+            self.assertEqual(patched.call_count, 1)
+        self.assertEqual(results, [self.getPassage.text] * 5)
+        self.assertEqual(self.retriever.flight.coalesced, 4)
+
+        with patch('requests.get', return_value=self.getPassage) as patched:
+            self.retriever.getPassage(urn="urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.pr")
+            self.assertEqual(patched.call_count, 1, "Finished requests should not be reused")
+
+    def test_errors_shared(self):
+        """ Callers waiting for a failing request should receive its exception """
+        with patch('requests.get', side_effect=self.slow(ValueError("API down"))) as patched:
+            results = self.run_concurrently(3, lambda: self.retriever.getCapabilities(inventory="annotsrc"))
+            self.assertEqual(patched.call_count, 1)
+        self.assertEqual([str(result) for result in results], ["API down"] * 3)
+
+    def test_nemo_coalesce(self):
+        """ Nemo should put the coalescing layer in front of the cache when asked to """
+        nemo = Nemo(api_url=NemoResource.endpoint, coalesce=True)
+        self.assertIsInstance(nemo.retriever, CoalescingRetriever)
+        folder = tempfile.mkdtemp()
+        try:
+            nemo = Nemo(api_url=NemoResource.endpoint, coalesce=True, cache=os.path.join(folder, "cache.sqlite"))
+            self.assertIsInstance(nemo.retriever.retriever, CachedRetriever)
+        finally:
+            shutil.rmtree(folder)
+        self.assertNotIsInstance(Nemo(api_url=NemoResource.endpoint).retriever, CoalescingRetriever)
@@ -2,15 +2,19 @@
     Test for routes functions : ensure responses are correct with mocked call to API
 """
 
-from .resources import NemoResource
+import json
+from .resources import NemoResource, RequestPatchChained
 from .test_controller import NemoTestControllers
 from flask_nemo import Nemo
+import flask_nemo.filters
+from flask_nemo.cache import LRUCache
 from flask_nemo.default import Breadcrumb
 from flask import Markup, Flask
 from lxml import etree
 from mock import Mock, patch, call
 import MyCapytain
 from jinja2.exceptions import TemplateNotFound
+from werkzeug.exceptions import NotFound
 
 
 class NemoTestRoutes(NemoResource):
@@ -84,6 +88,152 @@ class NemoTestRoutes(NemoResource):
             self.assertIsInstance(view["version"], MyCapytain.resources.inventory.Text)
             self.assertEqual(view["reffs"][0], ("1.pr.1", "1.pr.1"))
 
+    def test_route_version_reffs_cached(self):
+        """ References should be requested once per text and level when Nemo has a cache
+        """
+        nemo = Nemo(api_url=NemoTestControllers.endpoint, inventory="annotsrc", cache=LRUCache())
+        with patch('requests.get', return_value=self.getValidReff) as patched:
+            view = nemo.r_version("latinLit", "phi1294", "phi002", "perseus-lat2")
+            self.assertEqual(patched.call_count, 2)
+        with patch('requests.get') as patched:
+            self.assertEqual(nemo.r_version("latinLit", "phi1294", "phi002", "perseus-lat2")["reffs"], view["reffs"])
+            self.assertFalse(patched.called)
+        self.assertEqual(nemo.cache_stats()["reffs"]["hits"], 1)
+        self.assertEqual(
+            nemo.get_valid_reff("urn:cts:latinLit:phi1294.phi002.perseus-lat2", 3)[0],
+            "urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.pr.1"
+        )
+
+    def test_route_version_chunks_tree(self):
+        """ Cached chunks of references read from the reference tree should be checked against its digest
+        """
+        nemo = Nemo(api_url=NemoTestControllers.endpoint, inventory="annotsrc", cache=LRUCache())
+        with patch('requests.get', return_value=self.getValidReff):
+            view = nemo.r_version("latinLit", "phi1294", "phi002", "perseus-lat2")
+        with patch.object(nemo, "get_valid_reff", wraps=nemo.get_valid_reff) as get_valid_reff:
+            self.assertEqual(nemo.r_version("latinLit", "phi1294", "phi002", "perseus-lat2")["reffs"], view["reffs"])
+            self.assertEqual(get_valid_reff.call_count, 0, "References should not be built on cache hit")
+        self.assertEqual(nemo.cache_stats()["chunks"]["hits"], 1)
+
+        tree = nemo.get_reference_tree("urn:cts:latinLit:phi1294.phi002.perseus-lat2", view["version"].citation)
+        tree.digest = "other references"
+        with patch.object(nemo, "get_valid_reff", wraps=nemo.get_valid_reff) as get_valid_reff:
+            self.assertEqual(nemo.r_version("latinLit", "phi1294", "phi002", "perseus-lat2")["reffs"], view["reffs"])
+            self.assertGreater(get_valid_reff.call_count, 0, "Chunks of another tree should be computed again")
+
+    def test_route_version_hierarchy_cached(self):
+        """ The citation hierarchy of chunks should be computed once when Nemo has a cache
+        """
+        nemo = Nemo(api_url=NemoTestControllers.endpoint, inventory="annotsrc", cache=LRUCache())
+        with patch('requests.get', return_value=self.getValidReff):
+            view = nemo.r_version("latinLit", "phi1294", "phi002", "perseus-lat2")
+            self.assertEqual(view["hierarchy"][0:3], [
+                ("open", "%book|1%", None), ("open", "%poem|pr%", None), ("passage", "1.pr.1", "1.pr.1")
+            ])
+            self.assertEqual(view["hierarchy"], list(
+                flask_nemo.filters.f_hierarchical_passages_stream(view["reffs"], view["version"])
+            ))
+            self.assertEqual(nemo.r_version("latinLit", "phi1294", "phi002", "perseus-lat2")["hierarchy"], view["hierarchy"])
+        self.assertEqual(nemo.cache_stats()["hierarchies"], {"hits": 1, "misses": 1, "ratio": 0.5})
+        with patch('requests.get', return_value=RequestPatchChained([self.getCapabilities, self.getValidReff_single])):
+            self.assertNotIn("hierarchy", self.nemo.r_version("latinLit", "phi1294", "phi002", "perseus-lat2"))
+
+    def test_reffs_levels_from_tree(self):
+        """ Every level should be answered from the deepest one when Nemo has a cache
+        """
+        nemo = Nemo(api_url=NemoTestControllers.endpoint, inventory="annotsrc", cache=LRUCache())
+        with patch('requests.get', return_value=self.getValidReff) as patched:
+            text, reffs = nemo.get_reffs("latinLit", "phi1294", "phi002", "perseus-lat2")
+            self.assertEqual(reffs(level=2)[0:2], [
+                "urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.pr", "urn:cts:latinLit:phi1294.phi002.perseus-lat2:1.1"
+            ])
+            self.assertEqual(len(reffs(level=1)), 14)
+            self.assertEqual(len(reffs(level=3)), nemo.get_reference_tree(str(text.urn), text.citation).count(3))
+            self.assertEqual(patched.call_count, 2)
+            self.assertEqual(patched.call_args[1]["params"]["level"], "3")
+
+    def test_reffs_shallow_levels_from_tree(self):
+        """ Shallow levels should be derived from the tree of the deepest one, in the order of the text
+        """
+        urn = "urn:cts:latinLit:phi1294.phi002.perseus-lat2"
+        nemo = Nemo(api_url=NemoTestControllers.endpoint, inventory="annotsrc", cache=LRUCache())
+        with patch('requests.get', return_value=self.getValidReff) as patched:
+            text, reffs = nemo.get_reffs("latinLit", "phi1294", "phi002", "perseus-lat2")
+            self.assertEqual(reffs(level=1), [urn + ":" + str(book) for book in range(1, 15)])
+            books = [reff.split(":")[-1].split(".")[0] for reff in reffs(level=2)]
+            self.assertEqual(books, sorted(books, key=int), "Poems should be listed book after book")
+            self.assertEqual(reffs(level=2)[-1], urn + ":14.223")
+            self.assertEqual(reffs(level=3)[-1], urn + ":14.223.2")
+            self.assertEqual(
+                [reff.split(":")[-1] for reff in reffs(level=3) if reff.split(":")[-1].startswith("1.pr.")],
+                ["1.pr.{0}".format(line) for line in range(1, 23)]
+            )
+            self.assertEqual(reffs(level=2).array.reference(0), "1.pr")
+            self.assertEqual(patched.call_count, 2, "Only the deepest level should be requested")
+
+    def test_reffs_prevnext_boundaries(self):
+        """ Passages at the boundaries of the text should have no previous or next passage
+        """
+        urn = "urn:cts:latinLit:phi1294.phi002.perseus-lat2"
+        nemo = Nemo(
+            api_url=NemoTestControllers.endpoint, inventory="annotsrc", cache=LRUCache(), local_prevnext=True
+        )
+        callback = Mock(return_value=(None, None))
+        with patch('requests.get', return_value=self.getValidReff) as patched:
+            for reference, expected in [
+                ("1.pr.1", (None, "1.pr.2")),
+                ("14.223.2", ("14.223.1", None)),
+                ("1.pr.1-1.pr.2", (None, "1.pr.3-1.pr.4")),
+                ("14.223.1-14.223.2", ("14.222.1-14.222.2", None)),
+                ("1.pr", (None, "1.1")),
+                ("14.223", ("14.222", None)),
+                ("1", (None, "2")),
+                ("14", ("13", None))
+            ]:
+                passage = Mock(urn=MyCapytain.common.reference.URN(urn + ":" + reference))
+                self.assertEqual(nemo.getprevnext(passage, callback), expected, reference)
+            self.assertFalse(callback.called, "Neighbours should not be requested from the API")
+            self.assertEqual(patched.call_count, 2)
+
+            passage = Mock(urn=MyCapytain.common.reference.URN(urn + ":15.1"), prev=None, next=None)
+            self.assertEqual(nemo.getprevnext(passage, callback), (None, None))
+            self.assertTrue(callback.called, "Unknown references should fall back to the API")
+
+    def test_route_version_reffs(self):
+        """ Passages below a reference of the table of contents should be served from the cached references
+        """
+        nemo = Nemo(
+            app=Flask(__name__), api_url=NemoTestControllers.endpoint, inventory="annotsrc", cache=LRUCache(),
+            toc_depth=1
+        )
+        with patch('requests.get', return_value=self.getValidReff) as patched:
+            view = nemo.r_version("latinLit", "phi1294", "phi002", "perseus-lat2")
+            self.assertEqual(view["reffs"][0], ("1", "%book|1%"))
+            self.assertEqual(len(view["reffs"]), 14)
+
+            with nemo.app.test_request_context("/?format=fragment"):
+                view = nemo.r_version_reffs("latinLit", "phi1294", "phi002", "perseus-lat2", "1")
+                self.assertEqual(view["template"], "main::reffs.html")
+                self.assertEqual(view["depth"], 1)
+                self.assertEqual(view["reffs"][0], ("1.pr.1", "1.pr.1"))
+                self.assertTrue(all(reff.startswith("1.") for reff, _ in view["reffs"]))
+
+            with nemo.app.test_request_context("/?format=json"):
+                response = nemo.r_version_reffs("latinLit", "phi1294", "phi002", "perseus-lat2", "14")
+                data = json.loads(response.get_data(as_text=True))
+                self.assertEqual(data["urn"], "urn:cts:latinLit:phi1294.phi002.perseus-lat2")
+                self.assertEqual(data["reference"], "14")
+                self.assertEqual(data["reffs"][-1], ["14.223.2", "14.223.2"])
+
+            with nemo.app.test_request_context("/"):
+                view = nemo.r_version_reffs("latinLit", "phi1294", "phi002", "perseus-lat2", "1.pr")
+                self.assertEqual(view["template"], "main::version.html")
+                self.assertEqual(view["depth"], 0)
+                self.assertEqual(len(view["reffs"]), 22)
+                with self.assertRaises(NotFound):
+                    nemo.r_version_reffs("latinLit", "phi1294", "phi002", "perseus-lat2", "15")
+            self.assertEqual(patched.call_count, 2, "References should be requested once")
+
     def test_route_text_without_transform(self):
         """ Try to get valid reffs
         """
@@ -119,6 +269,110 @@ class NemoTestRoutes(NemoResource):
                 6
             )
 
+    def test_route_passage_unknown_text(self):
+        """ Passages of texts missing from the inventory should not be requested from the API
+        """
+        nemo = Nemo(api_url=NemoTestControllers.endpoint, inventory="annotsrc", fetch_workers=4)
+        with patch('requests.get', return_value=self.getCapabilities) as patched:
+            with self.assertRaises(NotFound):
+                nemo.r_passage("latinLit", "phi1294", "phi002", "perseus-lat9", "1.pr.1")
+            self.assertEqual(
+                [request[1]["params"]["request"] for request in patched.call_args_list], ["GetCapabilities"]
+            )
+
+    def test_route_passage_concurrent(self):
+        """ With fetch_workers, passage and siblings should be requested at the same time with the same result
+        """
+        nemo = Nemo(
+            api_url=NemoTestControllers.endpoint,
+            inventory="annotsrc",
+            fetch_workers=4
+        )
+        replies = {
+            "GetCapabilities": self.getCapabilities, "GetPassage": self.getPassage, "GetPrevNextUrn": self.getPrevNext
+        }
+        with patch('requests.get', side_effect=lambda *args, **kwargs: replies[kwargs["params"]["request"]]) as patched:
+            view = nemo.r_passage("latinLit", "phi1294", "phi002", "perseus-lat2", "1.pr.1")
+            self.assertEqual(
+                sorted(request[1]["params"]["request"] for request in patched.call_args_list),
+                ["GetCapabilities", "GetPassage", "GetPrevNextUrn"]
+            )
+            self.assertEqual(view["prev"], "1.1.1")
+            self.assertEqual(view["next"], "1.1.3")
+            xml = etree.fromstring(str(view["text_passage"]))
+            self.assertEqual(len(xml.xpath("//tei:l", namespaces={"tei": "http://www.tei-c.org/ns/1.0"})), 6)
+
+    def test_route_passage_cached(self):
+        """ Transformed passages should be served from the cache without requesting the API again
+        """
+        nemo = Nemo(
+            api_url=NemoTestControllers.endpoint,
+            inventory="annotsrc",
+            cache=LRUCache(),
+            transform={"default": NemoTestControllers.body_xsl}
+        )
+        with patch('requests.get', return_value=self.getPassage_Route) as patched:
+            view = nemo.r_passage("latinLit", "phi1294", "phi002", "perseus-lat2", "1.pr.1")
+            self.assertEqual(patched.call_count, 3)
+        with patch('requests.get') as patched:
+            cached = nemo.r_passage("latinLit", "phi1294", "phi002", "perseus-lat2", "1.pr.1")
+            self.assertFalse(patched.called)
+        self.assertEqual(cached, view)
+        self.assertIsInstance(cached["text_passage"], Markup)
+        self.assertEqual(nemo.cache_stats()["passages"], {"hits": 1, "misses": 1, "ratio": 0.5})
+
+        with patch('requests.get', return_value=RequestPatchChained([self.getPassage, self.getPrevNext])) as patched:
+            nemo.r_passage("latinLit", "phi1294", "phi002", "perseus-lat2", "1.pr.2")
+            self.assertEqual(patched.call_count, 2, "Other passages should not be served from the cache")
+
+    def test_route_passage_local_prevnext(self):
+        """ With local_prevnext, siblings should be computed from the references instead of GetPrevNextUrn
+        """
+        nemo = Nemo(api_url=NemoTestControllers.endpoint, inventory="annotsrc", cache=LRUCache(), local_prevnext=True)
+        with patch('requests.get', return_value=RequestPatchChained([
+            self.getCapabilities, self.getPassage, self.getValidReff_single
+        ])) as patched:
+            view = nemo.r_passage("latinLit", "phi1294", "phi002", "perseus-lat2", "1.pr.2")
+            self.assertEqual(patched.call_count, 3)
+            self.assertEqual(patched.call_args[1]["params"]["request"], "GetValidReff")
+            self.assertEqual((view["prev"], view["next"]), ("1.pr.1", "1.pr.3"))
+
+        with patch('requests.get', return_value=self.getPassage) as patched:
+            view = nemo.r_passage("latinLit", "phi1294", "phi002", "perseus-lat2", "1.pr.1-1.pr.2")
+            self.assertEqual(patched.call_count, 1, "References should be read from the cache")
+            self.assertEqual((view["prev"], view["next"]), (None, "1.pr.3-1.pr.4"))
+
+    def test_route_passage_local_prevnext_chunks(self):
+        """ With local_prevnext, siblings of a chunk should be the chunks around it
+        """
+        nemo = Nemo(
+            api_url=NemoTestControllers.endpoint, inventory="annotsrc", cache=LRUCache(), local_prevnext=True,
+            chunker={"default": lambda text, reffs: [
+                ("1.pr.1-1.pr.3", "1.pr.1"), ("1.pr.4-1.pr.22", "1.pr.4"), ("1.1.1-1.1.6", "1.1.1")
+            ]}
+        )
+        with patch('requests.get', return_value=self.getPassage_Capabilities) as patched:
+            view = nemo.r_passage("latinLit", "phi1294", "phi002", "perseus-lat2", "1.pr.4-1.pr.22")
+            self.assertEqual(patched.call_count, 2)
+            self.assertEqual((view["prev"], view["next"]), ("1.pr.1-1.pr.3", "1.1.1-1.1.6"))
+
+    def test_route_passage_plus(self):
+        """ With passage_plus, the passage and its siblings should come from a single GetPassagePlus request
+        """
+        nemo = Nemo(
+            api_url=NemoTestControllers.endpoint,
+            inventory="annotsrc",
+            passage_plus=True
+        )
+        with patch('requests.get', return_value=self.getPassagePlus_Route) as patched:
+            view = nemo.r_passage("latinLit", "phi1294", "phi002", "perseus-lat2", "1.1")
+            self.assertEqual(patched.call_count, 2)
+            self.assertEqual(patched.call_args[1]["params"]["request"], "GetPassagePlus")
+            self.assertEqual(view["prev"], "1.pr")
+            self.assertEqual(view["next"], "1.2")
+            xml = etree.fromstring(str(view["text_passage"]))
+            self.assertEqual(len(xml.xpath("//tei:l", namespaces={"tei": "http://www.tei-c.org/ns/1.0"})), 6)
+
     def test_route_passage_with_transform(self):
         """ Try with a non xslt just to be sure
         """
@@ -158,6 +412,33 @@ class NemoTestRoutes(NemoResource):
                 1
             )
 
+    def test_route_passage_with_xslt_processes(self):
+        """ Passages transformed by worker processes should be identical to passages transformed in process
+        """
+        pooled = Nemo(
+            api_url=NemoTestControllers.endpoint,
+            inventory="annotsrc",
+            transform={"default": NemoTestControllers.body_xsl},
+            xslt_processes=1
+        )
+        inline = Nemo(
+            api_url=NemoTestControllers.endpoint,
+            inventory="annotsrc",
+            transform={"default": NemoTestControllers.body_xsl}
+        )
+        try:
+            with patch('requests.get', return_value=self.getPassage_Route):
+                view = pooled.r_passage("latinLit", "phi1294", "phi002", "perseus-lat2", "1.pr.1")
+            self.getPassage_Route.resource = [self.getCapabilities.text, self.getPassage.text, self.getPrevNext.text]
+            with patch('requests.get', return_value=self.getPassage_Route):
+                expected = inline.r_passage("latinLit", "phi1294", "phi002", "perseus-lat2", "1.pr.1")
+            self.assertEqual(view["text_passage"], expected["text_passage"])
+            self.assertEqual((view["prev"], view["next"]), (expected["prev"], expected["next"]))
+        finally:
+            with patch.object(pooled.xslt_pool, "close", wraps=pooled.xslt_pool.close) as close:
+                pooled.close()
+                close.assert_called_once_with()
+
     def test_route_passage_with_urn_xslt(self):
         nemo = Nemo(
             api_url=NemoTestControllers.endpoint,
@@ -230,7 +511,7 @@ class NemoTestRoutes(NemoResource):
                 self.nemo.render("main::index.html", test="123", value="value", url={})
                 patched.assert_called_once_with(
                     "main::index.html",
-                    collections={'latinLit', 'greekLit'},
+                    collections=['greekLit', 'latinLit'],
                     test="123",
                     value="value",
                     lang="eng",
@@ -254,7 +535,7 @@ class NemoTestRoutes(NemoResource):
                     })
                 patched.assert_called_once_with(
                     "index.html",
-                    collections={'latinLit', 'greekLit'},
+                    collections=['greekLit', 'latinLit'],
                     test="123",
                     value="value",
                     lang="eng",
@@ -288,7 +569,7 @@ class NemoTestRoutes(NemoResource):
                     })
                 patched.assert_called_once_with(
                     "index.html",
-                    collections={'latinLit', 'greekLit'},
+                    collections=['greekLit', 'latinLit'],
                     test="123",
                     value="value",
                     lang="eng",
@@ -307,6 +588,23 @@ class NemoTestRoutes(NemoResource):
                     texts=self.nemo.get_texts("latinLit", "phi1294")
                 )
 
+    def test_render_context_lazy(self):
+        """ Render context values are computed when read only, once per request
+        """
+        app = Flask(__name__)
+        with patch("requests.get", return_value=self.getCapabilities):
+            with app.test_request_context():
+                with patch.object(self.nemo, "get_textgroups", wraps=self.nemo.get_textgroups) as textgroups:
+                    with patch("flask_nemo.render_template") as patched:
+                        self.nemo.render("index.html", url={"collection": "latinLit", "textgroup": "phi1294"})
+                        self.nemo.render("index.html", url={"collection": "latinLit", "textgroup": "phi1294"})
+                        self.assertEqual(textgroups.call_count, 0, "Textgroups are not read by the render")
+
+                        kwargs = [kwargs for _, kwargs in patched.call_args_list]
+                        self.assertEqual(len(kwargs[0]["textgroups"]), 3)
+                        self.assertEqual(kwargs[0]["textgroups"], kwargs[1]["textgroups"])
+                        self.assertEqual(textgroups.call_count, 1, "Textgroups are computed once per request")
+
     def test_route(self):
         """ nemo.route should apply fn and the args given
         """
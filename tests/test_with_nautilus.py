@@ -3,11 +3,18 @@
 """
 
 
+import json
+import os
+import subprocess
+import sys
 from unittest import TestCase
 from .resources import NautilusDummy
 from flask_nemo import Nemo
 from flask_nemo.chunker import level_grouper
+from flask_nemo.cache import LRUCache
+from flask_nemo.plugin import PluginPrototype
 from flask import Flask, jsonify
+from mock import patch
 
 
 class NemoTestRoutes(TestCase):
@@ -230,3 +237,262 @@ class NemoTestRoutes(TestCase):
             '<li class="active">Martial</li>', query_data,
             "Breadcrumb should not be visible"
         )
+
+    def test_compact_inventory_pages(self):
+        """ Pages rendered with a compact inventory should be identical to the ones with MyCapytain objects
+        """
+        app = Flask("Nemo")
+        app.debug = True
+        nemo = Nemo(
+            app=app, base_url="", retriever=NautilusDummy, compact_inventory=True,
+            chunker={"default": lambda x, y: level_grouper(x, y, groupby=30)},
+            css=["./tests/test_data/empty.css", "//foo.bar/test.css", "http://bar.foo/test.css",
+                 "https://super.secure/mypasswordin.css"],
+            js=["./tests/test_data/empty.js", "//foo.bar/test.js", "http://bar.foo/test.js",
+                "https://super.secure/mypasswordin.js"],
+        )
+        client = app.test_client()
+        for url in [
+            "/", "/read/latinLit", "/read/latinLit/phi1294", "/read/latinLit/phi1294/phi002/perseus-lat2",
+            "/read/latinLit/phi1294/phi002/perseus-lat2/1.pr.1-1.pr.22"
+        ]:
+            self.assertEqual(
+                client.get(url).data, self.client.get(url).data,
+                "{} should be rendered the same way with a compact inventory".format(url)
+            )
+
+    def test_streamed_version_page(self):
+        """ Version pages of streamed routes should be sent while chunks are yielded, identical to rendered pages
+        """
+        yielded = []
+
+        def chunker(text, getreffs):
+            for reff in level_grouper(text, getreffs, groupby=30):
+                yielded.append(reff)
+                yield reff
+
+        app = Flask("Nemo")
+        app.debug = True
+        Nemo(
+            app=app, base_url="", retriever=NautilusDummy, chunker={"default": chunker}, stream=["r_version"],
+            css=["./tests/test_data/empty.css", "//foo.bar/test.css", "http://bar.foo/test.css",
+                 "https://super.secure/mypasswordin.css"],
+            js=["./tests/test_data/empty.js", "//foo.bar/test.js", "http://bar.foo/test.js",
+                "https://super.secure/mypasswordin.js"],
+        )
+        client = app.test_client()
+        response = client.get("/read/latinLit/phi1294/phi002/perseus-lat2")
+        self.assertEqual(yielded, [], "Chunks should not be consumed before the response is read")
+        self.assertEqual(response.data, self.client.get("/read/latinLit/phi1294/phi002/perseus-lat2").data)
+        self.assertEqual(len(yielded), 1533)
+
+    def test_lazy_version_page(self):
+        """ With toc_depth, version pages should only list the top levels and load passages below them on demand
+        """
+        app = Flask("Nemo")
+        app.debug = True
+        Nemo(
+            app=app, base_url="", retriever=NautilusDummy, toc_depth=1,
+            chunker={"default": lambda x, y: level_grouper(x, y, groupby=30)}
+        )
+        client = app.test_client()
+        page = client.get("/read/latinLit/phi1294/phi002/perseus-lat2").data.decode()
+        self.assertIn(
+            '<a href="/read/latinLit/phi1294/phi002/perseus-lat2/reffs/1" '
+            'data-fragment="/read/latinLit/phi1294/phi002/perseus-lat2/reffs/1?format=fragment">Book 1</a>', page
+        )
+        self.assertNotIn('/read/latinLit/phi1294/phi002/perseus-lat2/1.pr.1-1.pr.22', page)
+        self.assertLess(len(page), len(self.client.get("/read/latinLit/phi1294/phi002/perseus-lat2").data) / 10)
+
+        fragment = client.get("/read/latinLit/phi1294/phi002/perseus-lat2/reffs/1?format=fragment").data.decode()
+        self.assertIn('href="/read/latinLit/phi1294/phi002/perseus-lat2/1.pr.1-1.pr.22"', fragment)
+        self.assertNotIn('/read/latinLit/phi1294/phi002/perseus-lat2/2.', fragment)
+        self.assertNotIn("<html", fragment)
+        self.assertNotIn("Book 1", fragment, "Levels shown by the version page should not be repeated")
+
+        page = client.get("/read/latinLit/phi1294/phi002/perseus-lat2/reffs/1").data.decode()
+        self.assertIn("<html", page)
+        self.assertIn("Book 1", page)
+        self.assertIn('href="/read/latinLit/phi1294/phi002/perseus-lat2/1.pr.1-1.pr.22"', page)
+
+        data = json.loads(client.get("/read/latinLit/phi1294/phi002/perseus-lat2/reffs/1.pr?format=json").data.decode())
+        self.assertEqual(data["reference"], "1.pr")
+        self.assertEqual(data["reffs"], [["1.pr.1-1.pr.22", "1.pr.1-1.pr.22"]])
+        self.assertEqual(client.get("/read/latinLit/phi1294/phi002/perseus-lat2/reffs/99").status_code, 404)
+
+    def test_cached_version_page(self):
+        """ Version pages rendered from a cached hierarchy should be identical to the ones rendered from chunks
+        """
+        app = Flask("Nemo")
+        app.debug = True
+        Nemo(
+            app=app, base_url="", retriever=NautilusDummy, cache=LRUCache(),
+            chunker={"default": lambda x, y: level_grouper(x, y, groupby=30)},
+            css=["./tests/test_data/empty.css", "//foo.bar/test.css", "http://bar.foo/test.css",
+                 "https://super.secure/mypasswordin.css"],
+            js=["./tests/test_data/empty.js", "//foo.bar/test.js", "http://bar.foo/test.js",
+                "https://super.secure/mypasswordin.js"],
+        )
+        client = app.test_client()
+        for _ in range(2):
+            self.assertEqual(
+                client.get("/read/latinLit/phi1294/phi002/perseus-lat2").data,
+                self.client.get("/read/latinLit/phi1294/phi002/perseus-lat2").data
+            )
+
+    def test_cached_fragments(self):
+        """ Menu and inventory lists rendered from the fragment cache should be identical to the rendered ones
+        """
+        app = Flask("Nemo")
+        app.debug = True
+        nemo = Nemo(
+            app=app, base_url="", retriever=NautilusDummy, cache=LRUCache(),
+            chunker={"default": lambda x, y: level_grouper(x, y, groupby=30)},
+            css=["./tests/test_data/empty.css", "//foo.bar/test.css", "http://bar.foo/test.css",
+                 "https://super.secure/mypasswordin.css"],
+            js=["./tests/test_data/empty.js", "//foo.bar/test.js", "http://bar.foo/test.js",
+                "https://super.secure/mypasswordin.js"],
+        )
+        client = app.test_client()
+        urls = ["/", "/read/latinLit", "/read/latinLit/phi1294", "/read/latinLit/phi1294/phi002/perseus-lat2/1.pr"]
+        for url in urls:
+            self.assertEqual(client.get(url).data, self.client.get(url).data)
+
+        with patch.object(nemo, "get_textgroups", wraps=nemo.get_textgroups) as textgroups:
+            for url in urls:
+                self.assertEqual(client.get(url).data, self.client.get(url).data)
+            self.assertEqual(textgroups.call_count, 1, "Only the collection route should compute textgroups")
+        self.assertGreaterEqual(nemo.cache_stats()["fragments"]["hits"], 6)
+
+    def make_cached_pages_nemo(self, **kwargs):
+        app = Flask("Nemo")
+        app.debug = True
+        nemo = Nemo(
+            app=app, base_url="", retriever=NautilusDummy, cache=LRUCache(),
+            chunker={"default": lambda x, y: level_grouper(x, y, groupby=30)},
+            css=["./tests/test_data/empty.css", "//foo.bar/test.css", "http://bar.foo/test.css",
+                 "https://super.secure/mypasswordin.css"],
+            js=["./tests/test_data/empty.js", "//foo.bar/test.js", "http://bar.foo/test.js",
+                "https://super.secure/mypasswordin.js"],
+            page_cache={"r_passage": 0, "r_version": 60}, **kwargs
+        )
+        return nemo, app.test_client()
+
+    def test_cached_pages(self):
+        """ Cached pages should be served without running the route, until the inventory changes
+        """
+        nemo, client = self.make_cached_pages_nemo()
+        url = "/read/latinLit/phi1294/phi002/perseus-lat2/1.pr"
+        expected = self.client.get(url).data
+        self.assertEqual(client.get(url).data, expected)
+
+        with patch.object(nemo, "render", wraps=nemo.render) as render:
+            response = client.get(url)
+            self.assertEqual(response.data, expected)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(render.call_count, 0, "Cached page should not be rendered")
+            self.assertEqual(client.get(url + "?lang=ger").data, expected)
+            self.assertEqual(render.call_count, 1, "Query parameters are part of the key")
+
+            nemo.get_inventory_index().digest = "new inventory"
+            self.assertEqual(client.get(url).data, expected)
+            self.assertEqual(render.call_count, 2, "A new inventory should invalidate cached pages")
+        self.assertEqual(nemo.cache_stats()["pages"]["hits"], 1)
+
+        with patch.object(nemo, "render", wraps=nemo.render) as render:
+            client.get("/read/latinLit/phi1294")
+            client.get("/read/latinLit/phi1294")
+            self.assertEqual(render.call_count, 2, "Routes not listed in page_cache should not be cached")
+
+    def test_cached_pages_bypass(self):
+        """ Pages rendered with a non cacheable plugin should not be cached
+        """
+        class User(PluginPrototype):
+            HAS_AUGMENT_RENDER = True
+            CACHEABLE = False
+
+            def render(self, **kwargs):
+                return {}
+
+        nemo, client = self.make_cached_pages_nemo(plugins=[User()])
+        url = "/read/latinLit/phi1294/phi002/perseus-lat2/1.pr"
+        with patch.object(nemo, "render", wraps=nemo.render) as render:
+            self.assertEqual(client.get(url).data, client.get(url).data)
+            self.assertEqual(render.call_count, 2)
+        self.assertNotIn("pages", nemo.cache_stats())
+
+    def test_conditional_requests(self):
+        """ Responses should have an ETag and be answered with 304 when it is given back
+        """
+        response = self.client.get("/read/latinLit/phi1294")
+        etag = response.headers["ETag"]
+        self.assertNotIn("Cache-Control", response.headers)
+        self.assertFalse(etag.startswith("W/"), "ETag should be strong")
+
+        response = self.client.get("/read/latinLit/phi1294", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+        self.assertEqual(response.headers["ETag"], etag)
+
+        response = self.client.get("/read/latinLit/phi1294", headers={"If-None-Match": '"other"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["ETag"], etag)
+
+    def test_etag_hash_seed(self):
+        """ ETags should not depend on the hash seed, so that processes serving the same page agree on it
+        """
+        script = "from tests.test_with_nautilus import NemoTestRoutes\n" \
+                 "test = NemoTestRoutes()\n" \
+                 "test.setUp()\n" \
+                 "print(test.client.get('/read/latinLit').headers['ETag'])"
+        etags = set()
+        for seed in ["1", "2", "3"]:
+            env = dict(os.environ, PYTHONHASHSEED=seed)
+            etags.add(subprocess.check_output(
+                [sys.executable, "-c", script], env=env, stderr=subprocess.DEVNULL
+            ).splitlines()[-1])
+        self.assertEqual(len(etags), 1)
+
+    def test_conditional_cached_pages(self):
+        """ Conditional requests on cached pages should be answered without rendering
+        """
+        nemo, client = self.make_cached_pages_nemo(
+            cache_control={"r_passage": "public, max-age=3600", "r_texts": "no-cache"}
+        )
+        url = "/read/latinLit/phi1294/phi002/perseus-lat2/1.pr"
+        response = client.get(url)
+        etag, modified = response.headers["ETag"], response.headers["Last-Modified"]
+        self.assertEqual(response.headers["Cache-Control"], "public, max-age=3600")
+
+        with patch.object(nemo, "render", wraps=nemo.render) as render:
+            for headers in [{"If-None-Match": etag}, {"If-Modified-Since": modified}]:
+                for method in [client.get, client.head]:
+                    response = method(url, headers=headers)
+                    self.assertEqual(response.status_code, 304)
+                    self.assertEqual(response.data, b"")
+                    self.assertEqual(response.headers["ETag"], etag)
+                    self.assertEqual(response.headers["Cache-Control"], "public, max-age=3600")
+            self.assertEqual(render.call_count, 0, "Cached pages should not be rendered")
+
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data, self.client.get(url).data)
+            self.assertEqual(response.headers["Last-Modified"], modified)
+
+        self.assertEqual(client.get("/read/latinLit/phi1294").headers["Cache-Control"], "no-cache")
+
+    def test_cached_fragments_instances(self):
+        """ Instances sharing a cache should not share their fragments
+        """
+        app, cache = Flask("Nemo"), LRUCache()
+        app.debug = True
+        for name, base_url in [("a", "/a"), ("b", "/b")]:
+            Nemo(
+                name=name, app=app, base_url=base_url, retriever=NautilusDummy, cache=cache,
+                chunker={"default": lambda x, y: level_grouper(x, y, groupby=30)}
+            )
+        client = app.test_client()
+        self.assertIn('href="/a/read/latinLit"', client.get("/a/").data.decode())
+        menu = client.get("/b/").data.decode()
+        self.assertIn('href="/b/read/latinLit"', menu)
+        self.assertNotIn('href="/a/', menu)
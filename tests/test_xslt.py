@@ -0,0 +1,133 @@
+"""
+    Test for the compiled XSLT cache
+"""
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+from lxml import etree
+from mock import patch
+from flask_nemo.xslt import StylesheetCache, StylesheetPool, RawXML, tostring
+
+
+STRIP_SPACE = """<xsl:stylesheet xmlns:xsl="http://www.w3.org/1999/XSL/Transform" version="1.0">
+    <xsl:strip-space elements="*"/>
+    <xsl:template match="/"><out><xsl:copy-of select="."/></out></xsl:template>
+</xsl:stylesheet>"""
+
+
+class TestStylesheetCache(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "body.xsl")
+        shutil.copy("tests/test_data/xsl_test.xml", self.path)
+        self.cache = StylesheetCache()
+        self.body = etree.fromstring('<tei:body xmlns:tei="http://www.tei-c.org/ns/1.0" />')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_compiled_once(self):
+        """ Stylesheets should be compiled once and reused """
+        with patch("flask_nemo.xslt.etree.XSLT", side_effect=etree.XSLT) as compiled:
+            first = self.cache.get(self.path)
+            self.assertIs(self.cache.get(self.path), first)
+            self.assertEqual(compiled.call_count, 1)
+        for _ in range(3):
+            self.assertIn("notbody", str(first(self.body)))
+
+    def test_recompiled_when_modified(self):
+        """ Stylesheets should be recompiled when their file changes """
+        first = self.cache.get(self.path)
+        with open(self.path, "w") as f:
+            f.write(STRIP_SPACE)
+        os.utime(self.path, (first.mtime + 10, first.mtime + 10))
+        second = self.cache.get(self.path)
+        self.assertIsNot(second, first)
+        self.assertTrue(second.strip_space)
+        self.assertFalse(first.strip_space)
+
+    def test_per_thread(self):
+        """ Each thread should get its own compiled stylesheet """
+        stylesheets = [self.cache.get(self.path)]
+        thread = threading.Thread(target=lambda: stylesheets.append(self.cache.get(self.path)))
+        thread.start()
+        thread.join()
+        self.assertIsNot(stylesheets[0], stylesheets[1])
+        self.assertEqual(str(stylesheets[0](self.body)), str(stylesheets[1](self.body)))
+
+    def test_strip_space_keeps_input(self):
+        """ Stylesheets using xsl:strip-space should not modify the given tree """
+        with open(self.path, "w") as f:
+            f.write(STRIP_SPACE)
+        xml = etree.fromstring("<a> <b> x </b> <c/> </a>")
+        stylesheet = self.cache.get(self.path)
+        self.assertIn("<a><b> x </b><c/></a>", str(stylesheet(xml)))
+        self.assertEqual(etree.tostring(xml, encoding=str), "<a> <b> x </b> <c/> </a>")
+
+
+def slow_transform_in_worker(path, xml):
+    """ Transformation which does not complete in time """
+    import time
+    time.sleep(2)
+
+
+def failing_transform_in_worker(path, xml):
+    """ Transformation failing in the worker """
+    raise etree.XSLTApplyError("Stylesheet failed")
+
+
+class TestStylesheetPool(TestCase):
+
+    def setUp(self):
+        self.pool = StylesheetPool(["tests/test_data/xsl_test.xml"], processes=1, timeout=1)
+        self.body = etree.fromstring(
+            '<tei:TEI xmlns:tei="http://www.tei-c.org/ns/1.0"><tei:text><tei:body><tei:l>Hic</tei:l></tei:body>'
+            '</tei:text></tei:TEI>'
+        ).find(".//{http://www.tei-c.org/ns/1.0}body")
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_same_output(self):
+        """ Worker processes should give the output of the stylesheet applied in process """
+        expected = tostring(StylesheetCache().get("tests/test_data/xsl_test.xml")(self.body))
+        self.assertEqual(self.pool.transform("tests/test_data/xsl_test.xml", self.body), expected)
+        self.assertNotIsInstance(self.pool.transform("tests/test_data/xsl_test.xml", self.body), RawXML)
+
+    def test_start_method(self):
+        """ Workers should not be forked from the process serving requests """
+        self.assertIn(self.pool.start_method, ["forkserver", "spawn"])
+        self.assertEqual(StylesheetPool([], start_method="spawn").start_method, "spawn")
+        self.assertEqual(self.pool.pool._ctx.get_start_method(), self.pool.start_method)
+
+    def test_timeout(self):
+        """ Transformations which time out should give back the XML """
+        with patch("flask_nemo.xslt.transform_in_worker", slow_transform_in_worker):
+            output = self.pool.transform("tests/test_data/xsl_test.xml", self.body)
+        self.assertIsInstance(output, RawXML)
+        self.assertEqual(output, etree.tostring(self.body, encoding=str))
+
+    def test_timeout_replaces_pool(self):
+        """ Transformations should not wait behind a worker busy with a transformation which timed out """
+        with patch("flask_nemo.xslt.transform_in_worker", slow_transform_in_worker):
+            stuck = self.pool.pool
+            self.assertIsInstance(self.pool.transform("tests/test_data/xsl_test.xml", self.body), RawXML)
+        self.assertIsNot(self.pool.pool, stuck, "Pool with a busy worker should be replaced")
+        self.assertNotIsInstance(self.pool.transform("tests/test_data/xsl_test.xml", self.body), RawXML)
+        with patch.object(stuck, "terminate") as terminate:
+            self.pool.close()
+            self.assertTrue(terminate.called, "Retired pools should be terminated on close")
+        stuck.terminate()
+
+    def test_failure(self):
+        """ Transformations failing in the worker should give back the XML """
+        with patch("flask_nemo.xslt.transform_in_worker", failing_transform_in_worker):
+            with patch("flask_nemo.xslt.logging") as logging:
+                output = self.pool.transform("tests/test_data/xsl_test.xml", self.body)
+                self.assertTrue(logging.getLogger.return_value.warning.called)
+        self.assertIsInstance(output, RawXML)
+        self.assertEqual(output, etree.tostring(self.body, encoding=str))
+        self.assertNotIsInstance(self.pool.transform("tests/test_data/xsl_test.xml", self.body), RawXML)